@@ -0,0 +1,156 @@
+"""
+AWS clients and the HTTP session for downloads, created on first use and then kept for the life of the process
+
+A warm Lambda container reuses them, and the connections they hold open, across invocations. Endpoints can be
+pointed elsewhere, eg at local stand-ins for testing, with the config key 'aws_endpoints': {service: url}.
+boto3 is provided by the Lambda runtime, and is only needed if AWS clients are used.
+"""
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry  # type: ignore
+
+from utils import EXPORT_CHUNK_SIZE, get_config
+
+
+try:
+    import boto3  # type: ignore
+    from botocore.config import Config  # type: ignore
+except ImportError:
+    boto3 = None  # type: ignore
+
+DEFAULT_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+POOL_SIZE = 10
+DEFAULT_MAX_DOWNLOAD_BYTES = 100 * 1024 * 1024
+DEFAULT_DOWNLOAD_TIMEOUT_SECONDS = 60
+
+_lock = Lock()
+_clients = {}  # type: Dict[str, Any]
+_aws_session = None  # type: Any
+_http_session = None  # type: Optional[requests.Session]
+
+
+def aws_client(service: str) -> Any:
+    """
+    Get the shared boto3 client for an AWS service, creating it if need be
+
+    Args:
+        service: Service name, eg 's3', 'ses' or 'cloudfront'
+
+    Returns:
+        boto3 client
+    """
+    client = _clients.get(service)
+    if client is None:
+        global _aws_session  # pylint: disable=W0603
+        with _lock:  # boto3 sessions may not be used to create clients from several threads at once
+            if service not in _clients:
+                if boto3 is None:
+                    raise Exception('boto3 must be installed to use AWS services')
+                if _aws_session is None:
+                    _aws_session = boto3.session.Session()
+                _clients[service] = _aws_session.client(
+                    service,
+                    endpoint_url=(get_config('aws_endpoints') or {}).get(service),
+                    config=Config(
+                        retries={'max_attempts': get_config('http_retries', DEFAULT_RETRIES), 'mode': 'standard'},
+                        max_pool_connections=POOL_SIZE,
+                    ),
+                )
+            client = _clients[service]
+
+    return client
+
+
+def http_session() -> requests.Session:
+    """
+    Get the shared HTTP session, which pools connections and retries failed requests with a backoff
+
+    Connection errors and responses with a status in RETRY_STATUSES are retried up to the config value
+    'http_retries' times.
+
+    Returns:
+        requests.Session
+    """
+    global _http_session  # pylint: disable=W0603
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                retries = Retry(
+                    total=get_config('http_retries', DEFAULT_RETRIES),
+                    backoff_factor=RETRY_BACKOFF_SECONDS,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=['GET', 'HEAD'],
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retries)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _http_session = session
+
+    return _http_session
+
+
+def stream_download(url: str, max_bytes: int = None, timeout: float = None) -> Iterator[bytes]:
+    """
+    Download a file through the shared HTTP session as a series of byte chunks, failing fast if it's too big or slow
+
+    Limits default to the config values 'max_download_bytes' and 'download_timeout'. The size limit is checked
+    against the Content-Length header before reading, if there is one, and against the bytes read so far. The
+    timeout applies both to each wait for data and to the total time spent waiting, which excludes time taken by the
+    caller to process each chunk.
+
+    Args:
+        url: URL to download
+        max_bytes: Largest download allowed
+        timeout: Seconds allowed for the download
+
+    Returns:
+        Iterator of bytes chunks
+    """
+    if max_bytes is None:
+        max_bytes = get_config('max_download_bytes', DEFAULT_MAX_DOWNLOAD_BYTES)
+    if timeout is None:
+        timeout = get_config('download_timeout', DEFAULT_DOWNLOAD_TIMEOUT_SECONDS)
+
+    waited = 0.0
+    started = monotonic()
+    with http_session().get(url, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        if int(r.headers.get('Content-Length', 0)) > max_bytes:
+            raise Exception('Download is larger than the %d byte limit' % max_bytes)
+
+        received = 0
+        chunks = r.iter_content(EXPORT_CHUNK_SIZE)
+        while True:
+            chunk = next(chunks, None)
+            waited += monotonic() - started
+            if chunk is None:
+                break
+
+            received += len(chunk)
+            if received > max_bytes:
+                raise Exception('Download is larger than the %d byte limit' % max_bytes)
+            if waited > timeout:
+                raise Exception('Download took longer than %d seconds' % timeout)
+            yield chunk
+            started = monotonic()
+
+
+def reset_clients() -> None:
+    """
+    Discard all clients and the HTTP session, so that they are created afresh, eg after a change of config
+    """
+    global _aws_session, _http_session  # pylint: disable=W0603
+    with _lock:
+        _clients.clear()
+        _aws_session = None
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Time report building against synthetic exports, and compare results between runs. Run with --help for details
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from typing import Callable, Dict, List, Optional
+
+import imbibed
+from bot_version import version
+from checkin_table import CheckinTable
+from stock_check import build_html_from_list, build_stocklists
+from svg_calendar import draw_daily_count_image
+from synthetic_export import generate_checkins, generate_list_items
+from utils import filter_source_data
+from vectorized_summaries import np
+
+
+RESULTS_FORMAT_VERSION = 1
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_TOLERANCE = 0.1
+
+
+class Fixtures:
+    """
+    Synthetic data of one size, and the intermediate results each benchmark starts from
+    """
+
+    def __init__(self, size: int, seed: int):
+        self.size = size
+        self.checkins = generate_checkins(size, seed=seed)
+        self.list_items = generate_list_items(size, seed=seed)
+        self.table = CheckinTable.from_checkins(self.checkins)
+
+        # A recent month, as commonly reported on
+        last_month = self.checkins[-1]['created_at'][:7]
+        self.filters = ['created_at>' + last_month, 'venue_name~the']
+
+    def summaries(self) -> Dict[str, dict]:
+        """
+        Build all checkin summaries afresh, as the writers alter those they are given
+
+        Returns:
+            Map of report => summary
+        """
+        daily, weekly, styles, breweries = {}, {}, {}, {}  # type: dict, dict, dict, dict
+        imbibed.build_checkin_summaries(self.table, daily, weekly, styles, breweries)
+        return {'daily': daily, 'weekly': weekly, 'styles': styles, 'breweries': breweries}
+
+    def stocklist(self) -> list:
+        """
+        Build the stock list of the synthetic list export
+
+        Returns:
+            list of rows
+        """
+        stocklist = []  # type: list
+        build_stocklists(self.list_items, stocklist=stocklist)
+        return stocklist
+
+
+def summary_writer(report: str, writer: Callable) -> Callable:
+    """
+    Set up a benchmark of one of the imbibed.write_*_summary functions
+
+    Args:
+        report: Key of summary to write
+        writer: Function writing the summary as CSV
+
+    Returns:
+        Benchmark setup function
+    """
+    def setup(fixtures: Fixtures):
+        summary = fixtures.summaries()[report]
+        return lambda: writer(summary, StringIO())
+
+    return setup
+
+
+def daily_image(fixtures: Fixtures) -> Callable:
+    """
+    Set up a benchmark of drawing the daily units calendar
+
+    Args:
+        fixtures: Synthetic data
+
+    Returns:
+        Call to time
+    """
+    daily = fixtures.summaries()['daily']
+    daily_count = {day: daily[day]['units'] for day in daily if 'units' in daily[day]}
+    return lambda: draw_daily_count_image(daily_count, True, 'Daily units')
+
+
+# Each benchmark's setup builds its input from the fixtures, untimed, and returns the call to time
+BENCHMARKS = {
+    'CheckinTable.from_checkins': lambda f: lambda: CheckinTable.from_checkins(f.checkins),
+    'filter_source_data (list)': lambda f: lambda: filter_source_data(f.filters, f.checkins),
+    'filter_source_data (table)': lambda f: lambda: filter_source_data(f.filters, f.table),
+    'build_checkin_summaries': lambda f: lambda: imbibed.build_checkin_summaries(f.table, {}, {}, {}, {}),
+    'build_checkin_summaries (vectorized)':
+        lambda f: lambda: imbibed.build_checkin_summaries(f.table, {}, {}, {}, {}, vectorized=True),
+    'write_daily_summary': summary_writer('daily', imbibed.write_daily_summary),
+    'write_weekly_summary': summary_writer('weekly', imbibed.write_weekly_summary),
+    'write_styles_summary': summary_writer('styles', imbibed.write_styles_summary),
+    'write_breweries_summary': summary_writer('breweries', imbibed.write_breweries_summary),
+    'draw_daily_count_image': daily_image,
+    'build_stocklists': lambda f: lambda: build_stocklists(f.list_items, stocklist=[], style_summary=[]),
+    'build_html_from_list': lambda f: lambda: build_html_from_list(f.stocklist(), StringIO()),
+}  # type: Dict[str, Callable]
+
+
+def time_benchmark(setup: Callable, fixtures: Fixtures, repeat: int) -> float:
+    """
+    Time a benchmark, returning the best of several runs, each with freshly set-up input
+
+    Args:
+        setup: Function of fixtures, returning the call to time
+        fixtures: Synthetic data
+        repeat: Number of runs
+
+    Returns:
+        Best time in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        run = setup(fixtures)
+        with redirect_stdout(StringIO()):  # Some reports log as they go
+            started = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def run_benchmarks(sizes: List[int], names: List[str], repeat: int, seed: int) -> dict:
+    """
+    Run the selected benchmarks at each size
+
+    Args:
+        sizes: Numbers of checkins and list items
+        names: Keys of BENCHMARKS to run
+        repeat: Runs per timing
+        seed: Random seed for synthetic data
+
+    Returns:
+        Results, as saved to JSON
+    """
+    results = []
+    for size in sizes:
+        fixtures = Fixtures(size, seed)
+        for name in names:
+            seconds = time_benchmark(BENCHMARKS[name], fixtures, repeat)
+            results.append({'benchmark': name, 'size': size, 'seconds': seconds})
+            print('%-40s %9d %12.6f' % (name, size, seconds))
+
+    return {
+        'format': RESULTS_FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'version': version,
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float) -> int:
+    """
+    Print each benchmark's time relative to a previous run, flagging those slower by more than `tolerance`
+
+    Args:
+        baseline: Results of previous run
+        current: Results of this run
+        tolerance: Fraction by which a benchmark may be slower before it is counted as a regression
+
+    Returns:
+        Number of regressions
+    """
+    previous = {(r['benchmark'], r['size']): r['seconds'] for r in baseline['results']}
+    if baseline.get('machine') != current['machine']:
+        print('Warning: baseline was run on %s' % baseline.get('machine'))
+
+    regressions = 0
+    print('%-40s %9s %12s %12s %8s' % ('benchmark', 'size', 'before (s)', 'after (s)', 'ratio'))
+    for result in current['results']:
+        before = previous.get((result['benchmark'], result['size']))
+        if before is None:
+            continue
+        ratio = result['seconds'] / before if before else float('inf')
+        regressed = ratio > 1 + tolerance
+        regressions += regressed
+        print('%-40s %9d %12.6f %12.6f %7.2fx%s' % (
+            result['benchmark'], result['size'], before, result['seconds'], ratio, ' SLOWER' if regressed else ''
+        ))
+
+    return regressions
+
+
+def parse_cli_args() -> argparse.Namespace:
+    """
+    Specify and parse command-line arguments
+
+    Returns:
+        Namespace of provided arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Time report building on synthetic exports',
+        usage=sys.argv[0] + ' [--sizes N ...] [--benchmark NAME ...] [--repeat N] [--seed N]'
+                            ' [--output RESULTS] [--compare BASELINE] [--tolerance FRACTION] [--list] [--help]'
+    )
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Numbers of checkins and list items to generate (default %s)' % DEFAULT_SIZES)
+    parser.add_argument('--benchmark', nargs='+', metavar='NAME', help='Run only the named benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per timing, best is reported (default 3)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for synthetic data (default 1)')
+    parser.add_argument('--output', metavar='RESULTS', help='Save results as JSON to RESULTS')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare with results saved by an earlier run')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Slowdown allowed before a benchmark counts as a regression (default 0.1)')
+    parser.add_argument('--list', action='store_true', help='List benchmarks and exit')
+    args = parser.parse_args()
+    return args
+
+
+def run_cli():
+    """
+    Run the benchmarks at the command line. Exits with status 1 if any regressed against the baseline
+    """
+    args = parse_cli_args()
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        return
+
+    names = args.benchmark or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise Exception('Unknown benchmark: ' + ', '.join(unknown))
+    if np is None:
+        names = [name for name in names if 'vectorized' not in name]
+
+    baseline = None  # type: Optional[dict]
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(args.sizes, names, args.repeat, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None and compare_results(baseline, results, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run_cli()
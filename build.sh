@@ -2,7 +2,7 @@
 
 set -e
 
-SOURCE_FILES="lambda_function.py stock_check.py imbibed.py utils.py daily_visualisation.py measures.py svg_calendar"
+SOURCE_FILES="lambda_function.py aws_clients.py result_cache.py message_ledger.py coalescing.py stock_check.py imbibed.py utils.py daily_visualisation.py measures.py dates.py checkin_table.py filter_query.py sharded_summaries.py timings.py vectorized_summaries.py summary_state.py svg_calendar"
 AWSREGION="eu-west-1"
 LAMBDA_NAME="receiveBeerBotMail"
 
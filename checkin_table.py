@@ -0,0 +1,349 @@
+"""
+Columnar in-memory store of checkins, converted once from an Untappd export and shared by all reports
+"""
+from array import array
+from datetime import datetime
+from itertools import chain
+from math import nan
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Sequence,
+                    Tuple)
+
+from dates import parse_date
+from measures import MeasureProcessor, Region
+
+
+# Source keys kept by default: those used by the reports, plus those most commonly filtered on
+REPORT_COLUMNS = (
+    'beer_name',
+    'beer_type',
+    'brewery_name',
+    'brewery_country',
+    'venue_name',
+    'venue_country',
+    'serving_type',
+    'created_at',
+)
+
+ESTIMATE_NONE = 0
+ESTIMATE_SERVING = 1  # Measure guessed from serving type
+ESTIMATE_MISSING = 2  # No measure could be found
+ESTIMATE_FLAGS = ('', '*', '**')
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def guess_region(checkins: Sequence[dict]) -> str:
+    """
+    Guess the region to start reading measures with, before any checkin has set it
+
+    Args:
+        checkins: Checkins, oldest first. Only those up to the first with a venue country are needed
+
+    Returns:
+        Region
+    """
+    # Try and guess a default country for this user
+    # First, by checkin
+    # Else, by manufacturer (not really reliable, but only used if no located checkins)
+    first_country = next((c['venue_country'] for c in checkins if c['venue_country']), None)
+    if not first_country:
+        first_country = next((c['brewery_country'] for c in checkins if c['brewery_country']), None)
+
+    return Region.USA if first_country == 'United States' else Region.EUROPE
+
+
+def checkin_regions(checkin: dict, current_region: str) -> Tuple[str, str]:
+    """
+    Find the region to read a checkin's measure with, and the region in effect for following checkins
+
+    Args:
+        checkin: Checkin from export
+        current_region: Region inferred from the location of previous checkins
+
+    Returns:
+        Region for this checkin, region inferred after this checkin
+    """
+    # If bottle or can, set parser region by manufacturer
+    if checkin['serving_type'] and checkin['serving_type'] in ['Can', 'Bottle'] and checkin['brewery_country']:
+        if checkin['brewery_country'] == 'United States':
+            checkin_region = Region.USA
+        else:
+            checkin_region = Region.EUROPE
+
+    else:  # Otherwise, base it on location if available
+        if checkin['venue_country']:
+            if checkin['venue_country'] == 'United States':
+                current_region = Region.USA
+            else:
+                current_region = Region.EUROPE
+
+        checkin_region = current_region
+
+    return checkin_region, current_region
+
+
+def region_after(checkins: Iterable[dict], current_region: str) -> str:
+    """
+    Find the region in effect after a run of checkins, without resolving their measures
+
+    Args:
+        checkins: Checkins, oldest first
+        current_region: Region in effect before the first of them
+
+    Returns:
+        Region
+    """
+    for checkin in checkins:
+        _, current_region = checkin_regions(checkin, current_region)
+    return current_region
+
+
+class EncodedColumn:
+    """
+    Dictionary-encoded column: each distinct value is stored once, and each row holds an integer code
+    """
+
+    def __init__(self, values: List[Any] = None, codes: array = None):
+        self.values = values if values is not None else []  # type: List[Any]
+        self.codes = codes if codes is not None else array('l')
+        self.lookup = None  # type: Optional[Dict[Any, int]]
+
+    def append(self, value: Any) -> None:
+        """
+        Add a row value, encoding it
+
+        Args:
+            value: Value from source row
+        """
+        if self.lookup is None:
+            self.values = list(self.values)  # May be shared with the column this was taken from
+            self.lookup = {v: k for k, v in enumerate(self.values)}
+
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.values)
+            self.lookup[value] = code
+            self.values.append(value)
+        self.codes.append(code)
+
+    def finish(self) -> None:
+        """
+        Drop the value lookup used while building, which is no longer needed once the column is complete
+        """
+        self.lookup = None
+
+    def take(self, rows: Iterable[int]) -> 'EncodedColumn':
+        """
+        Build a column from a subset of rows, sharing the value dictionary
+
+        Args:
+            rows: Row indexes to keep, in order
+
+        Returns:
+            EncodedColumn
+        """
+        codes = self.codes
+        return EncodedColumn(self.values, array('l', (codes[row] for row in rows)))
+
+    def slice(self, start: int, end: int) -> 'EncodedColumn':
+        """
+        Build a column from a contiguous range of rows, sharing the value dictionary
+
+        Args:
+            start: First row to keep
+            end: Row after the last to keep
+
+        Returns:
+            EncodedColumn
+        """
+        return EncodedColumn(self.values, self.codes[start:end])
+
+    def __getitem__(self, row: int) -> Any:
+        return self.values[self.codes[row]]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __iter__(self) -> Iterator:
+        values = self.values
+        return (values[code] for code in self.codes)
+
+
+class CheckinTable:
+    """
+    Checkins stored as typed columns rather than a dict per row
+
+    Numeric columns are arrays:
+        abv: float ABV
+        rating: float rating score, NaN if unrated
+        day: date ordinal of the checkin
+        timestamp: seconds since 1970-01-01 of the checkin's (local) time
+        measure_ml: int measure from the comment or serving type, 0 if not known
+        estimated: ESTIMATE_* flag describing how measure_ml was found
+
+    String columns (`REPORT_COLUMNS` plus any extra columns requested) are dictionary-encoded.
+    """
+    NUMERIC_COLUMNS = {'abv': 'd', 'rating': 'd', 'day': 'l', 'timestamp': 'd', 'measure_ml': 'l', 'estimated': 'b'}
+
+    def __init__(self, string_columns: Sequence[str] = REPORT_COLUMNS):
+        self.abv = array('d')
+        self.rating = array('d')
+        self.day = array('l')
+        self.timestamp = array('d')
+        self.measure_ml = array('l')
+        self.estimated = array('b')
+        self.strings = {key: EncodedColumn() for key in string_columns}  # type: Dict[str, EncodedColumn]
+        self.last_region = None  # type: Optional[str]
+        # Secondary indexes by key, built by filter_query on demand
+        self.indexes = {}  # type: Dict[str, Any]
+
+    @classmethod
+    def from_checkins(
+            cls,
+            source_data: Iterable[dict],
+            extra_columns: Iterable[str] = (),
+            initial_region: str = None
+    ) -> 'CheckinTable':
+        """
+        Convert checkins from an export into a table
+
+        Measures are resolved here, as the region used to interpret them depends on the order of checkins.
+        Checkins to leave out of reports must be filtered out beforehand, so that they don't set the region.
+        The region after the last checkin is kept as `last_region`, to continue from with later checkins.
+
+        Args:
+            source_data: Data unpacked from JSON source, as a list or an iterator of checkins
+            extra_columns: Source keys to keep in addition to REPORT_COLUMNS, eg for filtering
+            initial_region: Region in effect before the first checkin, if known; otherwise guessed from the data
+
+        Returns:
+            CheckinTable
+        """
+        string_columns = list(REPORT_COLUMNS) + [k for k in extra_columns if k not in REPORT_COLUMNS]
+        table = cls(string_columns)
+
+        if initial_region is not None:
+            for checkin in source_data:
+                initial_region = table.append(checkin, initial_region)
+            table.finish(initial_region)
+            return table
+
+        # Only read ahead as far as the first located checkin, so that streamed source data needn't all be held
+        source_iterator = iter(source_data)
+        lookahead = []
+        for checkin in source_iterator:
+            lookahead.append(checkin)
+            if checkin['venue_country']:
+                break
+
+        current_region = guess_region(lookahead)
+
+        for checkin in chain(lookahead, source_iterator):
+            current_region = table.append(checkin, current_region)
+
+        table.finish(current_region)
+        return table
+
+    def finish(self, last_region: str) -> None:
+        """
+        Complete the table once all checkins have been added
+
+        Args:
+            last_region: Region inferred after the last checkin
+        """
+        self.last_region = last_region
+        for column in self.strings.values():
+            column.finish()
+
+    def append(self, checkin: dict, current_region: str) -> str:
+        """
+        Add a checkin to the table
+
+        Args:
+            checkin: Checkin from export
+            current_region: Region inferred from the location of previous checkins
+
+        Returns:
+            Region inferred after this checkin
+        """
+        created_at = parse_date(checkin['created_at'])
+        self.abv.append(float(checkin['beer_abv']))
+        self.rating.append(float(checkin['rating_score']) if checkin['rating_score'] else nan)
+        self.day.append(created_at.toordinal())
+        self.timestamp.append((created_at.replace(tzinfo=None) - EPOCH).total_seconds())
+
+        checkin_region, current_region = checkin_regions(checkin, current_region)
+
+        processor = MeasureProcessor.for_region(checkin_region)
+
+        estimated = ESTIMATE_NONE
+        measure = processor.measure_from_comment(checkin['comment'])
+        if measure is None:
+            measure = processor.measure_from_serving(checkin['serving_type'])
+            estimated = ESTIMATE_SERVING
+
+        if not measure:
+            measure = 0
+            estimated = ESTIMATE_MISSING
+
+        self.measure_ml.append(measure)
+        self.estimated.append(estimated)
+
+        for key, column in self.strings.items():
+            column.append(checkin.get(key))
+
+        return current_region
+
+    def column(self, key: str) -> EncodedColumn:
+        """
+        Get a string column by its source key
+
+        Args:
+            key: Key in the source JSON
+
+        Returns:
+            EncodedColumn
+        """
+        if key not in self.strings:
+            raise Exception('Column "%s" was not loaded from the export' % key)
+        return self.strings[key]
+
+    def take(self, rows: Iterable[int]) -> 'CheckinTable':
+        """
+        Build a table from a subset of rows, in the order given
+
+        Args:
+            rows: Row indexes to keep
+
+        Returns:
+            CheckinTable
+        """
+        rows = list(rows)
+        subset = CheckinTable(list(self.strings.keys()))
+        for name, type_code in self.NUMERIC_COLUMNS.items():
+            source = getattr(self, name)
+            setattr(subset, name, array(type_code, (source[row] for row in rows)))
+        subset.strings = {key: column.take(rows) for key, column in self.strings.items()}
+        subset.last_region = self.last_region
+        return subset
+
+    def slice(self, start: int, end: int) -> 'CheckinTable':
+        """
+        Build a table from a contiguous range of rows, copying whole array slices rather than row by row
+
+        Args:
+            start: First row to keep
+            end: Row after the last to keep
+
+        Returns:
+            CheckinTable
+        """
+        subset = CheckinTable(list(self.strings.keys()))
+        for name in self.NUMERIC_COLUMNS:
+            setattr(subset, name, getattr(self, name)[start:end])
+        subset.strings = {key: column.slice(start, end) for key, column in self.strings.items()}
+        subset.last_region = self.last_region
+        return subset
+
+    def __len__(self) -> int:
+        return len(self.day)
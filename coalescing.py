@@ -0,0 +1,209 @@
+"""
+Coalescing of list exports that one sender submits in quick succession, so that only the newest is processed
+
+Each list export is registered under its sender and list name, with the time SES received it. Before uploading, a
+submission waits until the coalescing window after its arrival has passed, then checks whether a newer submission
+has since been registered; if one has, it is superseded and only the newer one is uploaded. The newest submission per
+sender & list is kept either in this process, eg for command-line use and tests, or as an object in an S3 bucket,
+shared by every instance of the Lambda function.
+"""
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime
+from hashlib import sha256
+from threading import Lock
+from time import sleep, time
+from typing import Dict, Optional, Tuple
+
+from aws_clients import aws_client
+from utils import get_config
+
+
+DEFAULT_WINDOW_SECONDS = 30
+LOCAL_RETENTION_SECONDS = 60 * 60
+
+_local_store = None  # type: Optional[LocalSubmissionStore]
+
+
+class SubmissionStore(ABC):
+    """
+    Store of the newest submission under each key
+    """
+
+    @abstractmethod
+    def offer(self, key: str, message_id: str, received_at: float) -> None:
+        """
+        Store a submission under a key, unless a newer one is already stored there
+        """
+
+    @abstractmethod
+    def newest(self, key: str) -> Optional[str]:
+        """
+        Get the message ID of the newest submission stored under a key, if any
+        """
+
+
+class LocalSubmissionStore(SubmissionStore):
+    """
+    Submission store held in this process, so only coalescing submissions handled by the same process
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.submissions = {}  # type: Dict[str, Tuple[float, str]]
+
+    def offer(self, key: str, message_id: str, received_at: float) -> None:
+        with self.lock:
+            expired_before = time() - LOCAL_RETENTION_SECONDS
+            self.submissions = {k: v for k, v in self.submissions.items() if v[0] >= expired_before}
+            if key not in self.submissions or self.submissions[key] < (received_at, message_id):
+                self.submissions[key] = (received_at, message_id)
+
+    def newest(self, key: str) -> Optional[str]:
+        with self.lock:
+            return self.submissions[key][1] if key in self.submissions else None
+
+
+class S3SubmissionStore(SubmissionStore):
+    """
+    Submission store of one small JSON object per key under a prefix of an S3 bucket
+
+    Offers read and then write the object, so two arriving at the same moment may both be stored, the later write
+    winning. At worst, that leaves an older export processed as well as or instead of a newer one, as happens without
+    coalescing. Objects should be removed by an S3 lifecycle rule on the prefix.
+    """
+
+    def __init__(self, bucket: str, prefix: str = ''):
+        self.client = aws_client('s3')
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def read(self, key: str) -> Optional[dict]:
+        """
+        Read the submission stored under a key
+
+        Args:
+            key: Submission key
+
+        Returns:
+            dict of 'message_id' and 'received_at', or None
+        """
+        try:
+            return json.loads(self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read())
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def offer(self, key: str, message_id: str, received_at: float) -> None:
+        stored = self.read(key)
+        if stored is None or (stored['received_at'], stored['message_id']) < (received_at, message_id):
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=self.prefix + key,
+                Body=json.dumps({'message_id': message_id, 'received_at': received_at}).encode('utf-8'),
+                ContentType='application/json',
+            )
+
+    def newest(self, key: str) -> Optional[str]:
+        stored = self.read(key)
+        return stored['message_id'] if stored else None
+
+
+class Submission:
+    """
+    A list export registered for coalescing
+    """
+
+    def __init__(self, store: SubmissionStore, key: str, message_id: str, received_at: float, window_seconds: float):
+        self.store = store
+        self.key = key
+        self.message_id = message_id
+        self.received_at = received_at
+        self.window_seconds = window_seconds
+
+    def superseded(self, max_wait: float = None) -> bool:
+        """
+        Check whether a newer submission has been registered, first waiting for the window after this one's arrival
+
+        Args:
+            max_wait: Most seconds to wait; None to wait out the window, 0 to check at once
+
+        Returns:
+            bool
+        """
+        wait = self.received_at + self.window_seconds - time()
+        if max_wait is not None:
+            wait = min(wait, max_wait)
+        if wait > 0:
+            sleep(wait)
+
+        return self.store.newest(self.key) not in (None, self.message_id)
+
+
+class Coalescer:
+    """
+    Registers list exports, so that those followed within the window by another from the same sender & list can be
+    skipped
+    """
+
+    def __init__(self, store: SubmissionStore, window_seconds: float = DEFAULT_WINDOW_SECONDS):
+        self.store = store
+        self.window_seconds = window_seconds
+
+    def submit(self, sender: str, list_name: Optional[str], message_id: str, received_at: float = None) -> Submission:
+        """
+        Register a list export
+
+        Args:
+            sender: Address the export was submitted from
+            list_name: Name of the list, if given
+            message_id: SES messageId
+            received_at: Timestamp at which the message was received; defaults to now
+
+        Returns:
+            Submission
+        """
+        key = sha256(json.dumps([sender.lower(), list_name]).encode('utf-8')).hexdigest()
+        if received_at is None:
+            received_at = time()
+        self.store.offer(key, message_id, received_at)
+        return Submission(self.store, key, message_id, received_at, self.window_seconds)
+
+
+def coalescer_from_config() -> Optional[Coalescer]:
+    """
+    Create the coalescer set by the config key 'coalesce_lists', if any
+
+    This is a dict of optional 'window_seconds' and, to share submissions between Lambda instances through S3,
+    'bucket' and optionally 'prefix'. Without a bucket, submissions are kept in this process.
+
+    Returns:
+        Coalescer or None
+    """
+    global _local_store  # pylint: disable=W0603
+    settings = get_config('coalesce_lists')
+    if not settings:
+        return None
+
+    if 'bucket' in settings:
+        store = S3SubmissionStore(settings['bucket'], settings.get('prefix', ''))  # type: SubmissionStore
+    else:
+        if _local_store is None:
+            _local_store = LocalSubmissionStore()
+        store = _local_store
+
+    return Coalescer(store, settings.get('window_seconds', DEFAULT_WINDOW_SECONDS))
+
+
+def parse_ses_timestamp(timestamp: Optional[str]) -> Optional[float]:
+    """
+    Convert the timestamp at which SES received a message, eg '2021-03-04T05:06:07.890Z', to a Unix timestamp
+
+    Args:
+        timestamp: ISO 8601 timestamp, if given
+
+    Returns:
+        float, or None if not given
+    """
+    if not timestamp:
+        return None
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp()
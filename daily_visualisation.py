@@ -3,13 +3,22 @@
 Generate a visualisation grid of daily consumption data. Run with --help for details
 """
 import argparse
-import json
+import logging
+import os
 import sys
 from math import floor
+from typing import Dict, Iterable
 
+import timings
+from checkin_table import CheckinTable
 from imbibed import build_checkin_summaries
-from svg_calendar import draw_daily_count_image
-from utils import file_contents, filter_source_data
+from svg_calendar import draw_daily_count_images
+from svg_calendar.canvas import Canvas
+from svg_calendar.daily_grid import DEFAULT_PALETTE_STEPS
+from utils import iter_export_items, iter_filtered_items
+
+
+MEASURES = ('units', 'drinks', 'average')
 
 
 def run_cli():
@@ -18,37 +27,68 @@ def run_cli():
     Returns:
         void
     """
+    # pylint: disable=R0912,R0915
     args = parse_cli_args()
+    if args.all_measures and not args.output:
+        raise Exception('--all-measures needs --output, to name the file for each measure')
     source = args.source
     dest = args.output
-    source_data = json.loads(file_contents(source))
     show_legend = args.legend
-
     filter_strings = args.filter
-    if filter_strings:
-        source_data = filter_source_data(filter_strings, source_data)
-        if not source_data:
+
+    if args.profile or args.profile_memory:
+        timings.start_profile(trace_memory=args.profile_memory)
+
+    source_items = timings.iterate('decode', iter_export_items(source), count_name='checkins')
+    if args.state:
+        from summary_state import SummaryState  # Only loaded when needed
+        state = SummaryState.load(args.state, filter_strings)
+        with timings.span('update'):
+            state.update(source_items)
+        state.save(args.state)
+        daily_summary = state.daily
+        if not daily_summary:
+            raise Exception('No data to analyse')
+    else:
+        if filter_strings:
+            source_items = iter_filtered_items(filter_strings, source_items)
+        with timings.span('load'):
+            source_data = CheckinTable.from_checkins(source_items)
+
+        if filter_strings and not source_data:
             raise Exception('Your filter left no data to analyse')
 
-    daily_summary = {}
-    build_checkin_summaries(source_data, daily_summary)
+        daily_summary = {}
+        with timings.span('aggregate'):
+            build_checkin_summaries(source_data, daily_summary)
 
-    if args.drinks:
-        measure = 'drinks'
+    if args.all_measures:
+        measures = MEASURES
+    elif args.drinks:
+        measures = ('drinks',)
     elif args.average:
-        measure = 'average'
+        measures = ('average',)
     else:
-        measure = 'units'
+        measures = ('units',)
 
-    image = build_daily_visualisation_image(daily_summary, measure, show_legend)
+    with timings.span('render svg'):
+        images = build_daily_visualisation_images(daily_summary, measures, show_legend, args.compact)
+    if not images:
+        raise Exception('No days have a value to visualise for ' + ', '.join(measures))
 
-    if dest:
-        image.saveas(dest, pretty=True)
-    else:
-        image.write(sys.stdout, pretty=True)
+    with timings.span('write svg'):
+        for measure, image in images.items():
+            if dest:
+                image.saveas(measure_output_path(dest, measure) if args.all_measures else dest, pretty=True)
+            else:
+                image.write(sys.stdout, pretty=True)
 
+    profile = timings.stop_profile()
+    if profile:
+        print(profile.report(), file=sys.stderr)
 
-def build_daily_visualisation_image(daily_summary: dict, measure: str, show_legend: bool):
+
+def build_daily_visualisation_image(daily_summary: dict, measure: str, show_legend: bool, compact: bool = False):
     """
     Build a github-style calendar view of the given measuer
 
@@ -56,16 +96,64 @@ def build_daily_visualisation_image(daily_summary: dict, measure: str, show_lege
         daily_summary:
         measure:
         show_legend:
+        compact: Whether to shade days from a palette and write the smallest equivalent SVG
 
     Returns:
 
     """
-    daily_count = {d: daily_summary[d][measure] for d in daily_summary if measure in daily_summary[d]}
-    if measure == 'average':
-        range_min = floor(min([daily_summary[d][measure] for d in daily_summary if measure in daily_summary[d]]))
-    else:
-        range_min = 0
-    return draw_daily_count_image(daily_count, show_legend, f'Daily {measure}', range_min)
+    images = build_daily_visualisation_images(daily_summary, [measure], show_legend, compact)
+    if measure not in images:
+        raise Exception(f'No days have a {measure} value to visualise')
+    return images[measure]
+
+
+def build_daily_visualisation_images(daily_summary: dict, measures: Iterable[str], show_legend: bool,
+                                     compact: bool = False) -> Dict[str, Canvas]:
+    """
+    Build a github-style calendar view of each of the given measures, laying out the days once for all of them
+
+    Measures that no day has a value for, eg average when no checkins are rated, are skipped with a warning.
+
+    Args:
+        daily_summary: Map of date string => map of measure => value
+        measures: Measures to draw, from MEASURES
+        show_legend: Whether to add a key to each calendar
+        compact: Whether to shade days from a palette and write the smallest equivalent SVG
+
+    Returns:
+        Map of measure => Canvas, of those drawn
+    """
+    daily_counts = {}
+    for measure in measures:
+        daily_count = {d: daily_summary[d][measure] for d in daily_summary if measure in daily_summary[d]}
+        if daily_count:
+            daily_counts[measure] = daily_count
+        else:
+            logging.getLogger(__name__).warning('Skipping %s calendar: no days have a value', measure)
+    range_mins = {
+        measure: floor(min(daily_count.values())) if measure == 'average' else 0
+        for measure, daily_count in daily_counts.items()
+    }
+    return draw_daily_count_images(
+        daily_counts, show_legend, {measure: f'Daily {measure}' for measure in daily_counts}, range_mins,
+        palette_steps=DEFAULT_PALETTE_STEPS if compact else None,
+        compact=compact
+    )
+
+
+def measure_output_path(path: str, measure: str) -> str:
+    """
+    Name the output file of one of several measures, eg 'calendar.svg' => 'calendar-units.svg'
+
+    Args:
+        path: Output path given
+        measure: Measure drawn
+
+    Returns:
+        str
+    """
+    base, extension = os.path.splitext(path)
+    return '%s-%s%s' % (base, measure, extension)
 
 
 def parse_cli_args():
@@ -77,24 +165,40 @@ def parse_cli_args():
     """
     parser = argparse.ArgumentParser(
         description='Visualise consumption of alcoholic drinks from an Untappd JSON export file',
-        usage=sys.argv[0] + ' SOURCE [--output OUTPUT] [--drinks|--units] [--legend] [--filter=…] [--help]',
+        usage=sys.argv[0] + ' SOURCE [--output OUTPUT] [--drinks|--units|--average|--all-measures] [--legend]'
+                            ' [--filter=…] [--state STATE_FILE] [--compact] [--profile|--profile-memory] [--help]',
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog=('Filter is based on JSON input keys.\nExample usages:\n'
                 '    "--filter=venue_name=The Red Lion"\n    "--filter=created_at>2017-10-01"'
                 )
     )
     parser.add_argument('source', help='Path to source file (export.json)')
-    parser.add_argument('--output', required=False, help='Path to output file, STDOUT if not specified')
+    parser.add_argument('--output', required=False,
+                        help='Path to output file, STDOUT if not specified; gzipped if it ends .svgz')
     parser.add_argument('--legend', required=False, help='Add a legend to image', action='store_true')
     group = parser.add_mutually_exclusive_group(required=False)
     group.add_argument('--units', help='Show number of units (default)', action='store_true')
     group.add_argument('--drinks', help='Show number of drinks', action='store_true')
     group.add_argument('--average', help='Show average score)', action='store_true')
+    group.add_argument('--all-measures',
+                       help='Show each of units, drinks & average score, written to OUTPUT with the measure appended'
+                            ' to its name, eg calendar-units.svg',
+                       action='store_true')
 
     parser.add_argument('--filter',
                         metavar='RULE',
                         help='Filter input list by rule',
                         action='append')
+    parser.add_argument('--state',
+                        metavar='STATE_FILE',
+                        help='Save summaries to this file, and on later runs only process checkins newer than those')
+    parser.add_argument('--compact',
+                        help='Shade days from a palette and write the smallest equivalent SVG',
+                        action='store_true')
+    parser.add_argument('--profile', help='Print time taken by each stage to STDERR', action='store_true')
+    parser.add_argument('--profile-memory',
+                        help='As --profile, also tracing peak & retained memory of each stage (slow)',
+                        action='store_true')
 
     args = parser.parse_args()
     return args
@@ -0,0 +1,57 @@
+"""
+Date parsing for Untappd export fields, avoiding dateutil's generic parser for the formats we know about
+"""
+from datetime import datetime
+from functools import lru_cache
+
+
+DATE_CACHE_SIZE = 8192
+ISO_DATE_LENGTH = len('2018-09-28')
+ISO_DATETIME_LENGTH = len('2018-09-28 19:14:33')
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(date_string: str) -> datetime:
+    """
+    Parse a date or datetime string, as dateutil.parser.parse would
+
+    Untappd `created_at` values ("2018-09-28 19:14:33") and ISO dates ("2018-09-28") are read directly;
+    anything else is passed to dateutil. Results are memoised, as daily keys in particular are parsed repeatedly.
+
+    Args:
+        date_string: Date as found in export or summary data
+
+    Returns:
+        datetime (at midnight if no time was given)
+    """
+    if is_fixed_format(date_string):
+        try:
+            return datetime.fromisoformat(date_string)
+        except ValueError:
+            pass  # Right shape but not a valid date: let dateutil decide
+
+    # Slow to import, and rarely needed
+    from dateutil.parser import parse as parse_any_date
+    return parse_any_date(date_string)
+
+
+def is_fixed_format(date_string: str) -> bool:
+    """
+    Check whether a string has the shape of an ISO date or Untappd `created_at` datetime
+
+    Args:
+        date_string:
+
+    Returns:
+        bool
+    """
+    length = len(date_string)
+    if length not in (ISO_DATE_LENGTH, ISO_DATETIME_LENGTH):
+        return False
+
+    if date_string[4] != '-' or date_string[7] != '-' or not date_string[0:4].isdigit():
+        return False
+
+    return length == ISO_DATE_LENGTH or (
+        date_string[10] == ' ' and date_string[13] == ':' and date_string[16] == ':'
+    )
@@ -0,0 +1,411 @@
+"""
+Compiled filter rules for export data, using secondary indexes on a CheckinTable where they help
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional,
+                    Sequence, Tuple, cast)
+
+from checkin_table import CheckinTable, EncodedColumn
+
+
+# Keys commonly filtered by equality or prefix, which get an index when filtering a CheckinTable
+INDEXED_COLUMNS = ('venue_name', 'venue_country', 'brewery_name', 'created_at')
+
+# Keys whose values normally increase through an export, so that '<' and '>' rules select a contiguous run of rows
+RANGE_COLUMNS = ('created_at',)
+
+# Rough order of how few rows each comparator tends to leave, most selective first
+SELECTIVITY_RANK = {'=': 0, '~': 1, '<': 2, '>': 2, '?': 3, '^': 5}
+EMPTY_SELECTIVITY_RANK = 4
+
+HIGHEST_CHARACTER = '\U0010ffff'
+
+
+class FilterRule:
+    """
+    A single filter rule, compiled to a test of one value with its constant already lower-cased
+    """
+
+    def __init__(self, key: str, comparator: str, value: str, verbose: bool = False):
+        self.key = key
+        self.comparator = comparator
+        self.value = value
+        self.constant = value.lower()
+
+        if comparator == '=' and value == '':
+            self.rank = EMPTY_SELECTIVITY_RANK
+        elif comparator in SELECTIVITY_RANK:
+            self.rank = SELECTIVITY_RANK[comparator]
+        else:
+            raise Exception('Bad rule comparator ' + comparator)
+
+        self.test_value = self.compile(verbose)
+
+    def compile(self, verbose: bool) -> Callable[[Optional[str]], bool]:
+        """
+        Build the test function for this rule
+
+        Args:
+            verbose: Emit debug for each test if true
+
+        Returns:
+            Function of a row's value, returning whether the row passes
+        """
+        constant = self.constant
+        if self.comparator == '=' and constant == '':
+            def test(value):
+                return value is None or value == ''
+        elif self.comparator == '=':
+            def test(value):
+                return value is not None and value.lower() == constant
+        elif self.comparator == '>':
+            def test(value):
+                return value is not None and value.lower() > constant
+        elif self.comparator == '<':
+            def test(value):
+                return value is not None and value.lower() < constant
+        elif self.comparator == '~':
+            def test(value):
+                return value is not None and value.lower().startswith(constant)
+        elif self.comparator == '?':
+            def test(value):
+                return constant in value.lower() if value else False
+        else:  # '^'
+            def test(value):
+                return value is None or value.lower() != constant
+
+        if not verbose:
+            return test
+
+        def verbose_test(value):
+            result = test(value)
+            print('Check [%s] (%s) %s %s: %s' % (self.key, value, self.comparator, self.value, repr(result)))
+            return result
+
+        return verbose_test
+
+    def test_row(self, row: dict) -> bool:
+        """
+        Test a row of export data
+
+        Args:
+            row: Row from source JSON
+
+        Returns:
+            bool
+        """
+        if self.comparator == '?' and self.key not in row:
+            return False
+        return self.test_value(row[self.key])
+
+    def is_indexable(self) -> bool:
+        """
+        Whether the rule can be answered from a column index
+
+        Returns:
+            bool
+        """
+        return self.key in INDEXED_COLUMNS and self.comparator in ('=', '~') and self.constant != ''
+
+    def is_range(self) -> bool:
+        """
+        Whether the rule selects a range of values that may be found by bisecting an ordered column
+
+        Returns:
+            bool
+        """
+        return self.key in RANGE_COLUMNS and self.comparator in ('<', '>')
+
+
+class ColumnIndex:
+    """
+    Secondary index on a dictionary-encoded column
+
+    Distinct lower-cased values are kept sorted, for equality and prefix lookups by bisection, and row numbers are
+    grouped by value code (sorted by code, with offsets per code) so that the rows for a value can be read directly.
+    """
+
+    def __init__(self, column: EncodedColumn):
+        keyed_codes = sorted(
+            (value.lower(), code) for code, value in enumerate(column.values) if isinstance(value, str)
+        )
+        self.sorted_values = [value for value, _ in keyed_codes]
+        self.sorted_codes = [code for _, code in keyed_codes]
+
+        counts = [0] * len(column.values)
+        for code in column.codes:
+            counts[code] += 1
+
+        self.offsets = array('l', [0])
+        for count in counts:
+            self.offsets.append(self.offsets[-1] + count)
+
+        positions = array('l', self.offsets[:-1])
+        self.rows = array('l', bytes(self.offsets[-1] * self.offsets.itemsize))
+        for row, code in enumerate(column.codes):
+            self.rows[positions[code]] = row
+            positions[code] += 1
+
+    def rows_for_codes(self, codes: List[int]) -> Iterable[int]:
+        """
+        Get the rows holding any of the given value codes, in row order
+
+        Args:
+            codes: Value codes
+
+        Returns:
+            Iterable of row numbers
+        """
+        row_groups = [self.rows[self.offsets[code]:self.offsets[code + 1]] for code in codes]
+        return row_groups[0] if len(row_groups) == 1 else merge(*row_groups)
+
+    def equal_codes(self, constant: str) -> List[int]:
+        """
+        Get the codes of values equal to a lower-cased constant, ignoring case
+
+        Args:
+            constant: Lower-cased value
+
+        Returns:
+            list of codes
+        """
+        start = bisect_left(self.sorted_values, constant)
+        end = bisect_left(self.sorted_values, constant + HIGHEST_CHARACTER, start)
+        return [self.sorted_codes[k] for k in range(start, end) if self.sorted_values[k] == constant]
+
+    def prefix_codes(self, constant: str) -> List[int]:
+        """
+        Get the codes of values starting with a lower-cased constant, ignoring case
+
+        Args:
+            constant: Lower-cased prefix
+
+        Returns:
+            list of codes
+        """
+        start = bisect_left(self.sorted_values, constant)
+        end = bisect_left(self.sorted_values, constant + HIGHEST_CHARACTER, start)
+        return self.sorted_codes[start:end]
+
+    def count_rows(self, codes: List[int]) -> int:
+        """
+        Count the rows holding any of the given value codes
+
+        Args:
+            codes: Value codes
+
+        Returns:
+            int
+        """
+        return sum(self.offsets[code + 1] - self.offsets[code] for code in codes)
+
+
+class RangeIndex:
+    """
+    Lower-cased values of a column in row order, which can be bisected if they never decrease
+
+    Exports list checkins oldest first, so created_at normally qualifies; if not (or if any value is missing),
+    `ordered` is False and range rules are tested row by row instead.
+    """
+
+    def __init__(self, column: EncodedColumn):
+        self.lowered = [value.lower() if isinstance(value, str) else None for value in column.values]
+        self.codes = column.codes
+
+        ordered = None not in self.lowered
+        if ordered:
+            previous = ''
+            for value in self:
+                if value < previous:
+                    ordered = False
+                    break
+                previous = value
+        self.ordered = ordered
+
+    def __getitem__(self, row: int) -> str:
+        return self.lowered[self.codes[row]]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __iter__(self):
+        lowered = self.lowered
+        return (lowered[code] for code in self.codes)
+
+    def bounds(self, rules: List[FilterRule]) -> Tuple[int, int]:
+        """
+        Find the contiguous rows passing all of a set of '<' and '>' rules on this column
+
+        Args:
+            rules: Range rules
+
+        Returns:
+            start and end rows, end being exclusive
+        """
+        values = cast(Sequence[str], self)  # Only __getitem__ and __len__ are needed to bisect
+        start = 0
+        end = len(self)
+        for rule in rules:
+            if rule.comparator == '>':
+                start = max(start, bisect_right(values, rule.constant, start, end))
+            else:
+                end = min(end, bisect_left(values, rule.constant, start, end))
+        return start, max(start, end)
+
+
+def compile_rules(rules: Iterable[dict], verbose: bool = False) -> List[FilterRule]:
+    """
+    Compile parsed filter rules, ordered so that the most selective are tested first
+
+    Args:
+        rules: Rules as parsed by utils.parse_filter_rule
+        verbose: Emit debug for each test if true
+
+    Returns:
+        list of FilterRule
+    """
+    return sorted((FilterRule(verbose=verbose, **rule) for rule in rules), key=lambda r: r.rank)
+
+
+def filter_rows(rules: List[FilterRule], source_data: Iterable[dict]) -> list:
+    """
+    Apply compiled rules to rows of export data
+
+    Args:
+        rules: Compiled rules
+        source_data: JSON source data from export
+
+    Returns:
+        list of rows passing all rules
+    """
+    return [row for row in source_data if all(rule.test_row(row) for rule in rules)]
+
+
+def iter_filtered_rows(rules: List[FilterRule], source_data: Iterable[dict]) -> Iterator[dict]:
+    """
+    Apply compiled rules to rows of export data as they are read, eg from a streamed export
+
+    Args:
+        rules: Compiled rules
+        source_data: JSON source data from export, as a list or an iterator of rows
+
+    Returns:
+        Iterator of rows passing all rules
+    """
+    return (row for row in source_data if all(rule.test_row(row) for rule in rules))
+
+
+def column_index(table: CheckinTable, key: str) -> ColumnIndex:
+    """
+    Get the index of a table's column, building it on first use
+
+    Args:
+        table: Checkins
+        key: Column key
+
+    Returns:
+        ColumnIndex
+    """
+    if key not in table.indexes:
+        table.indexes[key] = ColumnIndex(table.column(key))
+    return table.indexes[key]
+
+
+def range_index(table: CheckinTable, key: str) -> RangeIndex:
+    """
+    Get the range index of a table's column, building it on first use
+
+    Args:
+        table: Checkins
+        key: Column key
+
+    Returns:
+        RangeIndex
+    """
+    index_key = key + ':range'
+    if index_key not in table.indexes:
+        table.indexes[index_key] = RangeIndex(table.column(key))
+    return table.indexes[index_key]
+
+
+def filter_table(rules: List[FilterRule], table: CheckinTable) -> CheckinTable:
+    """
+    Apply compiled rules to a CheckinTable
+
+    Range rules on an ordered column such as created_at are answered by bisection, giving a contiguous slice of rows.
+    Where a rule can be answered from an index, the rule matching fewest rows supplies the candidate rows within that
+    slice, and only those are checked against the remaining rules. Each rule's test runs at most once per distinct
+    column value.
+
+    Args:
+        rules: Compiled rules
+        table: Checkins
+
+    Returns:
+        CheckinTable of rows passing all rules
+    """
+    remaining = list(rules)
+    start = 0
+    end = len(table)
+
+    range_rules = {}  # type: Dict[str, List[FilterRule]]
+    for rule in rules:
+        if rule.is_range():
+            range_rules.setdefault(rule.key, []).append(rule)
+
+    for key, key_rules in range_rules.items():
+        ordered_values = range_index(table, key)
+        if ordered_values.ordered:
+            key_start, key_end = ordered_values.bounds(key_rules)
+            start = max(start, key_start)
+            end = max(start, min(end, key_end))
+            for rule in key_rules:
+                remaining.remove(rule)
+
+    if not remaining:
+        return table.slice(start, end)
+
+    indexed = []
+    for rule in remaining:
+        if rule.is_indexable():
+            index = column_index(table, rule.key)
+            codes = index.equal_codes(rule.constant) if rule.comparator == '=' else index.prefix_codes(rule.constant)
+            indexed.append((index.count_rows(codes), rule, index, codes))
+
+    candidates = range(start, end)  # type: Iterable[int]
+    if indexed:
+        row_count, driver, index, codes = min(indexed, key=lambda candidate: candidate[0])
+        if row_count < end - start:
+            remaining.remove(driver)
+            candidates = (row for row in index.rows_for_codes(codes) if start <= row < end) if codes else []
+
+    checks = []  # type: list
+    for rule in remaining:
+        column = table.column(rule.key)
+        checks.append((rule.test_value, column.values, column.codes, {}))
+
+    def passes(row: int) -> bool:
+        for test, values, codes, results in checks:
+            code = codes[row]
+            if code not in results:
+                results[code] = test(values[code])
+            if not results[code]:
+                return False
+        return True
+
+    return table.take(row for row in candidates if passes(row))
+
+
+def filter_indexes(table: CheckinTable) -> Dict[str, ColumnIndex]:
+    """
+    Build indexes for all of the commonly-filtered columns of a table up front, eg before running several reports
+
+    Args:
+        table: Checkins
+
+    Returns:
+        Map of key => index
+    """
+    return {key: column_index(table, key) for key in INDEXED_COLUMNS if key in table.strings}
@@ -4,15 +4,25 @@ Parse an UNtappd JSON export of beers checked in. Run with --help for command-li
 """
 import argparse
 import csv
-import json
 import sys
-from datetime import timedelta
-from typing import Dict, Optional, TextIO
+from contextlib import ExitStack
+from datetime import date, timedelta
+from io import StringIO
+from math import isnan
+from typing import Dict, Iterable, Mapping, Optional, TextIO, Union
 
-from dateutil.parser import parse as parse_date
+import timings
+from checkin_table import ESTIMATE_FLAGS, CheckinTable
+from dates import parse_date
+from utils import (export_chunks, iter_export_items, iter_filtered_items,
+                   iter_json_array)
 
-from measures import MeasureProcessor, Region
-from utils import file_contents, filter_source_data
+
+STDOUT = '-'
+
+# Untappd ratings have at most 2 decimal places. Style and brewery scores are summed as whole hundredths, which are
+# exact in any order, so that summaries of separate runs of checkins merge to the same totals as a single pass
+SCORE_SCALE = 100
 
 
 def parse_cli_args() -> argparse.Namespace:
@@ -24,7 +34,11 @@ def parse_cli_args() -> argparse.Namespace:
     """
     parser = argparse.ArgumentParser(
         description='Analyse consumption of alcoholic drinks from an Untappd JSON export file',
-        usage=sys.argv[0] + ' SOURCE [--output OUTPUT] [--weekly|--daily|--style|--brewery] [--filter=…] [--help]',
+        usage=sys.argv[0] + ' SOURCE [--output OUTPUT] [--weekly|--daily|--style|--brewery]'
+                            ' [--daily-output PATH] [--weekly-output PATH] [--style-output PATH]'
+                            ' [--brewery-output PATH] [--visualisation-output PATH] [--filter=…]'
+                            ' [--vectorized] [--state STATE_FILE] [--workers N] [--cache DIR]'
+                            ' [--profile|--profile-memory] [--help]',
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog=('Filter is based on JSON input keys.\nExample usages:\n'
                 '    "--filter=venue_name=The Red Lion"\n    "--filter=created_at>2017-10-01"'
@@ -33,27 +47,57 @@ def parse_cli_args() -> argparse.Namespace:
     parser.add_argument('source', help='Path to source file (export.json)')
     parser.add_argument('--output', required=False, help='Path to output file, STDOUT if not specified')
 
-    group = parser.add_mutually_exclusive_group(required=True)
+    group = parser.add_mutually_exclusive_group(required=False)
     group.add_argument('--daily', help='Summarise checkins by day', action='store_true')
     group.add_argument('--weekly', help='Summarise checkins by week', action='store_true')
     group.add_argument('--style', help='Summarise styles of drinks checked in', action='store_true')
     group.add_argument('--brewery', help='Summarise checkins by brewery', action='store_true')
 
+    reports = parser.add_argument_group(
+        'multiple reports',
+        'Write any combination of reports to separate files, from a single pass over the source'
+    )
+    reports.add_argument('--daily-output', metavar='PATH', help='Write summary by day to PATH')
+    reports.add_argument('--weekly-output', metavar='PATH', help='Write summary by week to PATH')
+    reports.add_argument('--style-output', metavar='PATH', help='Write summary of styles to PATH')
+    reports.add_argument('--brewery-output', metavar='PATH', help='Write summary by brewery to PATH')
+    reports.add_argument('--visualisation-output', metavar='PATH', help='Write daily visualisation SVG to PATH')
+    reports.add_argument('--visualisation-measure',
+                         choices=['units', 'drinks', 'average'],
+                         default='units',
+                         help='Measure to visualise (default units)')
+
     parser.add_argument('--filter',
                         metavar='RULE',
                         help='Filter input list by rule',
                         action='append')
+    parser.add_argument('--vectorized', help='Build daily & weekly summaries with NumPy', action='store_true')
+    parser.add_argument('--state',
+                        metavar='STATE_FILE',
+                        help='Save summaries to this file, and on later runs only process checkins newer than those')
+    parser.add_argument('--workers',
+                        metavar='N',
+                        type=int,
+                        help='Split the source into shards and summarise them in N processes (0 for one per CPU)')
+    parser.add_argument('--profile', help='Print time taken by each stage to STDERR', action='store_true')
+    parser.add_argument('--cache',
+                        metavar='DIR',
+                        help='Keep reports in DIR, and reuse them when the same source is run with the same options')
+    parser.add_argument('--profile-memory',
+                        help='As --profile, also tracing peak & retained memory of each stage (slow)',
+                        action='store_true')
 
     args = parser.parse_args()
     return args
 
 
 def analyze_checkins(
-        source_data: list,
+        source_data: Union[CheckinTable, Iterable[dict]],
         daily_output: TextIO = None,
         weekly_output: TextIO = None,
         styles_output: TextIO = None,
         brewery_output: TextIO = None,
+        vectorized: bool = False,
 ) -> None:
     """
     Build a summary of intake from the exported data, and save to buffer
@@ -63,17 +107,48 @@ def analyze_checkins(
         weekly_output:
         styles_output:
         brewery_output:
+        vectorized: Use NumPy to build daily and weekly data
 
     Returns:
 
     """
+    # pylint: disable=R0913
     daily = {} if daily_output else None  # type: Optional[Dict]
     weekly = {} if weekly_output else None  # type: Optional[Dict]
     styles = {} if styles_output else None  # type: Optional[Dict]
     breweries = {} if brewery_output else None  # type: Optional[Dict]
 
-    build_checkin_summaries(source_data, daily, weekly, styles, breweries)
+    build_checkin_summaries(source_data, daily, weekly, styles, breweries, vectorized=vectorized)
+    write_summaries(daily, weekly, styles, breweries, daily_output, weekly_output, styles_output, brewery_output)
+
 
+def write_summaries(
+        daily: Optional[Dict],
+        weekly: Optional[Dict],
+        styles: Optional[Dict],
+        breweries: Optional[Dict],
+        daily_output: TextIO = None,
+        weekly_output: TextIO = None,
+        styles_output: TextIO = None,
+        brewery_output: TextIO = None,
+) -> None:
+    """
+    Write each built summary that has an output buffer as CSV
+
+    Args:
+        daily:
+        weekly:
+        styles:
+        breweries:
+        daily_output:
+        weekly_output:
+        styles_output:
+        brewery_output:
+
+    Returns:
+
+    """
+    # pylint: disable=R0913
     if weekly and weekly_output:
         write_weekly_summary(weekly, weekly_output)
 
@@ -88,54 +163,75 @@ def analyze_checkins(
 
 
 def build_checkin_summaries(
-        source_data: list,
+        source_data: Union[CheckinTable, Iterable[dict]],
         daily: dict = None,
         weekly: dict = None,
         styles: dict = None,
-        breweries: dict = None
+        breweries: dict = None,
+        vectorized: bool = False,
 ) -> None:
     """
     Build summaries to dictionaries as provided
 
     Args:
-        source_data: Data unpacked from JSON source
+        source_data: CheckinTable, or data unpacked from JSON source as a list or an iterator of checkins
         daily: dict to populate with daily data
         weekly: dict to populate with weekly data
         styles: dict to populate with style data
         breweries: dict to populate with brewery data
+        vectorized: Build daily and weekly data with NumPy rather than row by row
 
     Returns:
         No return value - results are passed back by reference
     """
-    # pylint: disable=R0914,R0912,R0915
-    # Data-gathering function is inherently noisy - can we simplify without doing things twice?
-
-    first_date = None
-    last_date = None
+    # pylint: disable=R0913
+    table = source_data if isinstance(source_data, CheckinTable) else CheckinTable.from_checkins(source_data)
 
-    # Try and guess a default country for this user
-    # First, by checkin
-    # Else, by manufacturer (not really reliable, but only used if no located checkins)
-    first_country = next(c['venue_country'] for c in source_data if c['venue_country'])
-    if not first_country:
-        first_country = next(c['brewery_country'] for c in source_data if c['brewery_country'])
-
-    current_region = Region.USA if first_country == 'United States' else Region.EUROPE
+    if not table:
+        raise Exception('No dated checkins found')
 
     # We need this to build with, even if we don't return it
     if daily is None:
         daily = {}
 
-    for checkin in source_data:
-        # fields of interest: comment, created_at, beer_abv, serving_type
-        abv = float(checkin['beer_abv'])
-        created_at = parse_date(checkin['created_at'])  # <class 'datetime.datetime'>
-        created_at_date = created_at.date()
-        date_key = created_at_date.isoformat()
-        if first_date is None:
-            first_date = created_at_date
+    if vectorized:
+        # Imported here so that NumPy is only loaded when asked for
+        from vectorized_summaries import build_vectorized_summaries
+        build_vectorized_summaries(table, daily, weekly)
+    else:
+        build_daily_summary(table, daily)
+        if weekly is not None:
+            build_weekly_summary(
+                daily,
+                weekly,
+                first_date=date.fromordinal(table.day[0]),
+                last_date=date.fromordinal(table.day[-1])
+            )
+
+    if styles is not None:
+        build_styles_summary(table, styles)
+
+    if breweries is not None:
+        build_breweries_summary(table, breweries)
+
 
-        last_date = created_at_date
+def build_daily_summary(table: CheckinTable, daily: dict) -> None:
+    """
+    Gather drinks, measures and scores by day
+
+    Args:
+        table: Checkins
+        daily: dict to populate with daily data, by ISO date
+    """
+    date_keys = {}  # type: Dict[int, str]
+
+    for row, day in enumerate(table.day):
+        abv = table.abv[row]
+        rating = table.rating[row]
+
+        if day not in date_keys:
+            date_keys[day] = date.fromordinal(day).isoformat()
+        date_key = date_keys[day]
 
         if date_key not in daily:
             daily[date_key] = {
@@ -147,33 +243,14 @@ def build_checkin_summaries(
 
         daily[date_key]['drinks'] += 1
 
-        if checkin['rating_score']:
+        if not isnan(rating):
             daily[date_key]['rated'] += 1
-            daily[date_key]['total_score'] += float(checkin['rating_score'])
+            daily[date_key]['total_score'] += rating
             daily[date_key]['average'] = daily[date_key]['total_score'] / daily[date_key]['rated']
 
-        # If bottle or can, set parser region by manufacturer
-        if checkin['serving_type'] and checkin['serving_type'] in ['Can', 'Bottle'] and checkin['brewery_country']:
-            if checkin['brewery_country'] == 'United States':
-                checkin_region = Region.USA
-            else:
-                checkin_region = Region.EUROPE
-
-        else:  # Otherwise, base it on location if available
-            if checkin['venue_country']:
-                if checkin['venue_country'] == 'United States':
-                    current_region = Region.USA
-                else:
-                    current_region = Region.EUROPE
-
-            checkin_region = current_region
-
-        processor = MeasureProcessor(checkin_region)
-
-        measure = processor.measure_from_comment(checkin['comment'])
-        if measure is None:
-            measure = processor.measure_from_serving(checkin['serving_type'])
-            daily[date_key]['estimated'] = '*'
+        measure = table.measure_ml[row]
+        if table.estimated[row]:
+            daily[date_key]['estimated'] = ESTIMATE_FLAGS[table.estimated[row]]
 
         if measure:
             if 'beverage_ml' not in daily[date_key]:
@@ -185,108 +262,224 @@ def build_checkin_summaries(
                 daily[date_key]['alcohol_ml'] += alcohol_volume
                 daily[date_key]['units'] += alcohol_volume / 10
 
-        else:
-            daily[date_key]['estimated'] = '**'
-
-        # Gather styles if present
-        if styles is not None and checkin['beer_type']:
-            style = checkin['beer_type'].split(' -')[0].strip()
-            if style not in styles:
-                styles[style] = {'style': style, 'count': 0, 'rated': 0, 'total_score': 0}
-
-            styles[style]['count'] += 1
-            if checkin['rating_score']:
-                styles[style]['rated'] += 1
-                styles[style]['total_score'] += float(checkin['rating_score'])
-
-        # Gather breweries if present
-        if breweries is not None and checkin.get('brewery_name', None):
-            brewery_name = checkin['brewery_name']
-            if brewery_name not in breweries:
-                breweries[brewery_name] = {
-                    'brewery': brewery_name,
-                    'count': 0,
-                    'rated': 0,
-                    'total_score': 0,
-                    'unique_rated': 0,
-                    'unique_total_score': 0,
-                    'unique_beers': [],
-                    'rated_beers': {},  # collect repeat ratings for the same beer
-                }
-            breweries[brewery_name]['count'] += 1
-            if checkin['rating_score']:
-                breweries[brewery_name]['rated'] += 1
-                breweries[brewery_name]['total_score'] += float(checkin['rating_score'])
-                beer_name = checkin['beer_name']
-                if beer_name not in breweries[brewery_name]['rated_beers']:
-                    breweries[brewery_name]['rated_beers'][beer_name] = []
-                breweries[brewery_name]['rated_beers'][beer_name].append(float(checkin['rating_score']))
-
-    if not first_date or not last_date:  # Be explicit for the benefit of MyPy
-        raise Exception('No dated checkins found')
 
-    if weekly is not None:
-        # Gather weeks
-        for date_key in daily:
-
-            # calculate week
-            date = parse_date(date_key)
-            iso_calendar = date.isocalendar()  # Y - W - dow
-            week_key = '%d-W%02d' % iso_calendar[0:2]
-            weekday = iso_calendar[2]
-            days_since_monday = weekday - 1
-            monday = date - timedelta(days=days_since_monday)
-
-            if week_key in weekly:
-                # Existing week
-                weekly[week_key]['dry_days'] -= 1
-
-            else:
-                # New week
-                weekly[week_key] = {
-                    'week': week_key,
-                    'commencing': monday.date().isoformat(),
-                    'drinks': 0,
-                    'units': 0,
-                    'alcohol_ml': 0,
-                    'beverage_ml': 0,
-                    'estimated': '',
-                    'rated': 0,
-                    'total_score': 0.0,
-                    'dry_days': 6,
-                }
-
-            for k in daily[date_key]:
-                if k == 'estimated':
-                    # Get the most uncertain, ie longest, estimate flag (* or **) in this time period
-                    if len(daily[date_key][k]) > len(weekly[week_key][k]):
-                        weekly[week_key][k] = daily[date_key][k]
-
-                elif k in daily[date_key] and k in weekly[week_key]:
-                    weekly[week_key][k] += daily[date_key][k]
-
-        # Fill in blank weeks
-        iso_calendar = first_date.isocalendar()  # Y - W - dow
+def build_styles_summary(table: CheckinTable, styles: dict) -> None:
+    """
+    Gather checkin counts and scores by style
+
+    Args:
+        table: Checkins
+        styles: dict to populate with style data
+    """
+    beer_types = table.column('beer_type')
+    style_names = [t.split(' -')[0].strip() if t else None for t in beer_types.values]
+
+    for row, code in enumerate(beer_types.codes):
+        style = style_names[code]
+        if style is None:
+            continue
+
+        if style not in styles:
+            styles[style] = {'style': style, 'count': 0, 'rated': 0, 'total_score': 0, 'score_hundredths': 0}
+
+        styles[style]['count'] += 1
+        rating = table.rating[row]
+        if not isnan(rating):
+            styles[style]['rated'] += 1
+            styles[style]['score_hundredths'] += round(rating * SCORE_SCALE)
+
+    for style_summary in styles.values():
+        style_summary['total_score'] = style_summary['score_hundredths'] / SCORE_SCALE
+
+
+def build_breweries_summary(table: CheckinTable, breweries: dict) -> None:
+    """
+    Gather checkin counts and scores by brewery, with scores by beer for averaging across unique beers
+
+    Args:
+        table: Checkins
+        breweries: dict to populate with brewery data
+    """
+    brewery_names = table.column('brewery_name')
+    beer_names = table.column('beer_name')
+
+    for row, brewery_name in enumerate(brewery_names):
+        if not brewery_name:
+            continue
+
+        if brewery_name not in breweries:
+            breweries[brewery_name] = {
+                'brewery': brewery_name,
+                'count': 0,
+                'rated': 0,
+                'total_score': 0,
+                'score_hundredths': 0,
+                'unique_rated': 0,
+                'unique_total_score': 0,
+                'unique_beers': [],
+                'rated_beers': {},  # collect repeat ratings for the same beer
+            }
+        breweries[brewery_name]['count'] += 1
+        rating = table.rating[row]
+        if not isnan(rating):
+            breweries[brewery_name]['rated'] += 1
+            breweries[brewery_name]['score_hundredths'] += round(rating * SCORE_SCALE)
+            beer_name = beer_names[row]
+            if beer_name not in breweries[brewery_name]['rated_beers']:
+                breweries[brewery_name]['rated_beers'][beer_name] = []
+            breweries[brewery_name]['rated_beers'][beer_name].append(rating)
+
+    for brewery in breweries.values():
+        brewery['total_score'] = brewery['score_hundredths'] / SCORE_SCALE
+
+
+def merge_daily_summary(daily: dict, later: dict) -> None:
+    """
+    Merge a daily summary of later checkins into another
+
+    Summaries of runs of checkins that don't share any days merge to exactly the summary of all the checkins.
+
+    Args:
+        daily: dict of daily data to add to
+        later: dict of daily data for checkins following those already in `daily`
+    """
+    for date_key, later_day in later.items():
+        if date_key not in daily:
+            daily[date_key] = later_day
+            continue
+
+        day = daily[date_key]
+        day['drinks'] += later_day['drinks']
+        if later_day['estimated']:
+            day['estimated'] = later_day['estimated']
+
+        if later_day['rated']:
+            day['rated'] += later_day['rated']
+            day['total_score'] += later_day['total_score']
+            day['average'] = day['total_score'] / day['rated']
+
+        if 'beverage_ml' in later_day:
+            if 'beverage_ml' not in day:
+                day['beverage_ml'] = day['alcohol_ml'] = day['units'] = 0
+
+            day['beverage_ml'] += later_day['beverage_ml']
+            day['alcohol_ml'] += later_day['alcohol_ml']
+            day['units'] += later_day['units']
+
+
+def merge_styles_summary(styles: dict, later: dict) -> None:
+    """
+    Merge a styles summary of later checkins into another
+
+    Args:
+        styles: dict of style data to add to
+        later: dict of style data for checkins following those already in `styles`
+    """
+    for style, later_style in later.items():
+        if style not in styles:
+            styles[style] = later_style
+            continue
+
+        for key in ('count', 'rated', 'score_hundredths'):
+            styles[style][key] += later_style[key]
+        styles[style]['total_score'] = styles[style]['score_hundredths'] / SCORE_SCALE
+
+
+def merge_breweries_summary(breweries: dict, later: dict) -> None:
+    """
+    Merge a breweries summary of later checkins into another
+
+    Args:
+        breweries: dict of brewery data to add to
+        later: dict of brewery data for checkins following those already in `breweries`
+    """
+    for brewery_name, later_brewery in later.items():
+        if brewery_name not in breweries:
+            breweries[brewery_name] = later_brewery
+            continue
+
+        brewery = breweries[brewery_name]
+        for key in ('count', 'rated', 'score_hundredths'):
+            brewery[key] += later_brewery[key]
+        brewery['total_score'] = brewery['score_hundredths'] / SCORE_SCALE
+
+        for beer_name, ratings in later_brewery['rated_beers'].items():
+            if beer_name not in brewery['rated_beers']:
+                brewery['rated_beers'][beer_name] = []
+            brewery['rated_beers'][beer_name].extend(ratings)
+
+
+def build_weekly_summary(daily: dict, weekly: dict, first_date: date, last_date: date) -> None:
+    """
+    Roll daily data up into ISO weeks, including empty weeks between the first and last checkins
+
+    Args:
+        daily: Daily data from build_daily_summary
+        weekly: dict to populate with weekly data
+        first_date: Date of first checkin
+        last_date: Date of last checkin
+    """
+    # Gather weeks
+    for date_key in daily:
+
+        # calculate week
+        day_date = parse_date(date_key)
+        iso_calendar = day_date.isocalendar()  # Y - W - dow
+        week_key = '%d-W%02d' % iso_calendar[0:2]
         weekday = iso_calendar[2]
         days_since_monday = weekday - 1
-        next_monday = first_date - timedelta(days=days_since_monday)
-        while next_monday <= last_date:
-            iso_calendar = next_monday.isocalendar()  # Y - W - dow
-            week_key = '%d-W%02d' % iso_calendar[0:2]
-            if week_key not in weekly:
-                weekly[week_key] = {
-                    'week': week_key,
-                    'commencing': next_monday.isoformat(),
-                    'drinks': 0,
-                    'units': 0,
-                    'alcohol_ml': 0,
-                    'beverage_ml': 0,
-                    'estimated': '',
-                    'rated': 0,
-                    'total_score': 0.0,
-                    'dry_days': 7,
-                }
-            next_monday += timedelta(weeks=1)
+        monday = day_date - timedelta(days=days_since_monday)
+
+        if week_key in weekly:
+            # Existing week
+            weekly[week_key]['dry_days'] -= 1
+
+        else:
+            # New week
+            weekly[week_key] = {
+                'week': week_key,
+                'commencing': monday.date().isoformat(),
+                'drinks': 0,
+                'units': 0,
+                'alcohol_ml': 0,
+                'beverage_ml': 0,
+                'estimated': '',
+                'rated': 0,
+                'total_score': 0.0,
+                'dry_days': 6,
+            }
+
+        for k in daily[date_key]:
+            if k == 'estimated':
+                # Get the most uncertain, ie longest, estimate flag (* or **) in this time period
+                if len(daily[date_key][k]) > len(weekly[week_key][k]):
+                    weekly[week_key][k] = daily[date_key][k]
+
+            elif k in daily[date_key] and k in weekly[week_key]:
+                weekly[week_key][k] += daily[date_key][k]
+
+    # Fill in blank weeks
+    iso_calendar = first_date.isocalendar()  # Y - W - dow
+    weekday = iso_calendar[2]
+    days_since_monday = weekday - 1
+    next_monday = first_date - timedelta(days=days_since_monday)
+    while next_monday <= last_date:
+        iso_calendar = next_monday.isocalendar()  # Y - W - dow
+        week_key = '%d-W%02d' % iso_calendar[0:2]
+        if week_key not in weekly:
+            weekly[week_key] = {
+                'week': week_key,
+                'commencing': next_monday.isoformat(),
+                'drinks': 0,
+                'units': 0,
+                'alcohol_ml': 0,
+                'beverage_ml': 0,
+                'estimated': '',
+                'rated': 0,
+                'total_score': 0.0,
+                'dry_days': 7,
+            }
+        next_monday += timedelta(weeks=1)
 
 
 def write_weekly_summary(weekly: Dict, weekly_output: TextIO):
@@ -435,6 +628,39 @@ def write_breweries_summary(breweries, brewery_output):
         breweries_writer.writerow(output_row)
 
 
+def requested_reports(args: argparse.Namespace) -> Dict[str, str]:
+    """
+    Work out which reports have been requested, and where each should be written
+
+    Args:
+        args: Parsed command-line arguments
+
+    Returns:
+        Map of report name => output path, or STDOUT
+    """
+    report_paths = {}
+    single_report = (
+        'daily' if args.daily else
+        'weekly' if args.weekly else
+        'styles' if args.style else
+        'breweries' if args.brewery else None
+    )
+    if single_report:
+        report_paths[single_report] = args.output or STDOUT
+
+    for report, path in [
+        ('daily', args.daily_output),
+        ('weekly', args.weekly_output),
+        ('styles', args.style_output),
+        ('breweries', args.brewery_output),
+        ('visualisation', args.visualisation_output),
+    ]:
+        if path:
+            report_paths[report] = path
+
+    return report_paths
+
+
 def run_cli():
     """
     Run the parser at the command line. Run with --help for details
@@ -442,33 +668,163 @@ def run_cli():
         Void
     """
     args = parse_cli_args()
-    source = args.source
-    dest = args.output
-    source_data = json.loads(file_contents(source))
+    report_paths = requested_reports(args)
 
-    filter_strings = args.filter
-    if filter_strings:
-        source_data = filter_source_data(filter_strings, source_data)
+    if not report_paths:
+        raise Exception('No report requested')
 
-    if dest:
-        # R1732 wants a 'with' here. Can't do that neatly with 2 potential opens
-        output_handle = open(dest, 'w')  # pylint: disable=consider-using-with
+    if args.profile or args.profile_memory:
+        timings.start_profile(trace_memory=args.profile_memory)
+
+    if args.cache:
+        if args.state:
+            raise Exception('--cache cannot be used with --state')
+        reports = cached_reports(args, report_paths)
+        with timings.span('write cached'):
+            for report, path in report_paths.items():
+                if path == STDOUT:
+                    sys.stdout.write(reports[report])
+                else:
+                    with open(path, 'w') as output_handle:
+                        output_handle.write(reports[report])
     else:
-        output_handle = sys.stdout
-
-    if args.weekly:
-        analyze_checkins(source_data, weekly_output=output_handle)
-    elif args.daily:
-        analyze_checkins(source_data, daily_output=output_handle)
-    elif args.style:
-        analyze_checkins(source_data, styles_output=output_handle)
-    elif args.brewery:
-        analyze_checkins(source_data, brewery_output=output_handle)
+        with ExitStack() as stack:
+            outputs = {
+                report: sys.stdout if path == STDOUT else stack.enter_context(open(path, 'w'))
+                for report, path in report_paths.items()
+            }
+            build_reports(iter_export_items(args.source), args, outputs)
+
+    profile = timings.stop_profile()
+    if profile:
+        print(profile.report(), file=sys.stderr)
+
+
+def cached_reports(args: argparse.Namespace, report_paths: Dict[str, str]) -> Dict[str, str]:
+    """
+    Fetch the requested reports from the --cache directory, or build them and store them there
+
+    The visualisation depends on today's date as well as the export, as its current year only has boundaries for the
+    months started.
+
+    Args:
+        args: Parsed command-line arguments
+        report_paths: Map of report name => output path
+
+    Returns:
+        Map of report name => report text
+    """
+    # Imported here as only used with --cache
+    from result_cache import (FileResultCache, cache_key, file_chunks,
+                              spool_chunks)
+
+    cache = FileResultCache(args.cache)
+    with timings.span('hash'):
+        digest, spool = spool_chunks(export_chunks(args.source))
+
+    with spool:
+        visualised = 'visualisation' in report_paths
+        key = cache_key(
+            digest,
+            reports=sorted(report_paths),
+            filters=args.filter or [],
+            visualisation_measure=args.visualisation_measure if visualised else None,
+            date=date.today().isoformat() if visualised else None,
+        )
+        with timings.span('cache lookup'):
+            reports = cache.get(key)
+        if reports is None:
+            outputs = {report: StringIO() for report in report_paths}
+            build_reports(iter_json_array(file_chunks(spool)), args, outputs)
+            reports = {report: output.getvalue() for report, output in outputs.items()}
+            with timings.span('cache store'):
+                cache.put(key, reports)
+        else:
+            timings.count('cache hits', 1)
+
+    return reports
+
+
+def build_reports(source_items: Iterable[dict], args: argparse.Namespace, outputs: Mapping[str, TextIO]) -> None:
+    """
+    Build each report requested on the command line, from a single load of and pass over the source data
+
+    Args:
+        source_items: Checkins
+        args: Parsed command-line arguments
+        outputs: Map of report name => buffer to write it to
+    """
+    filter_strings = args.filter
+    source_items = timings.iterate('decode', source_items, count_name='checkins')
+
+    # Imported only for the options that need them; both also depend on this module
+    if args.state:
+        from summary_state import SummaryState
+        with timings.span('load'):
+            state = SummaryState.load(args.state, filter_strings)
+        with timings.span('update'):
+            state.update(source_items)
+        with timings.span('save'):
+            state.save(args.state)
+        daily = state.daily
+        with timings.span('aggregate'):
+            weekly = state.weekly() if 'weekly' in outputs else None  # type: Optional[Dict]
+        styles = state.styles  # type: Optional[Dict]
+        breweries = state.breweries  # type: Optional[Dict]
+    elif args.workers is not None:
+        from sharded_summaries import build_sharded_summaries
+        daily = {}
+        weekly = {} if 'weekly' in outputs else None
+        styles = {} if 'styles' in outputs else None
+        breweries = {} if 'breweries' in outputs else None
+        with timings.span('load'):
+            checkins = list(source_items)
+        with timings.span('aggregate'):
+            build_sharded_summaries(
+                checkins,
+                daily,
+                weekly,
+                styles,
+                breweries,
+                filter_strings=filter_strings,
+                workers=args.workers or None,
+                vectorized=args.vectorized
+            )
     else:
-        raise Exception('No report requested')
+        if filter_strings:
+            source_items = iter_filtered_items(filter_strings, source_items)
+        with timings.span('load'):
+            source_data = CheckinTable.from_checkins(source_items)
 
-    if dest:
-        output_handle.close()
+        if filter_strings:
+            timings.count('filtered checkins', len(source_data))
+
+        daily = {}
+        weekly = {} if 'weekly' in outputs else None
+        styles = {} if 'styles' in outputs else None
+        breweries = {} if 'breweries' in outputs else None
+        with timings.span('aggregate'):
+            build_checkin_summaries(source_data, daily, weekly, styles, breweries, vectorized=args.vectorized)
+
+    if 'visualisation' in outputs:
+        # Imported here as daily_visualisation itself depends on this module
+        # pylint: disable=cyclic-import
+        from daily_visualisation import build_daily_visualisation_image
+        with timings.span('render svg'):
+            image = build_daily_visualisation_image(daily, args.visualisation_measure, show_legend=True)
+            image.write(outputs['visualisation'], pretty=True)
+
+    with timings.span('write csv'):
+        write_summaries(
+            daily,
+            weekly,
+            styles,
+            breweries,
+            daily_output=outputs.get('daily'),
+            weekly_output=outputs.get('weekly'),
+            styles_output=outputs.get('styles'),
+            brewery_output=outputs.get('breweries'),
+        )
 
 
 if __name__ == '__main__':
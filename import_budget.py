@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Measure how long each entry point takes to import, with `python -X importtime`, and check it against a budget.
+Run with --help for details
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+
+# Modules imported after this line is written to STDERR are counted; interpreter startup is not
+START_MARKER = 'import_budget: start'
+DEFAULT_REPEAT = 5
+
+# For each scenario: what it imports, how long that may take, and slow or unrelated modules it must not load.
+# Lambda export types import their report modules when first used, so are measured as the handler plus those.
+SCENARIOS = {
+    'lambda_function': {
+        'imports': ['lambda_function'],
+        'budget_ms': 300,
+        'excluded': ['imbibed', 'stock_check', 'daily_visualisation', 'checkin_table', 'svgwrite', 'numpy'],
+    },
+    'lambda list export': {
+        'imports': ['lambda_function', 'stock_check'],
+        'budget_ms': 320,
+        'excluded': ['imbibed', 'daily_visualisation', 'checkin_table', 'svgwrite', 'numpy'],
+    },
+    'lambda checkins export': {
+        'imports': ['lambda_function', 'daily_visualisation', 'imbibed', 'checkin_table'],
+        'budget_ms': 400,
+        'excluded': ['stock_check', 'svgwrite', 'numpy', 'summary_state', 'sharded_summaries'],
+    },
+    'imbibed.py': {
+        'imports': ['imbibed'],
+        'budget_ms': 50,
+        'excluded': ['requests', 'svgwrite', 'numpy', 'summary_state', 'sharded_summaries'],
+    },
+    'stock_check.py': {
+        'imports': ['stock_check'],
+        'budget_ms': 50,
+        'excluded': ['requests', 'checkin_table', 'svgwrite', 'numpy'],
+    },
+    'daily_visualisation.py': {
+        'imports': ['daily_visualisation'],
+        'budget_ms': 150,
+        'excluded': ['requests', 'svgwrite', 'numpy', 'summary_state'],
+    },
+}  # type: Dict[str, dict]
+
+
+def measure_imports(modules: List[str]) -> dict:
+    """
+    Import modules in a fresh interpreter, timing each import
+
+    Args:
+        modules: Names of modules to import, in order
+
+    Returns:
+        dict of 'ms' (total import time), 'self_ms' (time per module, excluding its imports) and 'modules' (set of
+        all modules loaded by the interpreter)
+    """
+    code = 'import sys; sys.stderr.write(%r + "\\n"); %s; print("\\n".join(sys.modules))' % (
+        START_MARKER, '; '.join('import ' + module for module in modules)
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    lines = result.stderr.splitlines()
+    total_us = 0
+    self_us = {}  # type: Dict[str, int]
+    for line in lines[lines.index(START_MARKER) + 1:]:
+        if not line.startswith('import time:'):
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            continue  # Column headings
+        self_us[name.strip()] = int(own)
+        if not name.startswith('  '):  # Top-level import: its cumulative time includes everything it loaded
+            total_us += int(cumulative)
+
+    return {
+        'ms': total_us / 1000,
+        'self_ms': {name: us / 1000 for name, us in self_us.items()},
+        'modules': set(result.stdout.split()),
+    }
+
+
+def check_scenario(name: str, repeat: int, scale: float, top: int = 0) -> List[str]:
+    """
+    Measure a scenario and print its best import time, returning any ways in which it breaks its budget
+
+    Args:
+        name: Key of SCENARIOS
+        repeat: Number of runs, the fastest of which is reported
+        scale: Multiplier for the budget, for machines slower or faster than the one it was set on
+        top: Number of slowest modules to list
+
+    Returns:
+        List of problems
+    """
+    scenario = SCENARIOS[name]
+    runs = [measure_imports(scenario['imports']) for _ in range(repeat)]
+    best = min(runs, key=lambda run: run['ms'])
+    budget = scenario['budget_ms'] * scale
+
+    problems = []
+    if best['ms'] > budget:
+        problems.append('took %.1fms, budget %.1fms' % (best['ms'], budget))
+    loaded = [module for module in scenario['excluded'] if module in best['modules']]
+    if loaded:
+        problems.append('loaded ' + ', '.join(loaded))
+
+    print('%-32s %9.1f %9.1f  %s' % (name, best['ms'], budget, '; '.join(problems) or 'OK'))
+    slowest = sorted(best['self_ms'].items(), key=lambda item: item[1], reverse=True)[:top]
+    for module, ms in slowest:
+        print('    %-28s %9.1f' % (module, ms))
+
+    return problems
+
+
+def parse_cli_args() -> argparse.Namespace:
+    """
+    Specify and parse command-line arguments
+
+    Returns:
+        Namespace of provided arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Check the import time of each entry point against its budget',
+        usage=sys.argv[0] + ' [--scenario NAME ...] [--repeat N] [--scale FACTOR] [--top N] [--list] [--help]'
+    )
+    parser.add_argument('--scenario', nargs='+', metavar='NAME', help='Check only the named scenarios')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='Runs per scenario, fastest is reported (default %d)' % DEFAULT_REPEAT)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiply budgets by FACTOR, eg on a slower machine (default 1)')
+    parser.add_argument('--top', type=int, default=0, metavar='N', help='List the N slowest modules of each scenario')
+    parser.add_argument('--list', action='store_true', help='List scenarios and exit')
+    args = parser.parse_args()
+    return args
+
+
+def run_cli():
+    """
+    Check import budgets at the command line. Exits with status 1 if any scenario is over budget
+    """
+    args = parse_cli_args()
+    if args.list:
+        print('\n'.join(SCENARIOS))
+        return
+
+    names = args.scenario or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise Exception('Unknown scenario: ' + ', '.join(unknown))
+
+    print('%-32s %9s %9s' % ('scenario', 'ms', 'budget'))
+    failed = [name for name in names if check_scenario(name, args.repeat, args.scale, args.top)]
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run_cli()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Time the Lambda function's handler on a fake SES event of many messages, against in-process stand-ins for S3, SES,
+CloudFront and the export downloads. Run with --help for details
+"""
+import argparse
+import json
+import sys
+import time
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
+from typing import Dict, Iterator, List
+from unittest import mock
+
+import lambda_function
+from synthetic_export import generate_checkins, generate_list_items
+
+
+DEFAULT_RECORDS = 24
+DEFAULT_SIZE = 2000
+DEFAULT_LATENCY = 0.05
+DEFAULT_WORKERS = [1, 4, 8]
+DOWNLOAD_ROOT = 'https://exports.example/'
+MESSAGE_BUCKET = 'incoming'
+
+STAND_IN_CONFIG = {
+    'incoming_email_bucket': MESSAGE_BUCKET,
+    'upload_bucket': 'uploads',
+    'secret': 'benchmark',
+    'upload_web_root': 'https://lists.example/',
+    'cdn_distribution_id': 'CDN',
+}
+
+
+class StubBackends:
+    """
+    Stand-ins for the S3, SES and CloudFront clients and the export download, each call waiting `latency` seconds
+
+    Messages and exports are stored in memory, and replies sent through SES are kept in `sent`.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.messages = {}  # type: Dict[str, bytes]
+        self.exports = {}  # type: Dict[str, bytes]
+        self.uploads = {}  # type: Dict[str, bytes]
+        self.sent = []  # type: List[dict]
+
+    def client(self, service: str) -> 'StubBackends':
+        """
+        Replaces aws_clients.aws_client: one object stands in for every service
+
+        Args:
+            service: AWS service name
+
+        Returns:
+            self
+        """
+        return self
+
+    def get_object(self, Bucket: str, Key: str) -> dict:  # pylint: disable=C0103
+        time.sleep(self.latency)
+        return {'Body': BytesIO(self.messages[Key])}
+
+    def put_object(self, Bucket: str, Key: str, Body, **_) -> dict:  # pylint: disable=C0103
+        time.sleep(self.latency)
+        self.uploads[Key] = Body
+        return {}
+
+    def create_invalidation(self, **_) -> dict:
+        time.sleep(self.latency)
+        return {}
+
+    def send_raw_email(self, Destinations: List[str], RawMessage: dict, **_) -> dict:  # pylint: disable=C0103
+        time.sleep(self.latency)
+        self.sent.append({'to': Destinations, 'size': len(RawMessage['Data'])})
+        return {'MessageId': str(len(self.sent))}
+
+    def stream_download(self, url: str, **_) -> Iterator[bytes]:
+        """
+        Replaces aws_clients.stream_download
+
+        Args:
+            url: Export URL
+
+        Returns:
+            Iterator of bytes chunks
+        """
+        time.sleep(self.latency)
+        data = self.exports[url]
+        for start in range(0, len(data), 64 * 1024):
+            yield data[start:start + 64 * 1024]
+
+
+def build_event(backends: StubBackends, records: int, size: int) -> dict:
+    """
+    Make an SES event of alternating checkin and list exports, storing their messages and exports in the backends
+
+    Args:
+        backends: Stand-ins to store messages and exports in
+        records: Number of messages
+        size: Checkins per checkin export; list exports have a tenth as many items
+
+    Returns:
+        Lambda event
+    """
+    exports = {
+        'your check-ins': json.dumps(generate_checkins(size)).encode('utf-8'),
+        'a list': json.dumps(generate_list_items(max(size // 10, 1))).encode('utf-8'),
+    }
+    event_records = []
+    for index in range(records):
+        description = 'your check-ins' if index % 2 == 0 else 'a list'
+        message_id = 'message-%d' % index
+        url = '%sexport-%d.json' % (DOWNLOAD_ROOT, index)
+        backends.exports[url] = exports[description]
+        backends.messages[message_id] = (
+            'Content-Type: text/plain\n\nHi, you requested an export of %s on Untappd.'
+            ' You can download your data export here: %s\n' % (description, url)
+        ).encode('utf-8')
+        event_records.append({'ses': {'mail': {
+            'messageId': message_id,
+            'source': 'drinker%d@example.com' % index,
+            'commonHeaders': {'subject': 'List: Cellar %d' % index},
+        }}})
+
+    return {'Records': event_records}
+
+
+def run_handler(backends: StubBackends, event: dict, workers: int, config: dict = None) -> dict:
+    """
+    Run the handler on an event, using the stand-in backends
+
+    Args:
+        backends: Stand-ins holding the event's messages and exports
+        event: Lambda event
+        workers: Records processed at once
+        config: Further config values, if any
+
+    Returns:
+        Handler response
+    """
+    config = dict(STAND_IN_CONFIG, record_workers=workers, **(config or {}))
+    with mock.patch.dict('utils.config', config), \
+            mock.patch.object(lambda_function, 'aws_client', backends.client), \
+            mock.patch.object(lambda_function, 'stream_download', backends.stream_download), \
+            redirect_stdout(StringIO()):
+        return lambda_function.lambda_handler(event, None)
+
+
+def time_handler(records: int, size: int, latency: float, workers: int) -> dict:
+    """
+    Run the handler once on a fresh fake event
+
+    Args:
+        records: Number of messages in the event
+        size: Checkins per checkin export
+        latency: Seconds taken by each call to a stand-in backend
+        workers: Records processed at once
+
+    Returns:
+        dict of 'seconds' and the handler's per-record results
+    """
+    backends = StubBackends(latency)
+    event = build_event(backends, records, size)
+    started = time.perf_counter()
+    response = run_handler(backends, event, workers)
+    seconds = time.perf_counter() - started
+
+    if len(backends.sent) != records:
+        raise Exception('Expected %d replies, %d sent' % (records, len(backends.sent)))
+
+    return {'seconds': seconds, 'records': response['records']}
+
+
+def parse_cli_args() -> argparse.Namespace:
+    """
+    Specify and parse command-line arguments
+
+    Returns:
+        Namespace of provided arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Time the Lambda handler on a fake event against stand-in AWS services',
+        usage=sys.argv[0] + ' [--records N] [--size N] [--latency SECONDS] [--workers N ...] [--help]'
+    )
+    parser.add_argument('--records', type=int, default=DEFAULT_RECORDS,
+                        help='Messages in the event, alternating checkin and list exports (default %d)'
+                             % DEFAULT_RECORDS)
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE,
+                        help='Checkins in each checkin export (default %d)' % DEFAULT_SIZE)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY,
+                        help='Seconds taken by each call to S3, SES, CloudFront or a download (default %s)'
+                             % DEFAULT_LATENCY)
+    parser.add_argument('--workers', type=int, nargs='+', default=DEFAULT_WORKERS,
+                        help='Numbers of records to process at once (default %s)' % DEFAULT_WORKERS)
+    args = parser.parse_args()
+    return args
+
+
+def run_cli():
+    """
+    Run the benchmark at the command line
+    """
+    args = parse_cli_args()
+    print('%8s %8s %10s %10s %s' % ('records', 'workers', 'seconds', 'records/s', 'statuses'))
+    for workers in args.workers:
+        result = time_handler(args.records, args.size, args.latency, workers)
+        statuses = {}  # type: Dict[str, int]
+        for record in result['records']:
+            statuses[record['status']] = statuses.get(record['status'], 0) + 1
+        print('%8d %8d %10.3f %10.1f %s' % (
+            args.records, workers, result['seconds'], args.records / result['seconds'], statuses
+        ))
+
+
+if __name__ == '__main__':
+    run_cli()
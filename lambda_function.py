@@ -1,7 +1,9 @@
-import json
 import logging
 import re
-from datetime import datetime, timedelta
+import sys
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import date, datetime, timedelta
 from email import encoders
 from email.message import Message
 from email.mime.application import MIMEApplication
@@ -11,20 +13,28 @@ from email.mime.text import MIMEText
 from email.parser import Parser as EmailParser
 from hashlib import sha256
 from io import StringIO
-from typing import List, Optional
+from time import monotonic
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
-import boto3
-import requests
 from botocore.exceptions import ClientError
 
-import daily_visualisation
-import imbibed
-import stock_check
+import timings
+from aws_clients import aws_client, stream_download
 from bot_version import version
-from utils import build_csv_from_list, debug_print, get_config
+from coalescing import (Coalescer, Submission, coalescer_from_config,
+                        parse_ses_timestamp)
+from message_ledger import MessageLedger, message_ledger_from_config
+from result_cache import (ResultCache, cache_key, file_chunks,
+                          result_cache_from_config, spool_chunks)
+from utils import build_csv_from_list, debug_print, get_config, iter_json_array
+
 
 EXPORT_TYPE_LIST = 'list'
 EXPORT_TYPE_CHECKINS = 'checkins'
+REPORT_THREADS = 4
+DEFAULT_RECORD_WORKERS = 4
+RECORD_STATUSES = ('ok', 'error', 'skipped', 'duplicate', 'superseded')
+REPLY_TIME_SECONDS = 5  # Kept back from the Lambda function's time limit, to send a reply if processing overruns
 
 
 # noinspection PyUnusedLocal
@@ -32,82 +42,398 @@ def lambda_handler(event, context):
     logger = logging.getLogger()
     logger.setLevel(logging.WARN)
 
-    for record in event['Records']:
-        if 'ses' in record:
+    # Always on: the cost is a few timer reads per stage, and the log line shows where slow invocations spend time.
+    # Memory tracing is much slower, so only done when configured, eg to size the function's memory setting
+    profile = timings.start_profile(trace_memory=bool(get_config('profile_memory')))
+    results = []  # type: List[dict]
+    try:
+        ledger = message_ledger_from_config()
+        coalescer = coalescer_from_config()
+        results = handle_records(event['Records'], logger, processing_deadline(context), ledger, coalescer)
+    finally:
+        timings.stop_profile()
+        print(timings.log_line(
+            profile,
+            version=version,
+            export_types=[result['export_type'] for result in results if 'export_type' in result],
+            records={status: sum(result['status'] == status for result in results) for status in RECORD_STATUSES},
+        ))
+
+    return {'records': results}
+
+
+def handle_records(records: List[dict], logger: logging.Logger, deadline: float = None,
+                   ledger: MessageLedger = None, coalescer: Coalescer = None) -> List[dict]:
+    """
+    Process the records of a Lambda event, several at once, so that one slow export doesn't hold up the others
+
+    The number processed at once is set by the config value 'record_workers'.
+
+    Args:
+        records: Records from the Lambda event
+        logger: Logger for errors
+        deadline: time.monotonic() value by which processing must be done, if any
+        ledger: Ledger of messages already answered, if one is configured
+        coalescer: Coalescer of list exports submitted in quick succession, if one is configured
+
+    Returns:
+        Result of each record, as from handle_record, in order
+    """
+    workers = min(len(records), get_config('record_workers', DEFAULT_RECORD_WORKERS))
+    if workers <= 1:
+        return [handle_record(record, logger, deadline, ledger, coalescer) for record in records]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda record: handle_record(record, logger, deadline, ledger, coalescer), records))
+
+
+def processing_deadline(context) -> Optional[float]:
+    """
+    Find when processing must stop, to leave time to reply before the Lambda function is stopped
+
+    Args:
+        context: Lambda context, or None if run outside Lambda
+
+    Returns:
+        time.monotonic() value, or None if there's no limit
+    """
+    if context is None:
+        return None
+    return monotonic() + context.get_remaining_time_in_millis() / 1000 - REPLY_TIME_SECONDS
+
+
+def time_left(deadline: Optional[float]) -> Optional[float]:
+    """
+    Get the seconds remaining until a deadline, raising an exception if it has passed
+
+    Args:
+        deadline: time.monotonic() value, or None for no limit
+
+    Returns:
+        Seconds, or None for no limit
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - monotonic()
+    if remaining <= 0:
+        raise Exception('Ran out of time to process your export')
+    return remaining
+
+
+def run_concurrently(tasks: Dict[str, Callable[[], Any]], deadline: Optional[float]) -> Dict[str, Any]:
+    """
+    Run independent tasks in a thread pool, waiting for all of them or until the deadline
+
+    Args:
+        tasks: Map of name => function to call
+        deadline: time.monotonic() value, or None for no limit
+
+    Returns:
+        Map of name => result
+    """
+    pool = ThreadPoolExecutor(max_workers=min(len(tasks), REPORT_THREADS))
+    futures = {name: pool.submit(task) for name, task in tasks.items()}
+    try:
+        return {name: future.result(timeout=time_left(deadline)) for name, future in futures.items()}
+    finally:
+        # Don't wait for unfinished tasks if out of time: let the error reply go
+        abandon_pool(pool, futures.values())
+
+
+def abandon_pool(pool: ThreadPoolExecutor, futures: Iterable[Future]) -> None:
+    """
+    Shut down a thread pool without waiting for its tasks, cancelling any not yet started
+
+    Tasks already running carry on in the background, as threads can't be stopped.
+
+    Args:
+        pool: Thread pool
+        futures: Futures of the tasks submitted to it
+    """
+    for future in futures:
+        future.cancel()
+    if sys.version_info >= (3, 9):
+        pool.shutdown(wait=False, cancel_futures=True)
+    else:
+        pool.shutdown(wait=False)
+
+
+def handle_record(record: dict, logger: logging.Logger, deadline: float = None, ledger: MessageLedger = None,
+                  coalescer: Coalescer = None) -> dict:
+    """
+    Process a single SES record, replying to its sender with reports or an error message
+
+    Processing is limited to the config value 'record_timeout' seconds, if set, as well as by the deadline.
+    A message already in the ledger has been answered, so is skipped as a duplicate; others are added to it once
+    their reply has been sent. A list export followed by a newer one of the same list from the same sender is
+    superseded, and only gets a short reply saying so.
+
+    Args:
+        record: Record from the Lambda event
+        logger: Logger for errors
+        deadline: time.monotonic() value by which processing must be done, if any
+        ledger: Ledger of messages already answered, if one is configured
+        coalescer: Coalescer of list exports submitted in quick succession, if one is configured
+
+    Returns:
+        Result: dict of 'message_id', 'status' (one of RECORD_STATUSES), 'seconds', and 'export_type' or 'error'
+    """
+    if 'ses' not in record:
+        return {'message_id': None, 'status': 'skipped', 'seconds': 0}
+
+    started = monotonic()
+    record_timeout = get_config('record_timeout')
+    if record_timeout:
+        deadline = min(deadline or float('inf'), started + record_timeout)
+
+    mail_data = record['ses']['mail']
+    headers = mail_data['commonHeaders']
+    reply_to = headers['returnPath'] if 'returnPath' in headers else mail_data['source']
+    message_id = mail_data['messageId']
+    result = {'message_id': message_id, 'status': 'ok'}  # type: Dict[str, Any]
 
-            mail_data = record['ses']['mail']
-            headers = mail_data['commonHeaders']
-            reply_to = headers['returnPath'] if 'returnPath' in headers else mail_data['source']
-            message_id = mail_data['messageId']
+    if ledger is not None and already_answered(ledger, message_id, logger):
+        timings.count('duplicates', 1)
+        result.update(status='duplicate', seconds=round(monotonic() - started, 3))
+        return result
 
-            try:
-                message_payload = fetch_message_from_bucket(message_id)
+    try:
+        with timings.span('fetch message'):
+            message_payload = fetch_message_from_bucket(message_id)
+
+        if not message_payload:
+            raise Exception('Incoming message could not be loaded')
+
+        message_text = message_payload.get_payload(decode=True).decode('utf-8')
+        export_type = detect_export_type(message_text)
+        download_link = detect_download_link(message_text)
+        result['export_type'] = export_type
+
+        if export_type:
+            list_name = None
+            if export_type == EXPORT_TYPE_LIST:
+                subject = headers['subject'] if 'subject' in headers else ''
+                subject_match = re.search(r'List:\s*(\w.*)', subject)
+                list_name = subject_match[1].strip() if subject_match else None
+
+            submission = None
+            if coalescer is not None and export_type == EXPORT_TYPE_LIST:
+                submission = coalescer.submit(reply_to, list_name, message_id,
+                                              parse_ses_timestamp(mail_data.get('timestamp')))
+                if submission.superseded(max_wait=0):  # A newer export has already arrived: don't download this one
+                    send_superseded_response(reply_to, list_name)
+                    result['status'] = 'superseded'
+                    return finish_record(result, ledger, logger, started)
+
+            # Items are decoded as they arrive, so the full export is never held in memory
+            chunks = timings.iterate('download', stream_download(download_link), 'input bytes', weigh=len)
+            with ExitStack() as stack:
+                cache = result_cache_from_config()
+                key = None
+                if cache is not None:
+                    # Reports can only be looked up once the whole export has been hashed, so it's spooled to disk
+                    # to be decoded afterwards if they need building
+                    with timings.span('spool & hash'):
+                        digest, spool = spool_chunks(chunks)
+                    stack.enter_context(spool)
+                    key = export_cache_key(digest, export_type, list_name)
+                    chunks = file_chunks(spool)
+                loaded_data = timings.iterate('download & decode', iter_json_array(chunks), count_name='rows')
+
+                if export_type == EXPORT_TYPE_LIST:
+                    if not process_list_export(loaded_data, reply_to, list_name, cache, key, deadline, submission):
+                        result['status'] = 'superseded'
+
+                elif export_type == EXPORT_TYPE_CHECKINS:
+                    process_checkins_export(loaded_data, reply_to, cache, key, deadline)
+
+        else:
+            exception_message = 'Unfamiliar export type: "%s"' % export_type
+            logger.error(exception_message)
+            raise Exception(exception_message)
+
+    except Exception as e:
+        timings.count('errors', 1)
+        result.update(status='error', error='%s %s' % (type(e).__name__, e))
+        error_message = 'BeerBot had a problem handling your message:\n\n' \
+                        ' Here\'s a hint to the problem: %s %s' % (type(e), e)
+        try:
+            send_email_response(reply_to, error_message)
+        except Exception as reply_error:  # Mustn't stop other records' replies
+            result['reply_error'] = '%s %s' % (type(reply_error).__name__, reply_error)
+        if get_config('debug'):
+            raise e
+
+    return finish_record(result, ledger, logger, started)
+
+
+def finish_record(result: dict, ledger: Optional[MessageLedger], logger: logging.Logger, started: float) -> dict:
+    """
+    Complete the result of a record that has been replied to, adding its message to the ledger if there is one
 
-                if not message_payload:
-                    raise Exception('Incoming message could not be loaded')
+    Args:
+        result: Result so far, as built by handle_record
+        ledger: Ledger of messages already answered, if one is configured
+        logger: Logger for errors
+        started: time.monotonic() value at which processing of the record started
+
+    Returns:
+        Result
+    """
+    message_id = result['message_id']
+    if ledger is not None and 'reply_error' not in result:
+        try:
+            with timings.span('ledger record'):
+                ledger.record(message_id)
+        except Exception as e:  # The reply has gone, so this only risks answering a redelivery again
+            logger.error('Message %s could not be added to the ledger: %s %s', message_id, type(e).__name__, e)
+            result['ledger_error'] = '%s %s' % (type(e).__name__, e)
 
-                message_text = message_payload.get_payload(decode=True).decode('utf-8')
-                export_type = detect_export_type(message_text)
-                download_link = detect_download_link(message_text)
+    result['seconds'] = round(monotonic() - started, 3)
+    return result
 
-                if export_type:
-                    r = requests.get(download_link)
-                    export_data = r.content.decode('utf-8')  # string
-                    loaded_data = json.loads(export_data)
 
-                    if export_type == EXPORT_TYPE_LIST:
-                        subject = headers['subject'] if 'subject' in headers else ''
-                        subject_match = re.search(r'List:\s*(\w.*)', subject)
-                        list_name = subject_match[1].strip() if subject_match else None
-                        process_list_export(loaded_data, reply_to, list_name)
+def already_answered(ledger: MessageLedger, message_id: str, logger: logging.Logger) -> bool:
+    """
+    Check the ledger for a message, treating it as new if the ledger can't be read
+
+    Args:
+        ledger: Ledger of messages already answered
+        message_id: SES messageId
+        logger: Logger for errors
+
+    Returns:
+        bool
+    """
+    try:
+        with timings.span('ledger check'):
+            return ledger.seen(message_id)
+    except Exception as e:  # Better to answer a message twice than not at all
+        logger.error('Ledger could not be checked for message %s: %s %s', message_id, type(e).__name__, e)
+        return False
+
+
+def export_cache_key(export_digest: str, export_type: str, list_name: str = None) -> str:
+    """
+    Key the reports of an export in the result cache
+
+    Reports depend on today's date: list reports' expiry groups and HTML date, and checkin reports' calendar, whose
+    current year only has boundaries for the months started. List reports also depend on the list name, which titles
+    the HTML version.
+
+    Args:
+        export_digest: SHA-256 hex digest of the export
+        export_type: EXPORT_TYPE_LIST or EXPORT_TYPE_CHECKINS
+        list_name: Name of a list export, if given
+
+    Returns:
+        Cache key
+    """
+    today = date.today().isoformat()
+    if export_type == EXPORT_TYPE_LIST:
+        return cache_key(export_digest, export_type=export_type, list_name=list_name, date=today)
+    return cache_key(export_digest, export_type=export_type, date=today)
+
+
+def cached_reports(cache: Optional[ResultCache], key: Optional[str],
+                   build: Callable[[], Dict[str, str]]) -> Dict[str, str]:
+    """
+    Fetch reports from the result cache, or build them and store them there
+
+    Args:
+        cache: Result cache, if one is configured
+        key: Key of the reports in the cache
+        build: Function building the reports, as a dict of filename => text
 
-                    elif export_type == EXPORT_TYPE_CHECKINS:
-                        process_checkins_export(loaded_data, reply_to)
+    Returns:
+        dict of filename => text
+    """
+    if cache is None or key is None:
+        return build()
 
-                else:
-                    exception_message = 'Unfamiliar export type: "%s"' % export_type
-                    logger.error(exception_message)
-                    raise Exception(exception_message)
+    with timings.span('cache lookup'):
+        reports = cache.get(key)
+    if reports is not None:
+        timings.count('cache hits', 1)
+        return reports
 
-            except Exception as e:
-                error_message = 'BeerBot had a problem handling your message:\n\n' \
-                                ' Here\'s a hint to the problem: %s %s' % (type(e), e)
-                send_email_response(reply_to, error_message)
-                if get_config('debug'):
-                    raise e
+    reports = build()
+    with timings.span('cache store'):
+        cache.put(key, reports)
+    return reports
 
 
-def process_checkins_export(loaded_data: list, reply_to: str):
+def process_checkins_export(loaded_data: Iterable[dict], reply_to: str, cache: ResultCache = None, key: str = None,
+                            deadline: float = None):
     """
     Process loaded checkin export data to create an email containing appropriate reports
     Args:
-        loaded_data: Unpacked JSON data
+        loaded_data: Unpacked JSON data, as a list or an iterator of checkins
         reply_to: Address email was submitted from
+        cache: Result cache to fetch reports from or store them in, if any
+        key: Key of the reports in the cache
+        deadline: time.monotonic() value by which the reports must be built, if any
 
     Returns:
 
     """
-    weekly_buffer = StringIO()
-    styles_buffer = StringIO()
-    breweries_buffer = StringIO()
-    image_buffer = StringIO()
+    reports = cached_reports(cache, key, lambda: build_checkins_reports(loaded_data, deadline))
+
+    body = 'BeerBot found a check-in export in your email and' \
+           ' created the following summaries:\n\n' \
+           ' bb-checkin-summary.csv: summarises consumption and score by week\n' \
+           ' bb-checkin-styles.csv: styles you\'ve checked in, most common first\n' \
+           ' bb-checkin-breweries.csv: average score by brewery of all checkins & unique beers \n\n' \
+           'plus a visualisation of your consumption over time in bb-units-vis.svg \n\n' \
+           'bb-checkin-summary.csv may contain notes on estimated consumption: \n' \
+           '* = Some measures guessed from serving. \n' \
+           '** = Some beers skipped due to no serving or measure\n'
+    attachments = [
+        make_attachment(StringIO(reports['bb-units-vis.svg']), 'bb-units-vis.svg', 'image/svg+xml',
+                        disposition='inline'),
+        make_attachment(StringIO(reports['bb-checkin-summary.csv']), 'bb-checkin-summary.csv', 'text/csv'),
+        make_attachment(StringIO(reports['bb-checkin-styles.csv']), 'bb-checkin-styles.csv', 'text/csv'),
+        make_attachment(StringIO(reports['bb-checkin-breweries.csv']), 'bb-checkin-breweries.csv', 'text/csv'),
+    ]
+    send_email_response(reply_to, body, attachments)
+
+
+def build_checkins_reports(loaded_data: Iterable[dict], deadline: float = None) -> Dict[str, str]:
+    """
+    Build the reports on a checkin export, writing each from the summaries in its own thread
+
+    Args:
+        loaded_data: Unpacked JSON data, as a list or an iterator of checkins
+        deadline: time.monotonic() value by which the reports must be built, if any
+
+    Returns:
+        dict of filename => text
+    """
+    # Report modules are imported by the export type that uses them, so neither type loads the other's code,
+    # and a cold start only pays for what its export needs
+    import daily_visualisation
+    import imbibed
+    from checkin_table import CheckinTable
 
     daily = {}
     weekly = {}
     styles = {}
     breweries = {}
 
-    imbibed.build_checkin_summaries(
-        loaded_data,
-        daily=daily,
-        weekly=weekly,
-        styles=styles,
-        breweries=breweries,
-    )
+    with timings.span('load'):
+        table = CheckinTable.from_checkins(loaded_data)
+    timings.count('days', len(set(table.day)))
+
+    with timings.span('aggregate'):
+        imbibed.build_checkin_summaries(
+            table,
+            daily=daily,
+            weekly=weekly,
+            styles=styles,
+            breweries=breweries,
+        )
 
-    imbibed.write_weekly_summary(weekly, weekly_buffer)
-    imbibed.write_styles_summary(styles, styles_buffer)
-    imbibed.write_breweries_summary(breweries, breweries_buffer)
+    time_left(deadline)
 
     count_all_checkins = len(daily.keys())
     count_with_measure = len([1 for d in daily if 'beverage_ml' in daily[d]])
@@ -119,84 +445,160 @@ def process_checkins_export(loaded_data: list, reply_to: str):
 
     print('%d measures in %d checkins, visualising %s' % (count_with_measure, count_all_checkins, measure))
 
-    image = daily_visualisation.build_daily_visualisation_image(
-        daily,
-        measure=measure,
-        show_legend=True
+    def render_image() -> str:
+        with timings.span('render svg'):
+            # Compact, as the attachment's size matters more than its readability
+            image = daily_visualisation.build_daily_visualisation_image(
+                daily,
+                measure=measure,
+                show_legend=True,
+                compact=True
+            )
+            return image.getvalue()
+
+    return run_concurrently(
+        {
+            'bb-units-vis.svg': render_image,
+            'bb-checkin-summary.csv': lambda: write_report(imbibed.write_weekly_summary, weekly),
+            'bb-checkin-styles.csv': lambda: write_report(imbibed.write_styles_summary, styles),
+            'bb-checkin-breweries.csv': lambda: write_report(imbibed.write_breweries_summary, breweries),
+        },
+        deadline
     )
 
-    image.write(image_buffer, True)
 
-    body = 'BeerBot found a check-in export in your email and' \
-           ' created the following summaries:\n\n' \
-           ' bb-checkin-summary.csv: summarises consumption and score by week\n' \
-           ' bb-checkin-styles.csv: styles you\'ve checked in, most common first\n' \
-           ' bb-checkin-breweries.csv: average score by brewery of all checkins & unique beers \n\n' \
-           'plus a visualisation of your consumption over time in bb-units-vis.svg \n\n' \
-           'bb-checkin-summary.csv may contain notes on estimated consumption: \n' \
-           '* = Some measures guessed from serving. \n' \
-           '** = Some beers skipped due to no serving or measure\n'
-    attachments = [
-        make_attachment(image_buffer, 'bb-units-vis.svg', 'image/svg+xml', disposition='inline'),
-        make_attachment(weekly_buffer, 'bb-checkin-summary.csv', 'text/csv'),
-        make_attachment(styles_buffer, 'bb-checkin-styles.csv', 'text/csv'),
-        make_attachment(breweries_buffer, 'bb-checkin-breweries.csv', 'text/csv'),
-    ]
-    send_email_response(reply_to, body, attachments)
+def write_report(writer: Callable, *args) -> str:
+    """
+    Write a report to a string, timing it as CSV writing
+
+    Args:
+        writer: Function writing the report to the buffer given as its last argument
+        args: Other arguments for the writer
+
+    Returns:
+        Report text
+    """
+    with timings.span('write csv'):
+        buffer = StringIO()
+        writer(*args, buffer)
+        return buffer.getvalue()
 
 
-def process_list_export(loaded_data: list, reply_to: str, list_name: str = None):
+def process_list_export(loaded_data: Iterable[dict], reply_to: str, list_name: str = None,
+                        cache: ResultCache = None, key: str = None, deadline: float = None,
+                        submission: Submission = None) -> bool:
     """
     Process loaded list export data to create an email containing appropriate reports, and an uploaded HTML version
 
+    The HTML version is uploaded, and its CDN cache invalidated, while the email is assembled and sent. If the export
+    was registered for coalescing, the window after its arrival is waited out before uploading, and if a newer export
+    of the list has arrived by then, only a short reply is sent.
+
     Args:
         list_name: Optional list name to store under
-        loaded_data: Unpacked JSON data
+        loaded_data: Unpacked JSON data, as a list or an iterator of list items
         reply_to: Address email was submitted from
+        cache: Result cache to fetch reports from or store them in, if any
+        key: Key of the reports in the cache
+        deadline: time.monotonic() value by which the reports must be built and uploaded, if any
+        submission: Registration of the export for coalescing, if any
 
     Returns:
+        Whether the export was processed, rather than superseded
+    """
+    reports = cached_reports(cache, key, lambda: build_list_reports(loaded_data, list_name, deadline))
+
+    if submission is not None:
+        with timings.span('coalescing wait'):
+            superseded = submission.superseded(max_wait=time_left(deadline))
+        if superseded:
+            send_superseded_response(reply_to, list_name)
+            return False
+
+    # Not a with block, which would wait for the upload even once out of time
+    pool = ThreadPoolExecutor(max_workers=REPORT_THREADS)
+    futures = []  # type: List[Future]
+    try:
+        upload = pool.submit(
+            upload_report_to_s3,
+            StringIO(reports['stocklist.html']),
+            filename='sl' if list_name is None else list_name,
+            source_address=reply_to,
+            expiry_days=get_config('upload_expiry_days'),
+            pool=pool,
+        )
+        futures.append(upload)
+
+        body = 'BeerBot found a list export in your email and generated a stock list and' \
+               ' summary of styles, attached below.'
+        attachments = [
+            make_attachment(StringIO(reports['bb-stocklist.csv']), 'bb-stocklist.csv', 'text/csv'),
+            make_attachment(StringIO(reports['bb-stocklist-summary.csv']), 'bb-stocklist-summary.csv', 'text/csv'),
+        ]
+
+        uploaded_to = upload.result(timeout=time_left(deadline))
+        if uploaded_to:
+            body += '\n\nYour list was also uploaded to a private location at %s' % uploaded_to
+            body += '\nThis location will remain constant for all future submissions from your email '
+            body += 'address with the same list name, so feel free to bookmark it.'
+
+            if list_name is None:
+                body += '\nHint: Forward your message with a subject of "List: YOUR CHOICE" to save it under ' \
+                        'that name.'
+
+        send_email_response(reply_to, body, attachments)
+    except BaseException:
+        # Let the error reply go, leaving the upload to finish or fail in the background
+        abandon_pool(pool, futures)
+        raise
+
+    # Wait for the CDN cache invalidation, as it was started in the pool
+    pool.shutdown()
+    return True
+
 
+def build_list_reports(loaded_data: Iterable[dict], list_name: str = None, deadline: float = None) -> Dict[str, str]:
     """
+    Build the reports on a list export, writing each from the stock lists in its own thread
+
+    Args:
+        loaded_data: Unpacked JSON data, as a list or an iterator of list items
+        list_name: Optional list name, to title the HTML version
+        deadline: time.monotonic() value by which the reports must be built, if any
+
+    Returns:
+        dict of filename => text
+    """
+    import stock_check  # See build_checkins_reports
+
     stocklist = []
     stocklist_styles = []
-    stock_check.build_stocklists(
-        loaded_data,
-        stocklist=stocklist,
-        style_summary=stocklist_styles
-    )
-    stocklist_buffer_csv = StringIO()
-    styles_buffer_csv = StringIO()
-    build_csv_from_list(stocklist, stocklist_buffer_csv)
-    build_csv_from_list(stocklist_styles, styles_buffer_csv)
-    del stocklist_styles
-    body = 'BeerBot found a list export in your email and generated a stock list and' \
-           ' summary of styles, attached below.'
-    attachments = [
-        make_attachment(stocklist_buffer_csv, 'bb-stocklist.csv', 'text/csv'),
-        make_attachment(styles_buffer_csv, 'bb-stocklist-summary.csv', 'text/csv'),
-    ]
-    del stocklist_buffer_csv
-    del styles_buffer_csv
-    stocklist_buffer_html = StringIO()
-    stock_check.build_html_from_list(stocklist, stocklist_buffer_html, list_name)
-    uploaded_to = upload_report_to_s3(
-        stocklist_buffer_html,
-        filename='sl' if list_name is None else list_name,
-        source_address=reply_to,
-        expiry_days=get_config('upload_expiry_days')
+    with timings.span('build stocklists'):
+        stock_check.build_stocklists(
+            loaded_data,
+            stocklist=stocklist,
+            style_summary=stocklist_styles
+        )
+    time_left(deadline)
+
+    def write_html() -> str:
+        with timings.span('write html'):
+            buffer = StringIO()
+            stock_check.build_html_from_list(stocklist, buffer, list_name)
+            return buffer.getvalue()
+
+    return run_concurrently(
+        {
+            'bb-stocklist.csv': lambda: write_report(build_csv_from_list, stocklist),
+            'bb-stocklist-summary.csv': lambda: write_report(build_csv_from_list, stocklist_styles),
+            'stocklist.html': write_html,
+        },
+        deadline
     )
-    if uploaded_to:
-        body += '\n\nYour list was also uploaded to a private location at %s' % uploaded_to
-        body += '\nThis location will remain constant for all future submissions from your email '
-        body += 'address with the same list name, so feel free to bookmark it.'
 
-        if list_name is None:
-            body += '\nHint: Forward your message with a subject of "List: YOUR CHOICE" to save it under that name.'
 
-    send_email_response(reply_to, body, attachments)
-
-
-def upload_report_to_s3(buffer: StringIO, filename: str, source_address: str, expiry_days: int = None) -> str:
+def upload_report_to_s3(buffer: StringIO, filename: str, source_address: str, expiry_days: int = None,
+                        pool: Executor = None) -> str:
     """
     Upload a file to the S3 bucket
     Args:
@@ -204,6 +606,7 @@ def upload_report_to_s3(buffer: StringIO, filename: str, source_address: str, ex
         filename: Name of the file to save
         source_address: Email address of the file's submitter
         expiry_days: Numbed of days in future for file expiry date, if any
+        pool: Executor to invalidate the CDN cache in, rather than waiting for it, if any
 
     Returns:
         URL of uploaded file
@@ -215,21 +618,24 @@ def upload_report_to_s3(buffer: StringIO, filename: str, source_address: str, ex
     upload_web_root = get_config('upload_web_root')
 
     if secret and upload_bucket and upload_web_root:
-        s3_resource = boto3.resource('s3')
-        bucket = s3_resource.Bucket(upload_bucket)
         path = sha256((get_config('secret') + '/' + source_address.lower()).encode('utf8')).hexdigest()[0:20]
         relative_path = path + '/' + filename
         expires = (datetime.now() + timedelta(expiry_days)) if expiry_days is not None else None
-        bucket.put_object(
-            Body=buffer.getvalue(),
-            Key=relative_path,
-            GrantRead='uri="http://acs.amazonaws.com/groups/global/AllUsers"',
-            ContentType='text/html',
-            Expires=expires,
-            Tagging='ReportType=Stocklist',
-        )
+        with timings.span('s3 upload'):
+            aws_client('s3').put_object(
+                Bucket=upload_bucket,
+                Body=buffer.getvalue(),
+                Key=relative_path,
+                GrantRead='uri="http://acs.amazonaws.com/groups/global/AllUsers"',
+                ContentType='text/html',
+                Expires=expires,
+                Tagging='ReportType=Stocklist',
+            )
         url_path = relative_path.replace(' ', '+')
-        invalidate_path_cache(f'/{path}/*')
+        if pool is None:
+            invalidate_path_cache(f'/{path}/*')
+        else:
+            pool.submit(invalidate_path_cache, f'/{path}/*')
         destination = upload_web_root + url_path
         debug_print('Upload to s3: %s, url: %s, expiry %s' % (relative_path, url_path, expires))
     else:
@@ -251,8 +657,7 @@ def fetch_message_from_bucket(message_id: str) -> Message:
     if not source_bucket:
         raise Exception('config { "incoming_email_bucket" } must be specified')
 
-    client = boto3.client("s3")
-    result = client.get_object(Bucket=source_bucket, Key=message_id)
+    result = aws_client('s3').get_object(Bucket=source_bucket, Key=message_id)
     # Read the object (not compressed):
     text = result["Body"].read().decode()
     parser = EmailParser()
@@ -319,18 +724,19 @@ def send_email_response(to: str, action_message: str, files: List[MIMEApplicatio
     if not files:
         files = []
 
-    client = boto3.client('ses')
+    client = aws_client('ses')
     sender = get_config('reply_from', 'BeerBot at Phase.org <no-reply@beerbot.phase.org>')
     title = 'Your Untappd submission to BeerBot'
 
     print('Sending message to %s' % to)
 
-    msg = MIMEMultipart()
-    msg.add_header('X-BEERBOT-VERSION', version)
-    msg['Subject'] = title
-    msg['From'] = sender
+    with timings.span('assemble mime'):
+        msg = MIMEMultipart()
+        msg.add_header('X-BEERBOT-VERSION', version)
+        msg['Subject'] = title
+        msg['From'] = sender
 
-    body = action_message + '''
+        body = action_message + '''
 
 BeerBot was created by @parsingphase (https://untappd.com/user/parsingphase).
 Contribute to caffeinated coding at https://ko-fi.com/parsingphase
@@ -339,21 +745,24 @@ This report was created by "%s"
 
 ''' % version
 
-    part = MIMEText(body)
-    msg.attach(part)
-
-    for part in files:
+        part = MIMEText(body)
         msg.attach(part)
 
+        for part in files:
+            msg.attach(part)
+
+        raw_message = msg.as_string()
+
     try:
         # Provide the contents of the email.
-        response = client.send_raw_email(
-            Destinations=[to],
-            RawMessage={
-                'Data': msg.as_string()
-            },
-            Source=sender
-        )
+        with timings.span('ses send'):
+            response = client.send_raw_email(
+                Destinations=[to],
+                RawMessage={
+                    'Data': raw_message
+                },
+                Source=sender
+            )
     # Display an error if something goes wrong.
     except ClientError as e:
         print(e.response['Error']['Message'])
@@ -361,6 +770,25 @@ This report was created by "%s"
         print("Email sent! Message ID:", response['MessageId'])
 
 
+def send_superseded_response(to: str, list_name: str = None):
+    """
+    Tell the sender of a list export that a newer one they sent will be processed instead
+
+    Args:
+        to: Recipient address
+        list_name: Name of the list, if given
+
+    Returns:
+
+    """
+    list_description = 'your list "%s"' % list_name if list_name else 'your list'
+    send_email_response(
+        to,
+        'BeerBot received a newer export of %s from you shortly after this one, so has only processed the newer'
+        ' export. Its reports will arrive in a separate email.' % list_description
+    )
+
+
 def make_attachment(file_data: StringIO, filename: str, mime_type: str, disposition='attachment') -> MIMEApplication:
     """
     Convert buffer into a MIME file attachment
@@ -409,18 +837,19 @@ def invalidate_path_cache(path: str):
     if cdn_id:
         debug_print('Invalidate "%s" in "%s"' % (path, cdn_id))
         try:
-            client = boto3.client('cloudfront')
+            client = aws_client('cloudfront')
             reference = datetime.now().strftime('%Y%m%d%H%M%S')
-            invalidation = client.create_invalidation(
-                DistributionId=cdn_id,
-                InvalidationBatch={
-                    'Paths': {
-                        'Quantity': 1,
-                        'Items': [path]
-                    },
-                    'CallerReference': 'beerbot_upload_' + reference
-                }
-            )
+            with timings.span('cdn invalidation'):
+                invalidation = client.create_invalidation(
+                    DistributionId=cdn_id,
+                    InvalidationBatch={
+                        'Paths': {
+                            'Quantity': 1,
+                            'Items': [path]
+                        },
+                        'CallerReference': 'beerbot_upload_' + reference
+                    }
+                )
             print({'invalidation': invalidation})
             debug_print('end invalidation')
         except Exception as e:
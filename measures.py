@@ -1,5 +1,6 @@
 import re
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, Optional, Pattern
 
 
 class Region:
@@ -17,6 +18,10 @@ class Measure:
     PINT_US = 473  # 16 oz
 
 
+MEASURE_IN_COMMENT = re.compile(r'\[([^\[\]]+)\]')  # evil thing to match!
+DIVISORS = {'quarter': 4, 'third': 3, 'half': 2}
+
+
 class MeasureProcessor:
     """
     MeasureProcessor: Convert a human-readable measure in a comment into ml
@@ -43,6 +48,9 @@ class MeasureProcessor:
     MAX_VALID_MEASURE = 2500  # For detection of valid inputs. More than a yard of ale or a Maß
     DEFAULT_UNIT = 'pint'
 
+    PARSE_CACHE_SIZE = 1024
+    _shared = {}  # type: Dict[str, MeasureProcessor]
+
     def __init__(self, region):
         if region == Region.USA or region == Region.EUROPE:
             self.region = region
@@ -67,47 +75,72 @@ class MeasureProcessor:
             self.units['ounce'] = Measure.OUNCE_UK
             self.units['oz'] = Measure.OUNCE_UK
 
+        self.grammar = self.build_grammar()
+        self._cached_parse = lru_cache(maxsize=self.PARSE_CACHE_SIZE)(self._parse_measure)
+
+    @classmethod
+    def for_region(cls, region: str) -> 'MeasureProcessor':
+        """
+        Get the shared processor for a region, so that its grammar and parse cache are reused between checkins
+
+        Args:
+            region: Region.USA or Region.EUROPE
+
+        Returns:
+            MeasureProcessor
+        """
+        if region not in cls._shared:
+            cls._shared[region] = cls(region)
+        return cls._shared[region]
+
+    def build_grammar(self) -> Pattern:
+        """
+        Compile the accepted measure formats into a single pattern
+
+        Formats are a bare unit, or a quantity, divisor word or fraction optionally followed by a unit.
+
+        Returns:
+            Compiled regular expression
+        """
+        unit_options = '|'.join(self.units.keys())
+        divisor_match = '(?P<divisor_text>' + '|'.join(DIVISORS.keys()) + ')'
+        unit_match = '(?P<unit>' + unit_options + ')s?'  # allow plurals
+        fraction_match = r'(?P<fraction>\d+/\d+)'
+        quantity_match = r'(?P<quantity>[\d\.]+)'
+        optional_space = r'\s*'
+        return re.compile(
+            '^(?:(?P<bare_unit>' + unit_options + ')s?'
+            + '|(?:' + quantity_match + '|' + divisor_match + '|' + fraction_match + ')'
+            + optional_space + '(?:' + unit_match + ')?)$'
+        )
+
     def parse_measure(self, measure_string: str) -> Optional[int]:
         """
         Read a measure as recorded in the comment field and parse it into a number of millilitres
+
+        Results are cached, as most checkins reuse a handful of measures.
+
         Args:
             measure_string: String as found in square brackets
 
         Returns:
             Integer number of ml
         """
-        divisors = {'quarter': 4, 'third': 3, 'half': 2}
-        divisor_match = '(?P<divisor_text>' + '|'.join(divisors.keys()) + ')'
+        return self._cached_parse(measure_string)
 
-        unit_match = '(?P<unit>' + '|'.join(self.units.keys()) + ')s?'  # allow plurals
-        optional_unit_match = '(' + unit_match + ')?'
-        fraction_match = r'(?P<fraction>\d+/\d+)'
-        quantity_match = r'(?P<quantity>[\d\.]+)'
-        optional_space = r'\s*'
-        candidate_matches = [
-            '^' + unit_match + '$',
-            '^' + quantity_match + optional_space + optional_unit_match + '$',
-            '^' + divisor_match + optional_space + optional_unit_match + '$',
-            '^' + fraction_match + optional_space + optional_unit_match + '$',
-        ]
-
-        match = None
+    def _parse_measure(self, measure_string: str) -> Optional[int]:
+        match = self.grammar.match(measure_string)
         quantity = None
 
-        for pattern in candidate_matches:
-            match = re.match(pattern, measure_string)
-            if match:
-                break
-
         if match:
             match_dict = match.groupdict()
-            unit = match_dict['unit'] if 'unit' in match_dict and match_dict['unit'] is not None else self.DEFAULT_UNIT
+            unit = match_dict['bare_unit'] or match_dict['unit'] or self.DEFAULT_UNIT
             quantity = self.units[unit]
-            if 'quantity' in match_dict:
+            if match_dict['quantity'] is not None:
                 quantity *= float(match_dict['quantity'])
-            elif 'divisor_text' in match_dict:
-                quantity /= divisors[match_dict['divisor_text']]
-            elif 'fraction' in match_dict:
+            elif match_dict['divisor_text'] is not None:
+                quantity /= DIVISORS[match_dict['divisor_text']]
+            elif match_dict['fraction'] is not None:
                 fraction_parts = [int(s) for s in match_dict['fraction'].split('/')]
                 quantity = quantity * fraction_parts[0] / fraction_parts[1]
 
@@ -140,7 +173,7 @@ class MeasureProcessor:
         Returns:
             int measure in ml
         """
-        measure_match = re.search(r'\[([^\[\]]+)\]', comment)  # evil thing to match!
+        measure_match = MEASURE_IN_COMMENT.search(comment)
         match_string = measure_match[1] if measure_match else None
         if match_string:
             drink_measure = self.parse_measure(match_string)
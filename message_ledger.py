@@ -0,0 +1,192 @@
+"""
+Ledger of SES messages already answered, so that a message delivered again isn't processed again
+
+SES may deliver a message more than once, and the Lambda function may be retried after it has replied. Each message
+is recorded by its messageId once its reply has been sent, and a message found in the ledger is skipped. Entries
+expire after a configurable time, after which a message would be processed again.
+"""
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import time
+from typing import Dict, Optional
+
+from aws_clients import aws_client
+from utils import get_config
+
+
+DEFAULT_EXPIRY_SECONDS = 7 * 24 * 60 * 60
+
+
+class MessageLedger(ABC):
+    """
+    Record of when each message was processed
+    """
+
+    def __init__(self, expiry_seconds: float = DEFAULT_EXPIRY_SECONDS):
+        self.expiry_seconds = expiry_seconds
+
+    def seen(self, message_id: str) -> bool:
+        """
+        Check whether a message has been processed, and its entry hasn't expired
+
+        Args:
+            message_id: SES messageId
+
+        Returns:
+            bool
+        """
+        processed_at = self.processed_at(message_id)
+        return processed_at is not None and time() - processed_at <= self.expiry_seconds
+
+    @abstractmethod
+    def processed_at(self, message_id: str) -> Optional[float]:
+        """
+        Get the timestamp at which a message was recorded as processed, if it has been
+        """
+
+    @abstractmethod
+    def record(self, message_id: str) -> None:
+        """
+        Record a message as processed now, removing expired entries if the backend needs that done
+        """
+
+
+class FileMessageLedger(MessageLedger):
+    """
+    Ledger in a local JSON file of messageId => timestamp, for a single process, eg for command-line use and tests
+    """
+
+    def __init__(self, path: str, expiry_seconds: float = DEFAULT_EXPIRY_SECONDS):
+        super().__init__(expiry_seconds)
+        self.path = path
+        self.lock = Lock()
+
+    def load(self) -> Dict[str, float]:
+        """
+        Read all entries
+
+        Returns:
+            dict of messageId => timestamp
+        """
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def processed_at(self, message_id: str) -> Optional[float]:
+        with self.lock:
+            return self.load().get(message_id)
+
+    def record(self, message_id: str) -> None:
+        with self.lock:
+            now = time()
+            entries = {key: at for key, at in self.load().items() if now - at <= self.expiry_seconds}
+            entries[message_id] = now
+            # Written alongside and moved into place, so that the file is never left half-written
+            with NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(self.path)), delete=False) as f:
+                json.dump(entries, f)
+            os.replace(f.name, self.path)
+
+
+class SQLiteMessageLedger(MessageLedger):
+    """
+    Ledger in an SQLite database file, which may be shared by processes on one machine or a mounted file system
+    """
+
+    def __init__(self, path: str, expiry_seconds: float = DEFAULT_EXPIRY_SECONDS):
+        super().__init__(expiry_seconds)
+        self.path = path
+        with self.connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS processed_messages (message_id TEXT PRIMARY KEY, processed_at REAL)'
+            )
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open a connection; each call has its own, so that records can be handled from several threads
+
+        Returns:
+            sqlite3.Connection
+        """
+        return sqlite3.connect(self.path, timeout=10)
+
+    def processed_at(self, message_id: str) -> Optional[float]:
+        connection = self.connect()
+        try:
+            row = connection.execute(
+                'SELECT processed_at FROM processed_messages WHERE message_id = ?', (message_id,)
+            ).fetchone()
+        finally:
+            connection.close()
+        return row[0] if row else None
+
+    def record(self, message_id: str) -> None:
+        now = time()
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute(
+                    'DELETE FROM processed_messages WHERE processed_at < ?', (now - self.expiry_seconds,)
+                )
+                connection.execute(
+                    'INSERT OR REPLACE INTO processed_messages (message_id, processed_at) VALUES (?, ?)',
+                    (message_id, now)
+                )
+        finally:
+            connection.close()
+
+
+class S3MessageLedger(MessageLedger):
+    """
+    Ledger of empty marker objects under a prefix of an S3 bucket, shared by every instance of the Lambda function
+
+    Expired markers are ignored but not deleted; an S3 lifecycle rule on the prefix should remove them.
+    """
+
+    def __init__(self, bucket: str, prefix: str = '', expiry_seconds: float = DEFAULT_EXPIRY_SECONDS):
+        super().__init__(expiry_seconds)
+        self.client = aws_client('s3')
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def processed_at(self, message_id: str) -> Optional[float]:
+        try:
+            marker = self.client.head_object(Bucket=self.bucket, Key=self.prefix + message_id)
+        except self.client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return marker['LastModified'].timestamp()
+
+    def record(self, message_id: str) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + message_id, Body=b'')
+
+
+def message_ledger_from_config() -> Optional[MessageLedger]:
+    """
+    Create the ledger set by the config key 'message_ledger', if any
+
+    This is a dict of either 'bucket' and optionally 'prefix', for S3, 'sqlite' (a database path) or 'file' (a JSON
+    file path), plus optional 'expiry_days'.
+
+    Returns:
+        MessageLedger or None
+    """
+    settings = get_config('message_ledger')
+    if not settings:
+        return None
+
+    expiry_seconds = settings.get('expiry_days', DEFAULT_EXPIRY_SECONDS / 86400) * 86400
+    if 'bucket' in settings:
+        return S3MessageLedger(settings['bucket'], settings.get('prefix', ''), expiry_seconds)
+    if 'sqlite' in settings:
+        return SQLiteMessageLedger(settings['sqlite'], expiry_seconds)
+    if 'file' in settings:
+        return FileMessageLedger(settings['file'], expiry_seconds)
+
+    raise Exception('config { "message_ledger" } needs a "bucket", "sqlite" or "file"')
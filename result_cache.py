@@ -0,0 +1,304 @@
+"""
+Cache of finished reports, so that an export submitted again can be answered without rebuilding them
+
+Entries are keyed by a hash of the export's bytes together with everything else that affects the reports: the
+BeerBot version and whatever the caller passes as context, eg the export type or the reports requested. Each entry
+is a JSON document holding the text of every report file, and is stored either in a local directory or under a
+prefix of an S3 bucket. Entries expire after a TTL, and the oldest are removed when the cache grows past its size
+limit. Finding those means listing every entry, so an S3 cache is only pruned once an hour by default, by each
+process writing to it; an S3 lifecycle rule on the prefix can expire entries in between.
+"""
+import json
+import os
+from abc import ABC, abstractmethod
+from hashlib import sha256
+from tempfile import NamedTemporaryFile, TemporaryFile
+from threading import Lock
+from time import time
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bot_version import version
+from utils import EXPORT_CHUNK_SIZE, get_config
+
+
+CACHE_FORMAT_VERSION = 1
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_S3_PRUNE_INTERVAL_SECONDS = 60 * 60
+ENTRY_SUFFIX = '.json'
+
+_prune_lock = Lock()
+_last_pruned = {}  # type: Dict[str, float]
+
+
+class ResultCache(ABC):
+    """
+    Store of report bundles, each a dict of filename => report text, by cache key
+    """
+
+    def __init__(self, location: str, ttl_seconds: float = DEFAULT_TTL_SECONDS, max_bytes: int = DEFAULT_MAX_BYTES,
+                 prune_interval_seconds: float = 0):
+        self.location = location
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.prune_interval_seconds = prune_interval_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        """
+        Fetch the reports stored under a key, if there are any that haven't expired
+
+        Args:
+            key: Key from cache_key
+
+        Returns:
+            dict of filename => text, or None
+        """
+        data = self.read(key)
+        if data is None:
+            return None
+
+        entry = json.loads(data)
+        if entry.get('format') != CACHE_FORMAT_VERSION or time() - entry['created'] > self.ttl_seconds:
+            self.delete(key)
+            return None
+
+        return entry['files']
+
+    def put(self, key: str, files: Dict[str, str]) -> bool:
+        """
+        Store reports under a key, then, if due, remove expired entries and, if the cache is over its size limit,
+        the oldest
+
+        Args:
+            key: Key from cache_key
+            files: dict of filename => text
+
+        Returns:
+            Whether the reports were stored; they aren't if they alone exceed the size limit
+        """
+        data = json.dumps({'format': CACHE_FORMAT_VERSION, 'created': time(), 'files': files}).encode('utf-8')
+        if len(data) > self.max_bytes:
+            return False
+
+        self.write(key, data)
+        if self.prune_due():
+            self.prune()
+        return True
+
+    def prune_due(self) -> bool:
+        """
+        Check whether the prune interval has passed since this process last pruned the cache, noting a prune if so
+
+        Returns:
+            bool
+        """
+        now = time()
+        with _prune_lock:
+            if self.location in _last_pruned and now - _last_pruned[self.location] < self.prune_interval_seconds:
+                return False
+            _last_pruned[self.location] = now
+        return True
+
+    def prune(self) -> None:
+        """
+        Remove expired entries, then the oldest entries until the cache is within its size limit
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        expired_before = time() - self.ttl_seconds
+        total_bytes = sum(size for _, size, _ in entries)
+        for key, size, modified in entries:
+            if modified >= expired_before and total_bytes <= self.max_bytes:
+                break
+            self.delete(key)
+            total_bytes -= size
+
+    @abstractmethod
+    def read(self, key: str) -> Optional[bytes]:
+        """
+        Read an entry, or return None if there isn't one
+        """
+
+    @abstractmethod
+    def write(self, key: str, data: bytes) -> None:
+        """
+        Write an entry, replacing any already stored under the key
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Delete an entry
+        """
+
+    @abstractmethod
+    def entries(self) -> List[Tuple[str, int, float]]:
+        """
+        List all entries as (key, size in bytes, last modified timestamp)
+        """
+
+
+class FileResultCache(ResultCache):
+    """
+    Result cache in a local directory, one file per entry
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float = DEFAULT_TTL_SECONDS, max_bytes: int = DEFAULT_MAX_BYTES,
+                 prune_interval_seconds: float = 0):
+        super().__init__(os.path.abspath(directory), ttl_seconds, max_bytes, prune_interval_seconds)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        """
+        Path of the file holding an entry
+
+        Args:
+            key: Cache key
+
+        Returns:
+            str
+        """
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self.path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, data: bytes) -> None:
+        # Written alongside and moved into place, so that readers never see part of an entry
+        with NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            f.write(data)
+        os.replace(f.name, self.path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        return [
+            (entry.name[:-len(ENTRY_SUFFIX)], entry.stat().st_size, entry.stat().st_mtime)
+            for entry in os.scandir(self.directory) if entry.name.endswith(ENTRY_SUFFIX)
+        ]
+
+
+class S3ResultCache(ResultCache):
+    """
+    Result cache under a prefix of an S3 bucket, one object per entry
+    """
+
+    def __init__(self, bucket: str, prefix: str = '', ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 prune_interval_seconds: float = DEFAULT_S3_PRUNE_INTERVAL_SECONDS):
+        super().__init__('s3://%s/%s' % (bucket, prefix), ttl_seconds, max_bytes, prune_interval_seconds)
+        # aws_clients loads requests and boto3, which imbibed --cache, using a local directory, doesn't need
+        from aws_clients import aws_client
+        self.client = aws_client('s3')
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key + ENTRY_SUFFIX)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def write(self, key: str, data: bytes) -> None:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.prefix + key + ENTRY_SUFFIX,
+            Body=data,
+            ContentType='application/json',
+        )
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key + ENTRY_SUFFIX)
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        entries = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                name = item['Key'][len(self.prefix):]
+                if name.endswith(ENTRY_SUFFIX):
+                    entries.append((name[:-len(ENTRY_SUFFIX)], item['Size'], item['LastModified'].timestamp()))
+        return entries
+
+
+def result_cache_from_config() -> Optional[ResultCache]:
+    """
+    Create the result cache set by the config key 'result_cache', if any
+
+    This is a dict of either 'bucket' and optionally 'prefix', for S3, or 'directory', plus optional 'ttl_days',
+    'max_bytes' and 'prune_minutes', the least time between prunes by this process.
+
+    Returns:
+        ResultCache or None
+    """
+    settings = get_config('result_cache')
+    if not settings:
+        return None
+
+    ttl_seconds = settings.get('ttl_days', DEFAULT_TTL_SECONDS / 86400) * 86400
+    max_bytes = settings.get('max_bytes', DEFAULT_MAX_BYTES)
+    if 'bucket' in settings:
+        prune_interval_seconds = settings.get('prune_minutes', DEFAULT_S3_PRUNE_INTERVAL_SECONDS / 60) * 60
+        return S3ResultCache(settings['bucket'], settings.get('prefix', ''), ttl_seconds, max_bytes,
+                             prune_interval_seconds)
+    if 'directory' in settings:
+        return FileResultCache(settings['directory'], ttl_seconds, max_bytes, settings.get('prune_minutes', 0) * 60)
+
+    raise Exception('config { "result_cache" } needs a "bucket" or "directory"')
+
+
+def cache_key(export_digest: str, **context: Any) -> str:
+    """
+    Key reports by the export they are built from, the code building them, and anything else they depend on
+
+    Args:
+        export_digest: SHA-256 hex digest of the export's bytes, as from spool_chunks
+        context: JSON-serialisable values that also change the reports, eg export type or filters
+
+    Returns:
+        Hex digest
+    """
+    key_data = {'export': export_digest, 'version': version, 'format': CACHE_FORMAT_VERSION, 'context': context}
+    return sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def spool_chunks(chunks: Iterable[bytes]) -> Tuple[str, IO[bytes]]:
+    """
+    Hash a stream of bytes while saving it to a temporary file, so that it can still be read afterwards
+
+    Args:
+        chunks: Iterable of bytes chunks, eg a download
+
+    Returns:
+        SHA-256 hex digest, and the file, rewound. The file is deleted when closed.
+    """
+    digest = sha256()
+    spool = TemporaryFile()
+    for chunk in chunks:
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return digest.hexdigest(), spool
+
+
+def file_chunks(file: IO[bytes]) -> Iterator[bytes]:
+    """
+    Read an open binary file as a series of byte chunks
+
+    Args:
+        file: File to read
+
+    Returns:
+        Iterator of bytes chunks
+    """
+    chunk = file.read(EXPORT_CHUNK_SIZE)
+    while chunk:
+        yield chunk
+        chunk = file.read(EXPORT_CHUNK_SIZE)
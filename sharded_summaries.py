@@ -0,0 +1,139 @@
+"""
+Build checkin summaries across several processes, by splitting an export into shards and merging their summaries
+
+The measure region carried from checkin to checkin is found for each shard's start with a quick pass over the
+preceding checkins, and shards are cut at day boundaries so that no day's totals are split between processes.
+Style and brewery scores are totalled across shards in a different order than by a single pass, so are summed as whole
+hundredths of a point, which are exact in any order; the merged summaries match the single-process ones exactly.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import List, Optional, Tuple
+
+import imbibed
+from checkin_table import CheckinTable, guess_region, region_after
+from dates import parse_date
+from utils import filter_source_data
+
+
+SHARD_SIZE = 20000
+
+
+def shard_bounds(checkins: List[dict], shard_size: int = SHARD_SIZE) -> List[Tuple[int, int]]:
+    """
+    Split a list of checkins into runs of roughly `shard_size`, extending each run to the end of its last day
+
+    Args:
+        checkins: Checkins from export, oldest first
+        shard_size: Number of checkins per shard, before alignment to days
+
+    Returns:
+        list of (start, end) row ranges, end being exclusive
+    """
+    bounds = []
+    start = 0
+    while start < len(checkins):
+        end = min(start + shard_size, len(checkins))
+        if end < len(checkins):
+            last_day = parse_date(checkins[end - 1]['created_at']).date()
+            while end < len(checkins) and parse_date(checkins[end]['created_at']).date() == last_day:
+                end += 1
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def summarise_shard(
+        checkins: List[dict],
+        initial_region: str,
+        vectorized: bool = False,
+) -> Tuple[dict, dict, dict, int, int]:
+    """
+    Build the daily, style and brewery summaries of one shard. Run in a worker process
+
+    Args:
+        checkins: Checkins in the shard, oldest first
+        initial_region: Region in effect before the shard's first checkin
+        vectorized: Build daily data with NumPy
+
+    Returns:
+        daily, styles and breweries summaries and first and last day ordinals
+    """
+    table = CheckinTable.from_checkins(checkins, initial_region=initial_region)
+    daily = {}  # type: dict
+    styles = {}  # type: dict
+    breweries = {}  # type: dict
+    imbibed.build_checkin_summaries(table, daily, styles=styles, breweries=breweries, vectorized=vectorized)
+    return daily, styles, breweries, table.day[0], table.day[-1]
+
+
+def build_sharded_summaries(
+        checkins: List[dict],
+        daily: dict = None,
+        weekly: dict = None,
+        styles: dict = None,
+        breweries: dict = None,
+        filter_strings: Optional[list] = None,
+        workers: Optional[int] = None,
+        shard_size: int = SHARD_SIZE,
+        vectorized: bool = False,
+) -> None:
+    """
+    Build summaries to dictionaries as provided, as imbibed.build_checkin_summaries does, using a pool of processes
+
+    Args:
+        checkins: Checkins from export, oldest first
+        daily: dict to populate with daily data
+        weekly: dict to populate with weekly data
+        styles: dict to populate with style data
+        breweries: dict to populate with brewery data
+        filter_strings: Filter rules to apply
+        workers: Number of processes, one per CPU if not set
+        shard_size: Number of checkins per shard, before alignment to days
+        vectorized: Build daily data with NumPy
+
+    Returns:
+        No return value - results are passed back by reference
+    """
+    # Filtered before sharding, so that only the checkins kept set the region, as in a single pass
+    if filter_strings:
+        checkins = filter_source_data(filter_strings, checkins)
+    shards = [checkins[start:end] for start, end in shard_bounds(checkins, shard_size)]
+
+    # Each shard starts with the region the checkins before it leave in effect
+    regions = []
+    region = guess_region(checkins)
+    for shard in shards:
+        regions.append(region)
+        region = region_after(shard, region)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            summarise_shard,
+            shards,
+            regions,
+            [vectorized] * len(shards)
+        )
+        parts = list(results)
+
+    if not parts:
+        raise Exception('No dated checkins found')
+
+    if daily is None:
+        daily = {}
+
+    # Merged in shard order, so that keys are ordered as a single pass over the checkins would order them
+    for shard_daily, shard_styles, shard_breweries, _, _ in parts:
+        imbibed.merge_daily_summary(daily, shard_daily)
+        if styles is not None:
+            imbibed.merge_styles_summary(styles, shard_styles)
+        if breweries is not None:
+            imbibed.merge_breweries_summary(breweries, shard_breweries)
+
+    if weekly is not None:
+        imbibed.build_weekly_summary(
+            daily,
+            weekly,
+            first_date=date.fromordinal(parts[0][3]),
+            last_date=date.fromordinal(parts[-1][4])
+        )
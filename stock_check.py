@@ -3,17 +3,17 @@
 Analyze stock data. Run from cli with --help for details.
 """
 import argparse
-import json
 import sys
 from abc import ABC, abstractmethod
 from datetime import date, datetime
-from typing import Dict, List, Optional, TextIO, Union
+from typing import Dict, Iterable, List, Optional, TextIO, Union
 from urllib.parse import quote as quote_url
 
 from dateutil.relativedelta import relativedelta
 
+import timings
 from bot_version import version
-from utils import build_csv_from_list, file_contents
+from utils import build_csv_from_list, iter_export_items
 
 
 class TaggedText(ABC):
@@ -56,13 +56,13 @@ class LinkedText(TaggedText):
         return f'<a href="{self.url}">{self.text}</a>' if self.url else self.text
 
 
-def generate_stocklist_files(source_data: list, stocklist_output: TextIO = None,
+def generate_stocklist_files(source_data: Iterable[dict], stocklist_output: TextIO = None,
                              styles_output: TextIO = None) -> None:
     """
     Convert the parsed JSON from a list feed into a CSV reporting stock levels and expiry
 
     Args:
-        source_data: json data parsed into a list
+        source_data: json data parsed into a list, or an iterator of list items
         stocklist_output: buffer to write stock list to
         styles_output: buffer to write styles summary to
     """
@@ -78,19 +78,19 @@ def generate_stocklist_files(source_data: list, stocklist_output: TextIO = None,
         build_csv_from_list(style_summary, styles_output)
 
 
-def build_stocklists(source_data: list, stocklist: list = None, style_summary: list = None) -> None:
+def build_stocklists(source_data: Iterable[dict], stocklist: list = None, style_summary: list = None) -> None:
     """
     Assemble JSON data from stock list export into lists for subsequent writing to selected file format
 
     Args:
-        source_data: Source data unpacked from JSON
+        source_data: Source data unpacked from JSON, as a list or an iterator of list items
         stocklist:
         style_summary:
 
     Returns:
 
     """
-    # pylint: disable=R0912,R0914
+    # pylint: disable=R0912,R0914,R0915
     thresholds = [
         {'description': 'Undated beers', 'ends': '0000-00-00'},
         {'description': 'Expired beers', 'ends': date.today().strftime('%Y-%m-%d')},
@@ -101,14 +101,18 @@ def build_stocklists(source_data: list, stocklist: list = None, style_summary: l
     expiry_sets = [{} for _ in range(len(thresholds))]  # type: List[Dict]
     styles = {}  # type: Dict
     list_has_quantities = False
+    total_items = 0
+    total_quantity = 0
 
     for item in source_data:
         style = item['beer_type'].split(' -')[0].strip()
+        total_items += 1
 
         if 'quantity' in item:
             if style not in styles:
                 styles[style] = 0
             styles[style] += int(item['quantity'])
+            total_quantity += int(item['quantity'])
             list_has_quantities = True
         else:
             if style not in styles:
@@ -188,10 +192,7 @@ def build_stocklists(source_data: list, stocklist: list = None, style_summary: l
         if list_has_quantities:
             stocklist.append(
                 [
-                    'TOTAL: %d items of %d beers' % (
-                        sum([int(item['quantity']) for item in source_data]),
-                        len(source_data)
-                    )
+                    'TOTAL: %d items of %d beers' % (total_quantity, total_items)
                 ]
             )
 
@@ -216,13 +217,17 @@ def parse_cli_args() -> argparse.Namespace:
     """
     parser = argparse.ArgumentParser(
         description='Summarise expiry dates and types of beers on a list',
-        usage=sys.argv[0] + ' SOURCE [--output OUTPUT] [--summary|--html] [--help]'
+        usage=sys.argv[0] + ' SOURCE [--output OUTPUT] [--summary|--html] [--profile|--profile-memory] [--help]'
     )
     parser.add_argument('source', help='Path to source file (export.json)')
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--html', help='Export stocklist as html instead of csv', action='store_true')
     group.add_argument('--summary', help='Generate a summary of styles rather than a full list', action='store_true')
     parser.add_argument('--output', required=False, help='Path to output file, STDOUT if not specified')
+    parser.add_argument('--profile', help='Print time taken by each stage to STDERR', action='store_true')
+    parser.add_argument('--profile-memory',
+                        help='As --profile, also tracing peak & retained memory of each stage (slow)',
+                        action='store_true')
     args = parser.parse_args()
     return args
 
@@ -337,20 +342,29 @@ def run_cli():
     else:
         output_handle = sys.stdout
 
-    source_data = json.loads(file_contents(source))
+    if args.profile or args.profile_memory:
+        timings.start_profile(trace_memory=args.profile_memory)
 
-    if args.summary:
-        generate_stocklist_files(source_data, styles_output=output_handle)
-    elif args.html:
-        stocklist = []
-        build_stocklists(source_data, stocklist=stocklist)
-        build_html_from_list(stocklist, stocklist_output=output_handle)
-    else:
-        generate_stocklist_files(source_data, stocklist_output=output_handle)
+    source_data = timings.iterate('decode', iter_export_items(source), count_name='items')
+
+    with timings.span('build stocklists'):
+        if args.summary:
+            generate_stocklist_files(source_data, styles_output=output_handle)
+        elif args.html:
+            stocklist = []
+            build_stocklists(source_data, stocklist=stocklist)
+            with timings.span('write html'):
+                build_html_from_list(stocklist, stocklist_output=output_handle)
+        else:
+            generate_stocklist_files(source_data, stocklist_output=output_handle)
 
     if dest:
         output_handle.close()
 
+    profile = timings.stop_profile()
+    if profile:
+        print(profile.report(), file=sys.stderr)
+
 
 if __name__ == '__main__':
     run_cli()
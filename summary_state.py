@@ -0,0 +1,159 @@
+"""
+Persisted checkin summaries, so that a new export only needs its new checkins processed
+"""
+import json
+import os
+from datetime import date
+from hashlib import sha256
+from typing import Iterable, List, Optional
+
+import imbibed
+from bot_version import version
+from checkin_table import CheckinTable
+from measures import Measure, MeasureProcessor
+from utils import iter_filtered_items
+
+
+STATE_FORMAT_VERSION = 2
+
+
+def measures_fingerprint() -> str:
+    """
+    Hash the measure defaults, so that a change to them invalidates saved summaries
+
+    Returns:
+        hex digest
+    """
+    defaults = {
+        'serving_sizes': MeasureProcessor.DEFAULT_SERVING_SIZES,
+        'measures': {k: v for k, v in vars(Measure).items() if not k.startswith('_')},
+        'max_valid_measure': MeasureProcessor.MAX_VALID_MEASURE,
+        'default_unit': MeasureProcessor.DEFAULT_UNIT,
+    }
+    return sha256(json.dumps(defaults, sort_keys=True).encode('utf8')).hexdigest()
+
+
+class SummaryState:
+    """
+    Daily, style and brewery summaries of all checkins seen so far, plus the point reached in the checkin history
+
+    Saved state records the format version, code version, measure defaults and filters it was built with,
+    and is discarded on load if any of those have changed.
+    """
+
+    def __init__(self, filter_strings: Optional[list] = None):
+        self.stamp = {
+            'format': STATE_FORMAT_VERSION,
+            'version': version,
+            'measures': measures_fingerprint(),
+            'filters': list(filter_strings or []),
+        }  # type: dict
+        self.daily = {}  # type: dict
+        self.styles = {}  # type: dict
+        self.breweries = {}  # type: dict
+        self.last_checkin_id = 0
+        self.first_date = None  # type: Optional[str]
+        self.last_date = None  # type: Optional[str]
+        self.region = None  # type: Optional[str]
+
+    @classmethod
+    def load(cls, path: str, filter_strings: Optional[list] = None) -> 'SummaryState':
+        """
+        Load saved state, or start afresh if there is none or it is out of date
+
+        Args:
+            path: Path of state file
+            filter_strings: Filter rules that will be applied to checkins
+
+        Returns:
+            SummaryState
+        """
+        state = cls(filter_strings)
+        if not os.path.exists(path):
+            return state
+
+        with open(path, 'r') as f:
+            saved = json.load(f)
+
+        if saved.get('stamp') != state.stamp:
+            return state
+
+        for key in ('daily', 'styles', 'breweries', 'last_checkin_id', 'first_date', 'last_date', 'region'):
+            setattr(state, key, saved[key])
+
+        return state
+
+    def save(self, path: str) -> None:
+        """
+        Save state to file. Must be called before summaries are written out, as the writers alter them
+
+        Args:
+            path: Path of state file
+        """
+        saved = {
+            'stamp': self.stamp,
+            'daily': self.daily,
+            'styles': self.styles,
+            'breweries': self.breweries,
+            'last_checkin_id': self.last_checkin_id,
+            'first_date': self.first_date,
+            'last_date': self.last_date,
+            'region': self.region,
+        }
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(saved, f)
+        os.replace(temporary_path, path)
+
+    def update(self, source_data: Iterable[dict]) -> int:
+        """
+        Add checkins newer than any already seen to the summaries
+
+        Args:
+            source_data: Data unpacked from JSON source, as a list or an iterator of checkins, oldest first
+
+        Returns:
+            Number of new checkins, before filtering
+        """
+        def unseen_checkins():
+            for checkin in source_data:
+                if int(checkin['checkin_id']) > self.last_checkin_id:
+                    newest_checkin_ids.append(int(checkin['checkin_id']))
+                    yield checkin
+
+        newest_checkin_ids = []  # type: List[int]
+        filter_strings = self.stamp['filters']
+        checkins = unseen_checkins()  # type: Iterable[dict]
+        if filter_strings:
+            checkins = iter_filtered_items(filter_strings, checkins)
+        table = CheckinTable.from_checkins(checkins, initial_region=self.region)
+        if not newest_checkin_ids:
+            return 0
+
+        self.last_checkin_id = max(newest_checkin_ids)
+        if len(table):
+            # Only checkins that pass the filters set the region, as when filtering a whole export
+            self.region = table.last_region
+            imbibed.build_checkin_summaries(table, self.daily, styles=self.styles, breweries=self.breweries)
+            if self.first_date is None:
+                self.first_date = date.fromordinal(table.day[0]).isoformat()
+            self.last_date = date.fromordinal(table.day[-1]).isoformat()
+
+        return len(newest_checkin_ids)
+
+    def weekly(self) -> dict:
+        """
+        Roll the daily summary up into weeks
+
+        Returns:
+            Weekly data, as from build_checkin_summaries
+        """
+        weekly = {}  # type: dict
+        if self.first_date and self.last_date:
+            imbibed.build_weekly_summary(
+                self.daily,
+                weekly,
+                first_date=date.fromisoformat(self.first_date),
+                last_date=date.fromisoformat(self.last_date)
+            )
+        return weekly
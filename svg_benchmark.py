@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Compare the SVG calendar backends, drawing and writing grids of synthetic daily values spanning several years.
+The native backend is timed both with the year skeletons it keeps from earlier drawings, as in a warm Lambda
+container, and without them. The size and time of each output mode are then compared. Run with --help for details
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import date, timedelta
+from io import StringIO
+from typing import Dict, List
+
+from svg_calendar import draw_daily_count_image
+from svg_calendar.canvas import clear_fragment_cache, gzip_svg
+from svg_calendar.daily_grid import DEFAULT_PALETTE_STEPS
+
+
+DEFAULT_YEARS = [1, 5, 15]
+DEFAULT_REPEAT = 3
+LAST_DAY = date(2020, 12, 31)
+DRINKING_DAY_FRACTION = 0.6
+
+# Name => backend, and whether to discard kept fragments before each run
+VARIANTS = {
+    'native': ('native', False),
+    'native (cold)': ('native', True),
+    'svgwrite': ('svgwrite', False),
+}
+
+# Name => options for draw_daily_count_image, and whether to gzip the output
+MODES = {
+    'pretty': ({}, False),
+    'palette': ({'palette_steps': DEFAULT_PALETTE_STEPS}, False),
+    'compact': ({'palette_steps': DEFAULT_PALETTE_STEPS, 'compact': True}, False),
+    'compact svgz': ({'palette_steps': DEFAULT_PALETTE_STEPS, 'compact': True}, True),
+}
+
+
+def generate_daily_count(years: int, seed: int = 1) -> Dict[str, float]:
+    """
+    Generate daily values for some of the days in a span of whole years
+
+    Args:
+        years: Number of years, ending with LAST_DAY
+        seed: Random seed
+
+    Returns:
+        Map of date string => value
+    """
+    rng = random.Random(seed)
+    day = date(LAST_DAY.year - years + 1, 1, 1)
+    daily_count = {}
+    while day <= LAST_DAY:
+        if rng.random() < DRINKING_DAY_FRACTION:
+            daily_count[day.isoformat()] = round(rng.uniform(0.5, 12), 1)
+        day += timedelta(days=1)
+    return daily_count
+
+
+def time_backend(daily_count: Dict[str, float], backend: str, repeat: int, cold: bool = False) -> dict:
+    """
+    Time drawing a calendar and writing it out, as the scripts do, returning the best of several runs
+
+    Args:
+        daily_count: Map of date string => value
+        backend: One of SVG_BACKENDS
+        repeat: Number of runs
+        cold: Whether to discard fragments kept from earlier drawings before each run
+
+    Returns:
+        dict of 'draw' and 'write' seconds, and the 'svg' written
+    """
+    best = None
+    for _ in range(repeat):
+        if cold:
+            clear_fragment_cache()
+        started = time.perf_counter()
+        image = draw_daily_count_image(daily_count, True, 'Daily units', backend=backend)
+        drawn = time.perf_counter()
+        buffer = StringIO()
+        image.write(buffer, pretty=True)
+        written = time.perf_counter()
+        if best is None or written - started < best['draw'] + best['write']:
+            best = {'draw': drawn - started, 'write': written - drawn, 'svg': buffer.getvalue()}
+    return best
+
+
+def time_mode(daily_count: Dict[str, float], options: dict, gzipped: bool, repeat: int) -> dict:
+    """
+    Time drawing and writing a calendar with the native backend in one output mode, returning the best of several runs
+
+    Args:
+        daily_count: Map of date string => value
+        options: Keyword arguments for draw_daily_count_image
+        gzipped: Whether to gzip the output, as for an .svgz file
+        repeat: Number of runs
+
+    Returns:
+        dict of 'seconds' and output 'bytes'
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        svg = draw_daily_count_image(daily_count, True, 'Daily units', **options).getvalue(pretty=True)
+        output = gzip_svg(svg) if gzipped else svg.encode('utf-8')
+        seconds = time.perf_counter() - started
+        if best is None or seconds < best['seconds']:
+            best = {'seconds': seconds, 'bytes': len(output)}
+    return best
+
+
+def parse_cli_args() -> argparse.Namespace:
+    """
+    Specify and parse command-line arguments
+
+    Returns:
+        Namespace of provided arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Compare the time taken by each SVG backend to draw and write calendars',
+        usage=sys.argv[0] + ' [--years N ...] [--repeat N] [--help]'
+    )
+    parser.add_argument('--years', type=int, nargs='+', default=DEFAULT_YEARS,
+                        help='Years spanned by each calendar (default %s)' % DEFAULT_YEARS)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='Runs per timing, best is reported (default %d)' % DEFAULT_REPEAT)
+    args = parser.parse_args()
+    return args
+
+
+def run_cli():
+    """
+    Run the comparison at the command line. Exits with status 1 if the backends' output differs
+    """
+    args = parse_cli_args()
+    print('%6s %14s %10s %10s %10s %9s %s' % ('years', 'backend', 'draw (s)', 'write (s)', 'total (s)', 'speedup',
+                                              'output'))
+    mismatched = []  # type: List[int]
+    for years in args.years:
+        daily_count = generate_daily_count(years)
+        results = {
+            name: time_backend(daily_count, backend, args.repeat, cold) for name, (backend, cold) in VARIANTS.items()
+        }
+        baseline = results['svgwrite']
+        for name, result in results.items():
+            total = result['draw'] + result['write']
+            same = result['svg'] == baseline['svg']
+            if not same:
+                mismatched.append(years)
+            print('%6d %14s %10.4f %10.4f %10.4f %8.1fx %s' % (
+                years, name, result['draw'], result['write'], total,
+                (baseline['draw'] + baseline['write']) / total, 'identical' if same else 'DIFFERS'
+            ))
+
+    print()
+    print('%6s %14s %10s %10s %9s' % ('years', 'mode', 'total (s)', 'bytes', 'size'))
+    for years in args.years:
+        daily_count = generate_daily_count(years)
+        results = {name: time_mode(daily_count, options, gzipped, args.repeat)
+                   for name, (options, gzipped) in MODES.items()}
+        for name, result in results.items():
+            print('%6d %14s %10.4f %10d %8.1f%%' % (
+                years, name, result['seconds'], result['bytes'], 100 * result['bytes'] / results['pretty']['bytes']
+            ))
+
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run_cli()
@@ -1 +1,3 @@
+from .canvas import SVG_BACKENDS  # noqa F401
 from .daily_grid import draw_daily_count_image  # noqa F401
+from .daily_grid import draw_daily_count_images  # noqa F401
@@ -0,0 +1,328 @@
+"""
+Canvases to draw the calendar on, each able to write itself out as an SVG document
+
+The native canvas formats each shape's markup as it is added, so drawing and writing a grid of thousands of days
+needs no object tree. Its output matches svgwrite's byte for byte when written with pretty=True, as all callers do,
+on Python 3.8 and later, and is equivalent XML otherwise. The svgwrite canvas remains as a fallback, and for
+comparison.
+
+A compact native canvas writes the smallest equivalent document instead, eg for email attachments: no XML
+declaration or unused namespaces, whole numbers without '.0', and no whitespace between elements or within the
+stylesheet. Any canvas saved to a '.svgz' file is gzipped.
+"""
+import gzip
+import re
+from abc import ABC, abstractmethod
+from io import BytesIO, StringIO
+from threading import Lock
+from typing import (IO, Callable, Dict, Hashable, List, Optional, Sequence,
+                    Tuple)
+
+
+SVG_BACKENDS = ('native', 'svgwrite')
+DEFAULT_BACKEND = 'native'
+
+XML_DECLARATION = '<?xml version="1.0" encoding="utf-8" ?>\n'
+SVG_NAMESPACES = 'xmlns="http://www.w3.org/2000/svg" xmlns:ev="http://www.w3.org/2001/xml-events"' \
+                 ' xmlns:xlink="http://www.w3.org/1999/xlink"'
+PRETTY_INDENT = '  '
+SVGZ_EXTENSION = '.svgz'
+FRAGMENT_CACHE_SIZE = 256
+
+_fragment_lock = Lock()
+_fragments = {}  # type: Dict[Hashable, List[Tuple[str, Optional[str]]]]
+
+
+class Canvas(ABC):
+    """
+    Surface that shapes are added to in drawing order, then written out as SVG
+    """
+
+    @abstractmethod
+    def add_rect(self, x: float, y: float, width: float, height: float, fill: str = None, title: str = None,
+                 class_: str = None):
+        """
+        Add a rectangle, optionally with a title shown on hover, filled directly or by its CSS class
+        """
+
+    @abstractmethod
+    def add_text(self, text, x: float, y: float, class_: str, fill: str = None):
+        """
+        Add a text label, styled by its CSS class
+        """
+
+    @abstractmethod
+    def add_polyline(self, points: Sequence[Tuple[float, float]], fill: str):
+        """
+        Add a filled polyline
+        """
+
+    @abstractmethod
+    def write(self, fileobj: IO[str], pretty: bool = False):
+        """
+        Write the SVG document, including its XML declaration, to a text file
+        """
+
+    def add_fragment(self, key: Hashable, draw: Callable[['Canvas'], None]):
+        """
+        Add shapes that depend only on the key, which canvases able to do so keep and reuse for later drawings
+
+        Args:
+            key: Everything the shapes depend on
+            draw: Function adding the shapes to the canvas it is given
+
+        Returns:
+
+        """
+        draw(self)
+
+    def saveas(self, filename: str, pretty: bool = False):
+        """
+        Write the SVG document to a file
+
+        Args:
+            filename: Path to write to
+            pretty: Whether to indent elements one per line
+
+        Returns:
+
+        """
+        if filename.endswith(SVGZ_EXTENSION):
+            with open(filename, 'wb') as svgz:
+                svgz.write(gzip_svg(self.getvalue(pretty)))
+        else:
+            with open(filename, 'w', encoding='utf-8') as f:
+                self.write(f, pretty)
+
+    def getvalue(self, pretty: bool = False) -> str:
+        """
+        Get the SVG document as a string
+
+        Args:
+            pretty: Whether to indent elements one per line
+
+        Returns:
+            str
+        """
+        buffer = StringIO()
+        self.write(buffer, pretty)
+        return buffer.getvalue()
+
+
+class NativeCanvas(Canvas):
+    """
+    Canvas that keeps the markup of each shape as a string
+    """
+
+    def __init__(self, width: int, height: int, css: str, compact: bool = False):
+        self.width = width
+        self.height = height
+        self.css = css
+        self.compact = compact
+        self.number = str  # type: Callable[[float], str]
+        if compact:
+            self.number = compact_number
+        # Each element is (markup, None) if it fits on one line, else (start tag, child element markup)
+        self.elements = []  # type: List[Tuple[str, Optional[str]]]
+
+    def add_rect(self, x: float, y: float, width: float, height: float, fill: str = None, title: str = None,
+                 class_: str = None):
+        number = self.number
+        start = '<rect%s%s height="%s" width="%s" x="%s" y="%s"' % (
+            ' class="%s"' % escape(class_) if class_ else '', ' fill="%s"' % escape(fill) if fill else '',
+            number(height), number(width), number(x), number(y)
+        )
+        if title is None:
+            self.elements.append((start + '/>', None))
+        else:
+            self.elements.append((start + '>', '<title>%s</title>' % escape(title)))
+
+    def add_text(self, text, x: float, y: float, class_: str, fill: str = None):
+        start = '<text class="%s"%s x="%s" y="%s"' % (
+            escape(class_), ' fill="%s"' % escape(fill) if fill else '', self.number(x), self.number(y)
+        )
+        text = escape(text)
+        self.elements.append((start + ('>%s</text>' % text if text else '/>'), None))
+
+    def add_polyline(self, points: Sequence[Tuple[float, float]], fill: str):
+        number = self.number
+        self.elements.append(('<polyline fill="%s" points="%s"/>' % (
+            escape(fill), ' '.join('%s,%s' % (number(x), number(y)) for x, y in points)
+        ), None))
+
+    def add_fragment(self, key: Hashable, draw: Callable[[Canvas], None]):
+        key = (self.compact, key)
+        fragment = _fragments.get(key)
+        if fragment is None:
+            scratch = NativeCanvas(0, 0, '', self.compact)
+            draw(scratch)
+            fragment = scratch.elements
+            with _fragment_lock:
+                if len(_fragments) >= FRAGMENT_CACHE_SIZE:
+                    del _fragments[next(iter(_fragments))]  # Oldest first
+                _fragments[key] = fragment
+        self.elements.extend(fragment)
+
+    def write(self, fileobj: IO[str], pretty: bool = False):
+        """
+        Write the SVG document to a text file; a compact canvas is always written compactly
+        """
+        if self.compact:
+            fileobj.write(''.join(
+                ['<svg xmlns="http://www.w3.org/2000/svg" height="%d" width="%d"><style>%s</style>' % (
+                    self.height, self.width, escape(minify_css(self.css))
+                )]
+                + [markup if child is None else markup + child + markup[:markup.index(' ')].replace('<', '</') + '>'
+                   for markup, child in self.elements]
+                + ['</svg>']
+            ))
+            return
+
+        if pretty:
+            separator, indent = '\n', PRETTY_INDENT
+        else:
+            separator, indent = '', ''
+        child_indent = separator + indent + indent
+
+        parts = [
+            XML_DECLARATION,
+            '<svg %s baseProfile="full" height="%dpx" version="1.1" width="%dpx">' % (
+                SVG_NAMESPACES, self.height, self.width
+            ),
+            separator + indent + '<defs>',
+            child_indent + '<style type="text/css"><![CDATA[%s]]></style>' % self.css,
+            separator + indent + '</defs>',
+        ]
+        for markup, child in self.elements:
+            if child is None:
+                parts.append(separator + indent + markup)
+            else:
+                name = markup[1:markup.index(' ')]
+                parts.append('%s%s%s%s%s%s</%s>' % (
+                    separator, indent, markup, child_indent, child, separator + indent, name
+                ))
+        parts.append(separator + '</svg>' + separator)
+        fileobj.write(''.join(parts))
+
+
+class SvgwriteCanvas(Canvas):
+    """
+    Canvas building an svgwrite Drawing
+    """
+
+    def __init__(self, width: int, height: int, css: str):
+        # Only loaded when needed, as it's slow to import
+        from svgwrite import Drawing  # type: ignore
+        self.drawing = Drawing(size=('%dpx' % width, '%dpx' % height))
+        self.drawing.defs.add(self.drawing.style(css))
+
+    def add_rect(self, x: float, y: float, width: float, height: float, fill: str = None, title: str = None,
+                 class_: str = None):
+        extra = {'fill': fill} if fill else {}
+        if class_:
+            extra['class_'] = class_
+        rect = self.drawing.rect(insert=(x, y), size=(width, height), **extra)
+        if title is not None:
+            rect.set_desc(title=title)
+        self.drawing.add(rect)
+
+    def add_text(self, text, x: float, y: float, class_: str, fill: str = None):
+        extra = {'fill': fill} if fill else {}
+        self.drawing.add(self.drawing.text(text, insert=(x, y), class_=class_, **extra))
+
+    def add_polyline(self, points: Sequence[Tuple[float, float]], fill: str):
+        self.drawing.add(self.drawing.polyline(points, fill=fill))
+
+    def write(self, fileobj: IO[str], pretty: bool = False):
+        self.drawing.write(fileobj, pretty=pretty)
+
+
+def make_canvas(width: int, height: int, css: str, backend: str = None, compact: bool = False) -> Canvas:
+    """
+    Create a blank canvas
+
+    Args:
+        width: Width in pixels
+        height: Height in pixels
+        css: Stylesheet to embed
+        backend: One of SVG_BACKENDS, DEFAULT_BACKEND if not given
+        compact: Whether to write the smallest equivalent document, which only the native backend can do
+
+    Returns:
+        Canvas
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == 'native':
+        return NativeCanvas(width, height, css, compact)
+    if backend == 'svgwrite':
+        if compact:
+            raise Exception('Compact SVG output needs the native backend')
+        return SvgwriteCanvas(width, height, css)
+
+    raise Exception('Unknown SVG backend "%s", expected one of %s' % (backend, ', '.join(SVG_BACKENDS)))
+
+
+def clear_fragment_cache():
+    """
+    Discard all fragments kept by native canvases
+    """
+    with _fragment_lock:
+        _fragments.clear()
+
+
+def compact_number(value: float) -> str:
+    """
+    Format a number as briefly as str() does, but without '.0' on whole numbers
+
+    Args:
+        value: int or float
+
+    Returns:
+        str
+    """
+    if isinstance(value, float) and value.is_integer():
+        return '%d' % value
+    return str(value)
+
+
+def minify_css(css: str) -> str:
+    """
+    Remove whitespace that doesn't affect a stylesheet whose selectors don't use pseudo-classes, like ours
+
+    Args:
+        css: Stylesheet
+
+    Returns:
+        str
+    """
+    return re.sub(r'\s*([{};:,])\s*', r'\1', re.sub(r'\s+', ' ', css)).replace(';}', '}').strip()
+
+
+def gzip_svg(svg: str) -> bytes:
+    """
+    Compress an SVG document as the contents of an .svgz file, leaving out the timestamp so that output is repeatable
+
+    Args:
+        svg: SVG document
+
+    Returns:
+        bytes
+    """
+    buffer = BytesIO()
+    # gzip.compress() only takes mtime from Python 3.8
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as f:
+        f.write(svg.encode('utf-8'))
+    return buffer.getvalue()
+
+
+def escape(value) -> str:
+    """
+    Escape a value for use as XML text or a double-quoted attribute, as svgwrite's pretty output does
+
+    Args:
+        value: Value, converted with str()
+
+    Returns:
+        str
+    """
+    return str(value).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
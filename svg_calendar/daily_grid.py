@@ -1,9 +1,10 @@
 from datetime import date, timedelta
 from math import ceil
-from typing import Tuple
+from typing import Dict, Iterable, Optional, Tuple
 
-from dateutil.parser import parse as parse_date
-from svgwrite import Drawing
+from dates import parse_date
+
+from .canvas import Canvas, make_canvas
 
 
 GRID_PITCH = 15
@@ -13,6 +14,7 @@ LEGEND_GRID = {'height': 50, 'left': 480, 'pitch': 32, 'cell_height': 22, 'cell_
 
 COLOR_LOW = (0xff, 0xff, 0xaa)
 COLOR_HIGH = (0xaa, 0x22, 0x00)
+DEFAULT_PALETTE_STEPS = 16
 
 CSS = """
     year { font-weight: bold; font-size: 14px }
@@ -32,17 +34,6 @@ def grid_size(rows: int, columns: int) -> Tuple[int, int]:
 
 
 # SVG puts 0,0 at top left
-def square_in_grid(image: Drawing, row: int, column: int, fill, offsets=(), title=None):
-    x_offset = offsets[0] if len(offsets) else 0
-    y_offset = offsets[1] if len(offsets) > 1 else 0
-    left = grid_square_left(column, x_offset)
-    top = grid_square_top(row, y_offset)
-    rect = image.rect(insert=(left, top), size=(GRID_SQUARE, GRID_SQUARE), fill=fill)
-    if title is not None:
-        rect.set_desc(title=title)
-    return rect
-
-
 def grid_square_top(row, y_offset=0):
     return GRID_BORDERS['top'] + (row - 1) * GRID_PITCH + y_offset
 
@@ -69,39 +60,120 @@ def fractional_fill_color(fraction: float) -> str:
     return color_string
 
 
-def draw_daily_count_image(daily_count: dict, show_legend: bool, legend_title: str = '', range_min=0) -> Drawing:
-    years = set([parse_date(d).year for d in daily_count])
+def palette_css(steps: int) -> str:
+    """
+    Style rules filling the day squares of each palette class, p0 (lightest) to p{steps - 1}
+
+    Args:
+        steps: Number of colors
+
+    Returns:
+        CSS
+    """
+    return ''.join(
+        '    rect.p%d { fill: %s }\n' % (step, fractional_fill_color(step / (steps - 1))) for step in range(steps)
+    )
+
+
+def palette_class(fraction: float, steps: int) -> str:
+    """
+    Get the palette class nearest to a position between our two configured limits
+
+    Args:
+        fraction: 0-1 value of position between limits
+        steps: Number of colors in the palette
+
+    Returns:
+        CSS class name
+    """
+    return 'p%d' % min(steps - 1, max(0, round(fraction * (steps - 1))))
+
+
+def draw_daily_count_images(daily_counts: Dict[str, dict], show_legend: bool, legend_titles: Dict[str, str] = None,
+                            range_mins: Dict[str, int] = None, backend: str = None,
+                            palette_steps: Optional[int] = None, compact: bool = False) -> Dict[str, Canvas]:
+    """
+    Draw a calendar grid for each of several measures, placing each date's square once for all of them
+
+    Args:
+        daily_counts: Map of measure => map of date string => value
+        show_legend: Whether to add a key to the shading
+        legend_titles: Map of measure => title of its key
+        range_mins: Map of measure => value shaded lightest, 0 if not given
+        backend: One of SVG_BACKENDS, 'native' by default
+        palette_steps: If given, shade days with this many colors, set by CSS classes, rather than each its own fill
+        compact: Whether to write the smallest equivalent documents; needs the native backend
+
+    Returns:
+        Map of measure => Canvas
+    """
+    squares = date_squares(set().union(*daily_counts.values()))
+    return {
+        measure: draw_daily_count_image(
+            daily_count, show_legend, (legend_titles or {}).get(measure, ''), (range_mins or {}).get(measure, 0),
+            backend, palette_steps, compact, squares
+        )
+        for measure, daily_count in daily_counts.items()
+    }
+
+
+def draw_daily_count_image(daily_count: dict, show_legend: bool, legend_title: str = '', range_min=0,
+                           backend: str = None, palette_steps: Optional[int] = None, compact: bool = False,
+                           squares: Dict[str, Tuple[int, int, int, str]] = None) -> Canvas:
+    """
+    Draw a calendar grid of daily values, each day shaded by its value
+
+    Args:
+        daily_count: Map of date string => value, or None if unknown
+        show_legend: Whether to add a key to the shading
+        legend_title: Title of the key
+        range_min: Value shaded lightest
+        backend: One of SVG_BACKENDS, 'native' by default
+        palette_steps: If given, shade days with this many colors, set by CSS classes, rather than each its own fill
+        compact: Whether to write the smallest equivalent document; needs the native backend
+        squares: Square of each date, as from date_squares, if already worked out
+
+    Returns:
+        Canvas, to write out with write() or saveas()
+    """
+    if squares is None:
+        squares = date_squares(daily_count)
+    years = set([squares[d][0] for d in daily_count])
     min_year = min(years)
     num_years = 1 + max(years) - min_year
     width, height_per_year = grid_size(7, 54)  # 52 weeks + ISO weeks 0, 53
     image_height = height_per_year * num_years + (LEGEND_GRID['height'] if show_legend else 0)
-    image = init_image(width, image_height)
+    css = CSS + palette_css(palette_steps) if palette_steps else CSS
+    image = init_image(width, image_height, backend, css, compact)
 
+    today = date.today()
     for year in years:
         year_top = (height_per_year * (year - min_year))
-        months = draw_year_labels(image, year, year_top)
-
-        for month_index, month in enumerate(months):
-            # Draw lines between months
-            draw_month_boundary(image, month_index + 1, year, year_top)
+        # Labels and month boundaries only depend on these, so are drawn once and reused by canvases that can
+        image.add_fragment(
+            ('year skeleton', year, year_top, months_started(year, today)),
+            lambda canvas: draw_year_skeleton(canvas, year, year_top, today)
+        )
 
     max_daily = ceil(max([daily_count[c] for c in daily_count]))
 
     for date_string in daily_count:
         daily_quantity = daily_count[date_string]
-        day_date = parse_date(date_string)
+        year, left, top, label = squares[date_string]
 
+        color = None  # type: Optional[str]
+        class_ = None  # type: Optional[str]
         if daily_quantity is None:
             color = '#e0e0e0'
+        elif palette_steps:
+            class_ = palette_class((daily_quantity - range_min) / (max_daily - range_min), palette_steps)
         else:
             color = fractional_fill_color((daily_quantity - range_min) / (max_daily - range_min))
 
-        year = day_date.year
-        offset = (0, (year - min_year) * height_per_year)
         amount_string = round(daily_quantity, 1) if daily_quantity else '?'
-        title = day_date.strftime('%b') + (' %d: %s' % (day_date.day, amount_string))
+        title = '%s: %s' % (label, amount_string)
 
-        image.add(square_for_date(image, day_date, color, grid_offset=offset, title=title))
+        image.add_rect(left, top + (year - min_year) * height_per_year, GRID_SQUARE, GRID_SQUARE, color, title, class_)
 
     if show_legend:
         top = image_height - LEGEND_GRID['height']
@@ -111,58 +183,95 @@ def draw_daily_count_image(daily_count: dict, show_legend: bool, legend_title: s
     return image
 
 
-def square_for_date(image, day_date, color, grid_offset=(), title=None):
-    year, week, day = isocalendar_natural(day_date)
+def date_squares(date_strings: Iterable[str]) -> Dict[str, Tuple[int, int, int, str]]:
+    """
+    Place the square of each date in the grid of its year, as needed whichever measure is drawn
+
+    Args:
+        date_strings: Dates, as strings
+
+    Returns:
+        Map of date string => tuple of year, left, top within its year's grid, and title label, eg 'Mar 4'
+    """
+    squares = {}
+    for date_string in date_strings:
+        day_date = parse_date(date_string)
+        year, week, day = isocalendar_natural(day_date)
+        squares[date_string] = (
+            year, grid_square_left(week), grid_square_top(day), day_date.strftime('%b') + ' %d' % day_date.day
+        )
+    return squares
+
+
+def draw_year_skeleton(image: Canvas, year: int, year_top: int, today: date = None):
+    """
+    Draw the labels and month boundaries of a year's grid
+
+    Args:
+        image: Canvas to draw on
+        year: Year
+        year_top: Vertical offset of the year's grid
+        today: Date up to which month boundaries are drawn, date.today() if not given
+
+    Returns:
 
-    day_square = square_in_grid(image, row=day, column=week, offsets=grid_offset, fill=color, title=title)
-    return day_square
+    """
+    months = draw_year_labels(image, year, year_top)
+
+    for month_index, month in enumerate(months):
+        # Draw lines between months
+        draw_month_boundary(image, month_index + 1, year, year_top, today)
+
+
+def months_started(year: int, today: date) -> int:
+    """
+    Count the months of a year that had started before today, which are those given boundaries
+
+    Args:
+        year: Year
+        today: Current date
+
+    Returns:
+        0-12
+    """
+    return sum(date(year, month, 1) < today for month in range(1, 13))
 
 
 def draw_year_labels(image, year, year_top):
     months = 'JFMAMJJASOND'
     text_vrt_offset = 9
-    image.add(
-        image.text(
-            '%d' % year,
-            insert=(GRID_BORDERS['left'] - 8, year_top + GRID_BORDERS['top'] + text_vrt_offset - GRID_PITCH - 2),
-            class_='year'
-        )
+    image.add_text(
+        '%d' % year,
+        GRID_BORDERS['left'] - 8, year_top + GRID_BORDERS['top'] + text_vrt_offset - GRID_PITCH - 2,
+        class_='year'
     )
-    image.add(
-        image.text(
-            'Mo',
-            insert=(GRID_BORDERS['left'] - 8, year_top + GRID_BORDERS['top'] + text_vrt_offset),
-            class_='day'
-        )
+    image.add_text(
+        'Mo',
+        GRID_BORDERS['left'] - 8, year_top + GRID_BORDERS['top'] + text_vrt_offset,
+        class_='day'
     )
-    image.add(
-        image.text(
-            'Su',
-            insert=(GRID_BORDERS['left'] - 8, year_top + GRID_BORDERS['top'] + text_vrt_offset + 6 * GRID_PITCH),
-            class_='day'
-        )
+    image.add_text(
+        'Su',
+        GRID_BORDERS['left'] - 8, year_top + GRID_BORDERS['top'] + text_vrt_offset + 6 * GRID_PITCH,
+        class_='day'
     )
     # Draw month initials in line with first day of month
     for month_index, month in enumerate(months):
         start_location = month_start_location(month_index + 1, year, year_top)
 
-        image.add(
-            image.text(
-                month,
-                insert=(
-                    offset_point(start_location, (GRID_PITCH + (GRID_SQUARE / 2), 0))[0],
-                    year_top + GRID_BORDERS['top'] + text_vrt_offset - GRID_PITCH - 2
-                ),
-                class_='month'
-            )
+        image.add_text(
+            month,
+            offset_point(start_location, (GRID_PITCH + (GRID_SQUARE / 2), 0))[0],
+            year_top + GRID_BORDERS['top'] + text_vrt_offset - GRID_PITCH - 2,
+            class_='month'
         )
     return months
 
 
-def draw_month_boundary(image, month_number, year, year_top):
+def draw_month_boundary(image, month_number, year, year_top, today: date = None):
     start_location = month_start_location(month_number, year, year_top)
     end_location = offset_point(month_end_location(month_number, year, year_top), (0, GRID_PITCH))
-    if date(year, month_number, 1) < date.today():
+    if date(year, month_number, 1) < (today or date.today()):
         half_pitch = (GRID_PITCH - GRID_SQUARE) / 2
         points = [
             (
@@ -190,7 +299,7 @@ def draw_month_boundary(image, month_number, year, year_top):
                 grid_square_top(1, year_top) - half_pitch
             ),
         ]
-        image.add(image.polyline(points, fill='#f4f4f4' if month_number % 2 else '#fff'))
+        image.add_polyline(points, fill='#f4f4f4' if month_number % 2 else '#fff')
 
 
 def month_start_location(month, year, y_offset):
@@ -271,16 +380,14 @@ def offset_point(point: tuple, by: tuple) -> tuple:
     return point[0] + by[0], point[1] + by[1]
 
 
-def draw_legend(image: Drawing, legend_title: str, top: int, range_max: float, range_min: int = 0):
+def draw_legend(image: Canvas, legend_title: str, top: int, range_max: float, range_min: int = 0):
     # Generate up to 5 integer steps
     step = int(ceil((range_max - range_min) / 5))
 
-    image.add(
-        image.text(
-            legend_title,
-            insert=(LEGEND_GRID['left'], top + 3 * LEGEND_GRID['cell_height'] / 4),
-            class_='legend_title'
-        )
+    image.add_text(
+        legend_title,
+        LEGEND_GRID['left'], top + 3 * LEGEND_GRID['cell_height'] / 4,
+        class_='legend_title'
     )
     steps = list(range(range_min, int(range_max + 1), step))
     if max(steps) != int(range_max):
@@ -288,25 +395,20 @@ def draw_legend(image: Drawing, legend_title: str, top: int, range_max: float, r
 
     for offset, marker in enumerate(steps):
         left = LEGEND_GRID['left'] + offset * LEGEND_GRID['pitch']
-        image.add(
-            image.rect(
-                (left, top),
-                (LEGEND_GRID['cell_width'], LEGEND_GRID['cell_height']),
-                fill=fractional_fill_color((marker - range_min) / (range_max - range_min))
-            )
+        image.add_rect(
+            left, top,
+            LEGEND_GRID['cell_width'], LEGEND_GRID['cell_height'],
+            fill=fractional_fill_color((marker - range_min) / (range_max - range_min))
         )
-        image.add(
-            image.text(
-                marker,
-                insert=(left + LEGEND_GRID['cell_width'] / 2, top + 3 * LEGEND_GRID['cell_height'] / 4),
-                class_='key',
-                fill='#ffffff' if marker > range_max / 2 else '#000000'
-            )
+        image.add_text(
+            marker,
+            left + LEGEND_GRID['cell_width'] / 2, top + 3 * LEGEND_GRID['cell_height'] / 4,
+            class_='key',
+            fill='#ffffff' if marker > range_max / 2 else '#000000'
         )
 
 
-def init_image(width: int, height: int) -> Drawing:
-    image = Drawing(size=('%dpx' % width, '%dpx' % height))
-    image.add(image.rect((0, 0), (width, height), fill='white'))
-    image.defs.add(image.style(CSS))
+def init_image(width: int, height: int, backend: str = None, css: str = CSS, compact: bool = False) -> Canvas:
+    image = make_canvas(width, height, css, backend, compact)
+    image.add_rect(0, 0, width, height, fill='white')
     return image
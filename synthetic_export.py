@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Generate realistic synthetic Untappd exports, for benchmarks and tests. Run with --help for details
+
+Output is deterministic for a given seed (and, for lists, reference date).
+"""
+import argparse
+import json
+import random
+import sys
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+from typing import List, Sequence, Tuple
+
+
+# Styles as Untappd names them, with a rough relative popularity and typical ABV range
+STYLES = [
+    ('IPA - American', 14, (5.5, 7.5)),
+    ('IPA - New England', 12, (5.5, 8)),
+    ('Pale Ale - American', 10, (4, 6)),
+    ('Bitter - Best', 8, (3.5, 4.8)),
+    ('Stout - Imperial / Double', 6, (8, 13)),
+    ('Stout - Oatmeal', 4, (4.5, 6.5)),
+    ('Porter - English', 4, (4.5, 6)),
+    ('Sour - Fruited Gose', 5, (4, 5.5)),
+    ('Lambic - Gueuze', 2, (5, 7)),
+    ('Lager - Pale', 6, (4, 5.2)),
+    ('Pilsner - Czech', 3, (4.2, 5)),
+    ('Saison - Farmhouse Ale', 3, (5, 7.5)),
+    ('Belgian Tripel', 2, (7.5, 9.5)),
+    ('Barleywine - English', 1, (9, 12)),
+    ('Cider - Traditional', 1, (5, 7)),
+    ('Non-Alcoholic Beer - IPA', 1, (0, 0.5)),
+]
+
+BREWERY_COUNTRIES = [('England', 10), ('Scotland', 2), ('Belgium', 3), ('United States', 4), ('Germany', 1)]
+BREWERY_WORDS = ['Hop', 'Stone', 'Red', 'Iron', 'Wild', 'Cloud', 'Harbour', 'Oak', 'North', 'Lost', 'Moon', 'Black']
+BREWERY_SUFFIXES = ['Brewing Co.', 'Brewery', 'Beer Project', 'Brouwerij', 'Ales', 'Craft Brewery']
+BEER_WORDS = ['Citra', 'Session', 'Double', 'Dark', 'Golden', 'Hazy', 'Midnight', 'Summer', 'Old', 'Tropical', 'Oak']
+BEER_NOUNS = ['Dream', 'Ale', 'Stout', 'Gold', 'Haze', 'Wolf', 'Harvest', 'Tide', 'Mild', 'Pilgrim', 'Rocket']
+
+VENUE_NAMES = ['The Red Lion', 'The Crown', 'The Royal Oak', 'Tap East', 'The Swan', 'Brewery Tap', 'Bottle Shop']
+TRAVEL_VENUES = [('Moeder Lambic', 'Belgium'), ('Tørst', 'United States'), ('BrewDog Columbus', 'United States')]
+# Measures as drinkers record them in comments, with relative frequency
+COMMENT_MEASURES = [
+    ('[pint]', 8), ('[half]', 8), ('[third]', 10), ('[2/3 pint]', 6), ('[330ml]', 5), ('[440ml]', 5),
+    ('[12oz]', 2), ('[33cl]', 2), ('[taster]', 2), ('[500ml]', 2), ('[2 x third]', 1), ('[half pint]', 2),
+]
+COMMENT_TEXTS = ['Lovely', 'Very juicy', 'Not for me', 'Excellent!', 'Bit thin', 'Would drink again', 'Meh']
+SERVING_TYPES = [('Draft', 10), ('Cask', 5), ('Can', 8), ('Bottle', 6), ('Taster', 2), ('', 3)]
+CONTAINERS = [('Can', 5), ('Bottle', 4), ('Growler', 1)]
+SESSION_SIZES = [(1, 10), (2, 7), (3, 5), (4, 3), (5, 2), (6, 1), (8, 1)]
+CHECKINS_PER_YEAR = 600
+MAX_YEARS = 40
+
+
+def weighted(generator: random.Random, choices: Sequence[Tuple]):
+    """
+    Pick the first element of a (value, weight, ...) tuple, by weight
+
+    Args:
+        generator: Random generator
+        choices: Sequence of tuples whose second element is a relative weight
+
+    Returns:
+        Chosen value
+    """
+    return generator.choices(choices, weights=[c[1] for c in choices])[0][0]
+
+
+class Catalogue:
+    """
+    Breweries and their beers, with a long tail of rarely-seen breweries as in a real checkin history
+    """
+
+    def __init__(self, generator: random.Random, brewery_count: int, beers_per_brewery: int):
+        self.breweries = []  # type: List[Tuple[str, str]]
+        for k in range(brewery_count):
+            name = '%s %s %s' % (
+                generator.choice(BREWERY_WORDS),
+                generator.choice(BREWERY_WORDS),
+                generator.choice(BREWERY_SUFFIXES)
+            )
+            if k >= len(BREWERY_WORDS):
+                name += ' %d' % k
+            self.breweries.append((name, weighted(generator, BREWERY_COUNTRIES)))
+
+        # Zipf-like popularity: a few breweries account for most checkins
+        self.brewery_cumulative_weights = list(accumulate(1 / (k + 1) for k in range(brewery_count)))
+
+        self.beers = []  # type: List[List[dict]]
+        for brewery_name, brewery_country in self.breweries:
+            beers = []
+            for k in range(beers_per_brewery):
+                style_name, _, (abv_min, abv_max) = generator.choices(STYLES, weights=[s[1] for s in STYLES])[0]
+                beers.append({
+                    'beer_name': '%s %s%s' % (
+                        generator.choice(BEER_WORDS),
+                        generator.choice(BEER_NOUNS),
+                        ' %d' % k if k >= 3 else ''
+                    ),
+                    'beer_type': style_name,
+                    'beer_abv': '%.1f' % generator.uniform(abv_min, abv_max),
+                    'brewery_name': brewery_name,
+                    'brewery_country': brewery_country,
+                    'bid': generator.randint(1, 5000000),
+                })
+            self.beers.append(beers)
+
+    def pick_beer(self, generator: random.Random) -> dict:
+        """
+        Choose a beer, weighted by brewery popularity
+
+        Args:
+            generator: Random generator
+
+        Returns:
+            dict of beer fields
+        """
+        brewery = generator.choices(range(len(self.breweries)), cum_weights=self.brewery_cumulative_weights)[0]
+        return generator.choice(self.beers[brewery])
+
+
+def generate_checkins(count: int, years: float = None, seed: int = 1, start: date = date(2015, 1, 1)) -> List[dict]:
+    """
+    Build a list of plausible checkins in export format, oldest first
+
+    Checkins come in evening sessions of a few drinks, more often at weekends, mostly at a handful of local venues or
+    at home, with occasional trips abroad.
+
+    Args:
+        count: Number of checkins
+        years: Number of years to spread them over; by default, as many as a keen drinker would take, up to MAX_YEARS
+        seed: Random seed, so that runs are repeatable
+        start: Date of the first possible checkin
+
+    Returns:
+        list of checkin dicts
+    """
+    # pylint: disable=R0914
+    generator = random.Random(seed)
+    if years is None:
+        years = min(max(1.0, count / CHECKINS_PER_YEAR), MAX_YEARS)
+
+    catalogue = Catalogue(generator, brewery_count=max(20, min(2000, count // 50)), beers_per_brewery=12)
+    local_venues = [(name, 'England') for name in VENUE_NAMES]
+    mean_session_size = sum(size * weight for size, weight in SESSION_SIZES) / sum(w for _, w in SESSION_SIZES)
+    mean_days_between = 365.25 * years / (count / mean_session_size)
+
+    checkins = []  # type: List[dict]
+    day = start
+    last_moment = datetime.combine(start, time())
+    checkin_id = 100000000
+    while len(checkins) < count:
+        day += timedelta(days=int(generator.expovariate(1 / mean_days_between)))
+        if day.weekday() < 4 and generator.random() < 0.3:
+            day += timedelta(days=4 - day.weekday())  # Move some midweek sessions to Friday
+
+        roll = generator.random()
+        if roll < 0.35:
+            venue = ('', '')
+        elif roll < 0.95:
+            venue = generator.choice(local_venues)
+        else:
+            venue = generator.choice(TRAVEL_VENUES)
+
+        moment = datetime.combine(day, time(hour=generator.choice([12, 17, 18, 19, 19, 20, 20, 21])))
+        moment = max(moment + timedelta(minutes=generator.randint(0, 59)), last_moment + timedelta(minutes=30))
+        for _ in range(min(weighted(generator, SESSION_SIZES), count - len(checkins))):
+            beer = catalogue.pick_beer(generator)
+            serving_type = 'Can' if venue[0] == '' and generator.random() < 0.6 else weighted(generator, SERVING_TYPES)
+
+            comment = ''
+            if generator.random() < 0.6:
+                comment = weighted(generator, COMMENT_MEASURES)
+                if generator.random() < 0.3:
+                    comment = generator.choice(COMMENT_TEXTS) + ' ' + comment
+            elif generator.random() < 0.2:
+                comment = generator.choice(COMMENT_TEXTS)
+
+            checkin_id += generator.randint(1, 5000)
+            checkin = dict(beer)
+            checkin.update({
+                'comment': comment,
+                'venue_name': venue[0],
+                'venue_city': '',
+                'venue_country': venue[1],
+                'rating_score': '%g' % (generator.randint(10, 19) / 4) if generator.random() < 0.85 else '',
+                'created_at': moment.strftime('%Y-%m-%d %H:%M:%S'),
+                'serving_type': serving_type,
+                'checkin_id': str(checkin_id),
+            })
+            checkins.append(checkin)
+            last_moment = moment
+            moment += timedelta(minutes=generator.randint(20, 70))
+
+    return checkins
+
+
+def generate_list_items(count: int, seed: int = 1, reference_date: date = None, quantities: bool = True) -> List[dict]:
+    """
+    Build a list of plausible items in the format of an Untappd list export
+
+    Args:
+        count: Number of items
+        seed: Random seed, so that runs are repeatable
+        reference_date: Date best-before dates are spread around, today if not set
+        quantities: Whether the list records quantities and containers, as a stock list would
+
+    Returns:
+        list of item dicts
+    """
+    generator = random.Random(seed)
+    if reference_date is None:
+        reference_date = date.today()
+
+    catalogue = Catalogue(generator, brewery_count=max(10, min(1000, count // 5)), beers_per_brewery=6)
+    items = []
+    for _ in range(count):
+        item = dict(catalogue.pick_beer(generator))
+        if quantities:
+            item['quantity'] = str(weighted(generator, [(1, 10), (2, 4), (3, 2), (4, 1), (6, 1), (12, 1)]))
+            item['container'] = weighted(generator, CONTAINERS)
+        if generator.random() < 0.8:
+            best_by = reference_date + timedelta(days=generator.randint(-120, 720))
+            item['best_by_date_iso'] = best_by.isoformat()
+        items.append(item)
+
+    return items
+
+
+def parse_cli_args() -> argparse.Namespace:
+    """
+    Specify and parse command-line arguments
+
+    Returns:
+        Namespace of provided arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic Untappd checkin or list export',
+        usage=sys.argv[0] + ' {checkins,list} COUNT [--output OUTPUT] [--seed SEED] [--years YEARS] [--help]'
+    )
+    parser.add_argument('kind', choices=['checkins', 'list'], help='Type of export')
+    parser.add_argument('count', type=int, help='Number of checkins or items')
+    parser.add_argument('--output', required=False, help='Path to output file, STDOUT if not specified')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default 1)')
+    parser.add_argument('--years', type=float, help='Years of history to spread checkins over')
+    args = parser.parse_args()
+    return args
+
+
+def run_cli():
+    """
+    Run the generator at the command line
+    """
+    args = parse_cli_args()
+    if args.kind == 'checkins':
+        data = generate_checkins(args.count, years=args.years, seed=args.seed)
+    else:
+        data = generate_list_items(args.count, seed=args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=1)
+    else:
+        json.dump(data, sys.stdout, indent=1)
+
+
+if __name__ == '__main__':
+    run_cli()
@@ -1,6 +1,107 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+import tracemalloc
 import unittest
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
+from copy import deepcopy
+from datetime import date, datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import monotonic, time
+from unittest import mock
+from xml.dom import Node
+from xml.dom.minidom import parseString
 
+import aws_clients
+import timings
+from checkin_table import (ESTIMATE_MISSING, ESTIMATE_NONE, ESTIMATE_SERVING,
+                           CheckinTable)
+from daily_visualisation import (MEASURES, build_daily_visualisation_image,
+                                 build_daily_visualisation_images)
+from imbibed import (build_checkin_summaries, build_reports,
+                     write_breweries_summary, write_daily_summary,
+                     write_styles_summary, write_weekly_summary)
+from import_budget import SCENARIOS, measure_imports
 from measures import MeasureProcessor, Region
+from message_ledger import FileMessageLedger, SQLiteMessageLedger
+from result_cache import FileResultCache, cache_key, file_chunks, spool_chunks
+from sharded_summaries import build_sharded_summaries
+from stock_check import build_stocklists
+from summary_state import SummaryState
+from svg_calendar import SVG_BACKENDS, draw_daily_count_image
+from svg_calendar.canvas import clear_fragment_cache, gzip_svg
+from svg_calendar.daily_grid import date_squares, months_started
+from synthetic_export import generate_checkins, generate_list_items
+from utils import filter_source_data, iter_json_array
+from vectorized_summaries import np
+
+
+def make_checkin(**fields) -> dict:
+    checkin = {
+        'beer_name': 'Test Beer',
+        'beer_type': 'IPA - American',
+        'beer_abv': 5.0,
+        'brewery_name': 'Test Brewery',
+        'brewery_country': 'England',
+        'comment': '',
+        'created_at': '2019-01-01 19:00:00',
+        'rating_score': '',
+        'serving_type': 'Draft',
+        'venue_name': 'The Red Lion',
+        'venue_country': 'England',
+    }
+    checkin.update(fields)
+    return checkin
+
+
+def svg_elements(svg: str) -> list:
+    text_types = (Node.TEXT_NODE, Node.CDATA_SECTION_NODE)
+    return [
+        (element.tagName, sorted(element.attributes.items()),
+         ''.join(child.data for child in element.childNodes if child.nodeType in text_types).strip())
+        for element in parseString(svg).getElementsByTagName('*')
+    ]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serve queued (status, body) responses in turn, recording the paths requested
+    """
+    responses = []  # type: list
+    paths = []  # type: list
+
+    def do_GET(self):  # pylint: disable=C0103
+        self.paths.append(self.path)
+        status, body = self.responses.pop(0)
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
+
+
+@contextmanager
+def stand_in_server(responses: list):
+    """
+    Run a local HTTP server giving the responses listed, yielding its root URL
+    """
+    StandInHandler.responses = list(responses)
+    StandInHandler.paths = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield 'http://127.0.0.1:%d' % server.server_port
+    finally:
+        server.shutdown()
+        server.server_close()
 
 
 class MeasureCalculationTests(unittest.TestCase):
@@ -30,6 +131,526 @@ class MeasureCalculationTests(unittest.TestCase):
         for (source, expected) in expectations.items():
             self.assertEqual(processor.parse_measure(source), expected)
 
+    def test_shared_processor_per_region(self):
+        processor = MeasureProcessor.for_region(Region.EUROPE)
+        self.assertIs(processor, MeasureProcessor.for_region(Region.EUROPE))
+        self.assertIsNot(processor, MeasureProcessor.for_region(Region.USA))
+        for _ in range(2):  # Second pass comes from the parse cache
+            self.assertEqual(processor.measure_from_comment('Lovely [2/3 pints]'), 378)
+            self.assertEqual(processor.measure_from_comment('Lovely [third]'), 189)
+            self.assertIsNone(processor.measure_from_comment('No measure [given here'))
+            with self.assertRaises(Exception):
+                processor.measure_from_comment('[5 litres]')
+
+
+class ExportStreamTests(unittest.TestCase):
+    def test_items_split_across_chunks(self):
+        source = '[{"beer_name": "Fünf", "beer_abv": 5.5}, {"beer_name": "Zwölf", "beer_abv": 12}, 1234]'.encode()
+        expected = [{'beer_name': 'Fünf', 'beer_abv': 5.5}, {'beer_name': 'Zwölf', 'beer_abv': 12}, 1234]
+        for size in (1, 2, 5, 64):
+            chunks = [source[i:i + size] for i in range(0, len(source), size)]
+            self.assertEqual(list(iter_json_array(chunks)), expected)
+
+    def test_empty_and_invalid_exports(self):
+        self.assertEqual(list(iter_json_array([' [ ] '])), [])
+        for source in ['{}', '[1, 2', '[1 2]', '[1] [2]']:
+            with self.assertRaises(Exception):
+                list(iter_json_array([source]))
+
+
+class CheckinTableTests(unittest.TestCase):
+    def test_columns_from_checkins(self):
+        table = CheckinTable.from_checkins([
+            make_checkin(comment='[third]', rating_score=4.25),
+            make_checkin(serving_type='Can', brewery_country='United States', created_at='2019-01-02 12:00:00'),
+            make_checkin(serving_type='', venue_name='Home', venue_country=''),
+        ])
+        self.assertEqual(len(table), 3)
+        self.assertEqual(list(table.measure_ml), [189, 355, 0])
+        self.assertEqual(list(table.estimated), [ESTIMATE_NONE, ESTIMATE_SERVING, ESTIMATE_MISSING])
+        self.assertEqual(table.rating[0], 4.25)
+        self.assertEqual(list(table.column('venue_name')), ['The Red Lion', 'The Red Lion', 'Home'])
+        self.assertEqual(len(table.column('brewery_name').values), 1)
+
+    def test_filter_table_matches_list(self):
+        checkins = [
+            make_checkin(venue_name='The Red Lion', created_at='2018-10-01 19:00:00'),
+            make_checkin(venue_name='the red lion', created_at='2018-12-01 19:00:00'),
+            make_checkin(venue_name='The Crown', created_at='2019-01-01 19:00:00'),
+        ]
+        rules = ['venue_name=The Red Lion', 'created_at>2018-11']
+        table = filter_source_data(rules, CheckinTable.from_checkins(checkins))
+        expected = [c['created_at'] for c in filter_source_data(rules, checkins)]
+        self.assertEqual(list(table.column('created_at')), expected)
+        with self.assertRaises(Exception):
+            filter_source_data(['venue_city=Leeds'], table)
+
+    def test_indexed_filters_match_list(self):
+        checkins = [
+            make_checkin(venue_name=venue, brewery_name=brewery, created_at='2019-01-%02d 19:00:00' % day)
+            for day, (venue, brewery) in enumerate([
+                ('The Red Lion', 'Thornbridge'), ('The Crown', 'Thornbridge'), ('THE RED LION', 'Magic Rock'),
+                ('Red Lion', 'thornbridge'), ('', 'Thornbridge'), ('The Red Lion', 'Cloudwater'),
+            ], start=1)
+        ]
+        table = CheckinTable.from_checkins(checkins)
+        for rules in (
+                ['venue_name~the red', 'brewery_name=THORNBRIDGE'],
+                ['brewery_name~thorn', 'venue_name^the crown', 'created_at<2019-01-05'],
+                ['venue_name=', 'brewery_name~T'],
+                ['venue_name~Nowhere'],
+                ['venue_name?lion', 'brewery_name~'],
+        ):
+            expected = [c['created_at'] for c in filter_source_data(rules, checkins)]
+            self.assertEqual(list(filter_source_data(rules, table).column('created_at')), expected, rules)
+
+    def test_date_range_filters_match_list(self):
+        dates = [
+            '2018-10-31 23:00:00', '2018-11-01 19:00:00', '2018-11-01 19:00:00', '2018-12-24 12:00:00', '2019-01-02'
+        ]
+        for created_at in (dates, [dates[1], dates[0]] + dates[2:]):
+            checkins = [make_checkin(created_at=value, beer_name=str(k)) for k, value in enumerate(created_at)]
+            table = CheckinTable.from_checkins(checkins)
+            for rules in (
+                    ['created_at>2018-11', 'created_at<2019'],
+                    ['created_at>2018-11-01 19:00:00'],
+                    ['created_at<2018-11-01 19:00:00', 'venue_name~the'],
+                    ['created_at>2019', 'created_at<2018'],
+            ):
+                expected = [c['beer_name'] for c in filter_source_data(rules, checkins)]
+                self.assertEqual(list(filter_source_data(rules, table).column('beer_name')), expected, rules)
+
+
+class SyntheticExportTests(unittest.TestCase):
+    def test_generated_exports(self):
+        checkins = generate_checkins(500, seed=3)
+        self.assertEqual(checkins, generate_checkins(500, seed=3))
+        self.assertEqual(len(checkins), 500)
+        created_at = [c['created_at'] for c in checkins]
+        self.assertEqual(created_at, sorted(created_at))
+        table = CheckinTable.from_checkins(checkins)
+        self.assertGreater(sum(1 for e in table.estimated if e == ESTIMATE_NONE), 200)
+
+        items = generate_list_items(50, seed=3)
+        self.assertEqual(len(items), 50)
+        stocklist = []
+        build_stocklists(items, stocklist=stocklist)
+        self.assertTrue(stocklist[-1][0].startswith('TOTAL'))
+
+
+class TimingsTests(unittest.TestCase):
+    def test_spans_only_recorded_while_profiling(self):
+        items = [1, 2, 3]
+        self.assertIs(timings.iterate('decode', items), items)
+        with timings.span('unrecorded'):
+            pass
+
+        profile = timings.start_profile()
+        try:
+            with timings.span('aggregate'):
+                self.assertEqual(list(timings.iterate('decode', items, count_name='rows')), items)
+            with timings.span('aggregate'):
+                timings.count('rows', 2)
+        finally:
+            self.assertIs(timings.stop_profile(), profile)
+
+        self.assertEqual(list(profile.stages), ['decode', 'aggregate'])
+        self.assertEqual(profile.stages['aggregate']['calls'], 2)
+        self.assertEqual(profile.counts, {'rows': 5})
+        self.assertIn('"rows": 5', timings.log_line(profile))
+
+    def test_memory_traced_per_stage(self):
+        profile = timings.start_profile(trace_memory=True)
+        try:
+            with timings.span('outer'):
+                kept = [bytearray(100000)]
+                with timings.span('inner'):
+                    bytearray(1000000)
+        finally:
+            timings.stop_profile()
+
+        memory = profile.as_dict()['memory']
+        self.assertLess(memory['inner']['retained_bytes'], 100000)
+        self.assertGreaterEqual(memory['outer']['retained_bytes'], 100000)
+        if timings.PEAK_PER_STAGE:
+            self.assertGreaterEqual(memory['inner']['peak_increase_bytes'], 1000000)
+            self.assertGreaterEqual(memory['outer']['peak_increase_bytes'], 1100000)
+        else:
+            self.assertNotIn('peak_bytes', memory['inner'])
+        self.assertEqual(len(kept), 1)
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+class ImportBudgetTests(unittest.TestCase):
+    def test_entry_points_skip_unused_modules(self):
+        for name, scenario in SCENARIOS.items():
+            if aws_clients.boto3 is None and 'lambda_function' in scenario['imports']:
+                continue  # Provided by the Lambda runtime, so not installed everywhere
+            loaded = measure_imports(scenario['imports'])['modules']
+            self.assertEqual([module for module in scenario['excluded'] if module in loaded], [], name)
+
+
+class AwsClientTests(unittest.TestCase):
+    def setUp(self):
+        aws_clients.reset_clients()
+
+    def tearDown(self):
+        aws_clients.reset_clients()
+
+    def test_http_session_retries_server_errors(self):
+        with stand_in_server([(503, b'busy'), (200, b'[1, 2]')]) as url:
+            session = aws_clients.http_session()
+            response = session.get(url + '/export.json')
+            self.assertEqual(response.json(), [1, 2])
+            self.assertEqual(StandInHandler.paths, ['/export.json', '/export.json'])
+            self.assertIs(aws_clients.http_session(), session)
+
+    def test_stream_download_of_large_export(self):
+        checkins = generate_checkins(5000)
+        body = json.dumps(checkins).encode('utf-8')
+        with stand_in_server([(200, body)]) as url:
+            self.assertEqual(list(iter_json_array(aws_clients.stream_download(url + '/export.json'))), checkins)
+
+        with stand_in_server([(200, body)]) as url:
+            with self.assertRaisesRegex(Exception, 'larger than the 1000000 byte limit'):
+                list(aws_clients.stream_download(url + '/export.json', max_bytes=1000000))
+
+    @unittest.skipIf(aws_clients.boto3 is None, 'boto3 not installed')
+    def test_aws_client_uses_configured_endpoint(self):
+        credentials = {'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test', 'AWS_DEFAULT_REGION': 'eu-west-1'}
+        with stand_in_server([(200, b'message')]) as url, mock.patch.dict(os.environ, credentials), \
+                mock.patch.dict('utils.config', {'aws_endpoints': {'s3': url}}):
+            client = aws_clients.aws_client('s3')
+            self.assertEqual(client.get_object(Bucket='mail', Key='abc')['Body'].read(), b'message')
+            self.assertEqual(StandInHandler.paths, ['/mail/abc'])
+            self.assertIs(aws_clients.aws_client('s3'), client)
+
+
+class LambdaHandlerTests(unittest.TestCase):
+    @unittest.skipIf(aws_clients.boto3 is None, 'boto3 not installed')
+    def test_records_processed_concurrently_and_failures_isolated(self):
+        from lambda_benchmark import StubBackends, build_event, run_handler
+
+        backends = StubBackends(latency=0)
+        event = build_event(backends, records=5, size=50)
+        del backends.messages['message-1']
+        response = run_handler(backends, event, workers=3)
+
+        results = response['records']
+        self.assertEqual([result['message_id'] for result in results], ['message-%d' % i for i in range(5)])
+        self.assertEqual([result['status'] for result in results], ['ok', 'error', 'ok', 'ok', 'ok'])
+        self.assertEqual([result.get('export_type') for result in results], ['checkins', None, 'checkins', 'list',
+                                                                             'checkins'])
+        self.assertEqual(len(backends.sent), 5)  # Including the error reply
+        self.assertEqual(len(backends.uploads), 1)
+
+    @unittest.skipIf(aws_clients.boto3 is None, 'boto3 not installed')
+    def test_redelivered_messages_skipped(self):
+        from lambda_benchmark import StubBackends, build_event, run_handler
+
+        backends = StubBackends(latency=0)
+        event = build_event(backends, records=3, size=50)
+        with TemporaryDirectory() as directory:
+            config = {'message_ledger': {'sqlite': os.path.join(directory, 'ledger.db')}}
+            run_handler(backends, event, workers=2, config=config)
+            response = run_handler(backends, event, workers=2, config=config)
+
+        self.assertEqual([result['status'] for result in response['records']], ['duplicate'] * 3)
+        self.assertEqual(len(backends.sent), 3)
+
+    @unittest.skipIf(aws_clients.boto3 is None, 'boto3 not installed')
+    def test_list_exports_in_quick_succession_coalesced(self):
+        from lambda_benchmark import StubBackends, build_event, run_handler
+
+        backends = StubBackends(latency=0)
+        event = build_event(backends, records=6, size=50)
+        for index in (1, 3, 5):  # The list exports
+            mail = event['Records'][index]['ses']['mail']
+            mail.update(source='tidier@example.com', timestamp=datetime.now(timezone.utc).isoformat())
+            mail['commonHeaders']['subject'] = 'List: Cellar'
+        response = run_handler(backends, event, workers=6, config={'coalesce_lists': {'window_seconds': 0.5}})
+
+        self.assertEqual([result['status'] for result in response['records']],
+                         ['ok', 'superseded', 'ok', 'superseded', 'ok', 'ok'])
+        self.assertEqual(len(backends.sent), 6)
+
+    @unittest.skipIf(aws_clients.boto3 is None, 'boto3 not installed')
+    def test_slow_upload_abandoned_at_deadline(self):
+        import lambda_function
+
+        reports = {'stocklist.html': '', 'bb-stocklist.csv': '', 'bb-stocklist-summary.csv': ''}
+        release = Event()
+        slow_upload = mock.Mock(side_effect=lambda *args, **kwargs: release.wait(5))
+        with mock.patch('lambda_function.build_list_reports', return_value=reports), \
+                mock.patch('lambda_function.upload_report_to_s3', slow_upload), \
+                mock.patch('lambda_function.send_email_response') as send_email_response:
+            started = monotonic()
+            with self.assertRaises(FuturesTimeoutError):
+                lambda_function.process_list_export([], 'drinker@example.com', deadline=started + 0.2)
+            elapsed = monotonic() - started
+        release.set()
+
+        self.assertLess(elapsed, 1)
+        send_email_response.assert_not_called()
+
+
+class MessageLedgerTests(unittest.TestCase):
+    def test_entries_recorded_and_expired(self):
+        with TemporaryDirectory() as directory:
+            for ledger in (FileMessageLedger(os.path.join(directory, 'ledger.json'), expiry_seconds=60),
+                           SQLiteMessageLedger(os.path.join(directory, 'ledger.db'), expiry_seconds=60)):
+                self.assertFalse(ledger.seen('first'))
+                ledger.record('first')
+                self.assertTrue(ledger.seen('first'))
+                self.assertFalse(ledger.seen('second'))
+
+                with mock.patch('message_ledger.time', return_value=time() + 61):
+                    self.assertFalse(ledger.seen('first'))
+                    ledger.record('second')  # Drops expired entries
+                self.assertIsNone(ledger.processed_at('first'))
+
+
+class ResultCacheTests(unittest.TestCase):
+    def test_entries_expire_and_oldest_are_dropped_over_size_limit(self):
+        with TemporaryDirectory() as directory:
+            cache = FileResultCache(directory, ttl_seconds=60, max_bytes=300)
+            digest, spool = spool_chunks([b'[1, ', b'2]'])
+            with spool:
+                self.assertEqual(b''.join(file_chunks(spool)), b'[1, 2]')
+            first, second = cache_key(digest, report='weekly'), cache_key(digest, report='daily')
+            self.assertNotEqual(first, second)
+
+            self.assertIsNone(cache.get(first))
+            self.assertTrue(cache.put(first, {'weekly': 'x' * 100}))
+            self.assertEqual(cache.get(first), {'weekly': 'x' * 100})
+            self.assertFalse(cache.put(second, {'daily': 'x' * 300}))
+
+            os.utime(cache.path(first), (0, 0))  # Entries are dropped oldest first
+            self.assertTrue(cache.put(second, {'daily': 'x' * 150}))
+            self.assertIsNone(cache.get(first))
+            self.assertEqual(cache.get(second), {'daily': 'x' * 150})
+
+            with mock.patch('result_cache.time', return_value=time() + 61):
+                self.assertIsNone(cache.get(second))
+            self.assertEqual(os.listdir(directory), [])
+
+    @unittest.skipIf(aws_clients.boto3 is None, 'boto3 not installed')
+    def test_export_keys_change_with_date(self):
+        import lambda_function
+
+        export_types = (lambda_function.EXPORT_TYPE_LIST, lambda_function.EXPORT_TYPE_CHECKINS)
+        keys = []
+        for today in (date(2019, 3, 1), date(2019, 3, 2)):
+            with mock.patch('lambda_function.date') as mock_date:
+                mock_date.today.return_value = today
+                keys.append([lambda_function.export_cache_key('digest', kind, 'List') for kind in export_types])
+        self.assertNotEqual(keys[0][0], keys[1][0])
+        self.assertNotEqual(keys[0][1], keys[1][1])  # The calendar draws a boundary for March from the 2nd
+
+    def test_pruned_at_most_once_per_interval(self):
+        with TemporaryDirectory() as directory:
+            cache = FileResultCache(directory, prune_interval_seconds=60)
+            with mock.patch('result_cache.FileResultCache.entries', autospec=True,
+                            side_effect=FileResultCache.entries) as entries:
+                cache.put('first', {'weekly': 'x'})
+                FileResultCache(directory, prune_interval_seconds=60).put('second', {'weekly': 'x'})
+                with mock.patch('result_cache.time', return_value=time() + 61):
+                    cache.put('third', {'weekly': 'x'})
+
+            self.assertEqual(entries.call_count, 2)
+            self.assertEqual(len(os.listdir(directory)), 3)
+
+
+class CheckinSummaryTests(unittest.TestCase):
+    checkins = [
+        make_checkin(created_at='2018-12-30 19:00:00', comment='[pint]', rating_score=4),
+        make_checkin(created_at='2018-12-30 21:00:00', beer_abv=0, rating_score='3.5'),
+        make_checkin(created_at='2018-12-31 20:00:00', serving_type='', beer_type=''),
+        make_checkin(created_at='2019-01-16 20:00:00', serving_type='Can', brewery_country='United States'),
+    ]
+
+    def test_weekly_summary(self):
+        weekly = {}
+        build_checkin_summaries(self.checkins, weekly=weekly)
+        self.assertEqual(sorted(weekly), ['2018-W52', '2019-W01', '2019-W02', '2019-W03'])
+        self.assertEqual(weekly['2018-W52']['drinks'], 2)
+        self.assertEqual(weekly['2018-W52']['beverage_ml'], 568 + 284)
+        self.assertEqual(weekly['2018-W52']['dry_days'], 6)
+        self.assertEqual(weekly['2019-W01']['estimated'], '**')
+        self.assertEqual(weekly['2019-W02']['dry_days'], 7)
+
+    @unittest.skipIf(np is None, 'NumPy not installed')
+    def test_vectorized_summary_matches(self):
+        outputs = []
+        for vectorized in (False, True):
+            daily, weekly = {}, {}
+            build_checkin_summaries(self.checkins, daily=daily, weekly=weekly, vectorized=vectorized)
+            output = StringIO()
+            write_daily_summary(daily, output)
+            write_weekly_summary(weekly, output)
+            outputs.append(output.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_sharded_summary_matches(self):
+        checkins = self.checkins + [
+            make_checkin(created_at='2019-01-16 21:00:00', venue_country='United States', rating_score=3.25),
+            make_checkin(created_at='2019-01-17 20:00:00', venue_country='', comment='[pint]', rating_score=4.5),
+            make_checkin(created_at='2019-01-17 22:00:00', venue_country='', serving_type='Cask'),
+        ]
+        summaries = []
+        for sharded in (False, True):
+            daily, weekly, styles, breweries = {}, {}, {}, {}
+            if sharded:
+                build_sharded_summaries(checkins, daily, weekly, styles, breweries, workers=2, shard_size=2)
+            else:
+                build_checkin_summaries(checkins, daily, weekly, styles, breweries)
+            summaries.append((daily, weekly, styles, breweries))
+        self.assertEqual(summaries[0], summaries[1])
+        self.assertEqual(summaries[1][0]['2019-01-17']['beverage_ml'], 473 + 473)  # US region carried into shard
+
+    def test_sharded_summary_matches_with_finer_ratings(self):
+        checkins = [
+            make_checkin(created_at='2019-02-%02d 20:00:00' % (1 + n), rating_score=round(0.1 + 0.37 * n, 2))
+            for n in range(24)
+        ]
+        summaries = []
+        reports = []
+        for sharded in (False, True):
+            styles, breweries = {}, {}
+            if sharded:
+                build_sharded_summaries(checkins, {}, None, styles, breweries, workers=2, shard_size=5)
+            else:
+                build_checkin_summaries(checkins, {}, None, styles, breweries)
+            summaries.append(deepcopy((styles, breweries)))
+            output = StringIO()
+            write_styles_summary(styles, output)
+            write_breweries_summary(breweries, output)
+            reports.append(output.getvalue())
+        self.assertEqual(summaries[0], summaries[1])
+        self.assertEqual(reports[0], reports[1])
+        self.assertEqual(summaries[0][0]['IPA']['total_score'], 104.52)
+
+    def test_filtered_reports_match_filtered_list(self):
+        # Checkins filtered out must not set the region that later checkins' measures are read with
+        checkins = [
+            make_checkin(checkin_id=1, created_at='2019-03-01 20:00:00', venue_country='United States'),
+            make_checkin(checkin_id=2, created_at='2019-03-02 20:00:00', brewery_name='Hop Co', venue_country=''),
+            make_checkin(checkin_id=3, created_at='2019-03-04 20:00:00', venue_country='England'),
+            make_checkin(checkin_id=4, created_at='2019-03-05 20:00:00', brewery_name='Hop Co', venue_country=''),
+            make_checkin(checkin_id=5, created_at='2019-03-12 20:00:00', venue_country='United States'),
+            make_checkin(checkin_id=6, created_at='2019-03-13 20:00:00', brewery_name='Hop Co', venue_country=''),
+        ]
+        filters = ['brewery_name~Hop']
+        daily, weekly = {}, {}
+        build_checkin_summaries(filter_source_data(filters, checkins), daily, weekly)
+        self.assertEqual(daily['2019-03-02']['beverage_ml'], 284)
+        expected = StringIO(), StringIO()
+        write_daily_summary(daily, expected[0])
+        write_weekly_summary(weekly, expected[1])
+
+        with TemporaryDirectory() as directory:
+            state_path = os.path.join(directory, 'state.json')
+            for state, workers in ((None, None), (None, 2), (state_path, None)):
+                args = argparse.Namespace(filter=filters, state=state, workers=workers, vectorized=False)
+                if state:
+                    build_reports(checkins[:3], args, {})
+                outputs = {'daily': StringIO(), 'weekly': StringIO()}
+                build_reports(iter(checkins), args, outputs)
+                self.assertEqual(outputs['daily'].getvalue(), expected[0].getvalue(), (state, workers))
+                self.assertEqual(outputs['weekly'].getvalue(), expected[1].getvalue(), (state, workers))
+
+
+class SummaryStateTests(unittest.TestCase):
+    checkins = [
+        make_checkin(checkin_id=10 + n, created_at='2019-01-%02d 20:00:00' % (1 + n // 2), rating_score=3 + n % 3)
+        for n in range(12)
+    ]
+
+    def test_incremental_update_matches_full_build(self):
+        daily, styles, breweries = {}, {}, {}
+        build_checkin_summaries(self.checkins, daily, styles=styles, breweries=breweries)
+
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'state.json')
+            for end in (5, 9, 12):
+                state = SummaryState.load(path)
+                state.update(self.checkins[:end])
+                state.save(path)
+
+            state = SummaryState.load(path)
+            self.assertEqual(state.update(self.checkins), 0)
+            self.assertEqual((state.daily, state.styles, state.breweries), (daily, styles, breweries))
+            self.assertEqual(state.last_checkin_id, 21)
+
+            self.assertEqual(SummaryState.load(path, ['venue_name=Home']).daily, {})
+
+
+class DailyGridTests(unittest.TestCase):
+    def test_native_backend_writes_same_svg_as_svgwrite(self):
+        daily_count = {'2018-12-%02d' % day: day / 3 for day in range(1, 32)}
+        daily_count.update({'2020-01-01': 0, '2020-02-29': 4.25})
+        written = []
+        for backend in SVG_BACKENDS:
+            buffer = StringIO()
+            draw_daily_count_image(daily_count, True, 'Daily <units> & "drinks"', backend=backend).write(buffer, True)
+            written.append(buffer.getvalue())
+
+        self.assertEqual(svg_elements(written[0]), svg_elements(written[1]))
+        if sys.version_info >= (3, 8):  # Before then, svgwrite sorts attributes and spaces out the stylesheet
+            self.assertEqual(written[0], written[1])
+        self.assertIn('<title>Dec 3: 1.0</title>', written[0])
+
+    def test_compact_output_equivalent(self):
+        daily_count = {'2019-03-%02d' % day: day / 2 for day in range(1, 29)}
+        full = parseString(draw_daily_count_image(daily_count, True, 'Daily units').getvalue())
+        compact_svg = draw_daily_count_image(daily_count, True, 'Daily units', palette_steps=4,
+                                             compact=True).getvalue()
+        compact = parseString(gzip.decompress(gzip_svg(compact_svg)))
+
+        self.assertNotIn('\n', compact_svg)
+        self.assertIn('rect.p3{fill:#aa2200}', compact_svg)
+        full_rects, compact_rects = full.getElementsByTagName('rect'), compact.getElementsByTagName('rect')
+        self.assertEqual([(r.getAttribute('x'), r.getAttribute('y')) for r in full_rects],
+                         [(r.getAttribute('x'), r.getAttribute('y')) for r in compact_rects])
+        classes = [r.getAttribute('class') for r in compact_rects if r.getAttribute('class')]
+        self.assertEqual((len(classes), classes[0], classes[-1]), (28, 'p0', 'p3'))
+        self.assertEqual(len(compact_svg), len(compact_svg.encode('utf-8')))
+
+    def test_year_skeletons_reused(self):
+        clear_fragment_cache()
+        daily_count = {'2019-03-02': 2, '2021-07-04': 5}
+        first, second = StringIO(), StringIO()
+        draw_daily_count_image(daily_count, False).write(first)
+        with mock.patch('svg_calendar.daily_grid.draw_year_labels') as draw_year_labels:
+            draw_daily_count_image(daily_count, False).write(second)
+
+        draw_year_labels.assert_not_called()
+        self.assertEqual(first.getvalue(), second.getvalue())
+        self.assertEqual(months_started(2021, date(2021, 7, 1)), 6)
+        self.assertEqual(months_started(2021, date(2021, 7, 2)), 7)
+
+    def test_all_measures_drawn_as_separately(self):
+        daily_summary = {'2019-12-%02d' % day: {'units': day / 4, 'drinks': day % 5, 'average': 3 + day / 40}
+                         for day in range(1, 32)}
+        daily_summary['2020-01-01'] = {'units': 2, 'drinks': 1}
+        with mock.patch('svg_calendar.daily_grid.date_squares', wraps=date_squares) as squares:
+            images = build_daily_visualisation_images(daily_summary, MEASURES, True)
+
+        squares.assert_called_once()
+        for measure in MEASURES:
+            self.assertEqual(images[measure].getvalue(True),
+                             build_daily_visualisation_image(daily_summary, measure, True).getvalue(True))
+
+    def test_measure_without_values_skipped(self):
+        daily_summary = {'2019-12-%02d' % day: {'units': day / 4, 'drinks': day % 5} for day in range(1, 32)}
+        with self.assertLogs('daily_visualisation', 'WARNING') as logs:
+            images = build_daily_visualisation_images(daily_summary, MEASURES, True)
+
+        self.assertEqual(list(images), ['units', 'drinks'])
+        self.assertIn('Skipping average calendar', logs.output[0])
+        self.assertEqual(images['units'].getvalue(True),
+                         build_daily_visualisation_image(daily_summary, 'units', True).getvalue(True))
+
 
 if __name__ == '__main__':
     unittest.main()
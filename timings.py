@@ -0,0 +1,320 @@
+"""
+Lightweight timing of processing stages, for finding where the time goes in a run
+
+Spans are recorded into the active Profile, if there is one. With none active, `span` returns a shared no-op context
+manager and `iterate` returns its iterable untouched, so instrumented code costs next to nothing in normal use.
+
+A profile can also trace memory allocation with tracemalloc, recording each span's peak and retained allocation.
+This slows processing considerably, so is only done when asked for. Peaks are process-wide, so are only meaningful
+for spans that don't run concurrently with others, and need tracemalloc.reset_peak() from Python 3.9; on earlier
+versions only retained allocation is recorded.
+"""
+import json
+import tracemalloc
+from contextlib import contextmanager
+from threading import Lock, local
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+
+PEAK_PER_STAGE = hasattr(tracemalloc, 'reset_peak')
+
+
+class Profile:
+    """
+    Durations and call counts of named stages, in the order each stage first completed, plus row counts
+
+    If tracing memory, each stage also records:
+        peak_bytes: the most memory allocated at any point during the stage, if PEAK_PER_STAGE
+        peak_increase_bytes: how far that peak rose above the allocation when the stage started, if PEAK_PER_STAGE
+        retained_bytes: memory allocated by the stage and still held when it ended
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.started = perf_counter()
+        self.elapsed = None  # type: Optional[float]
+        self.stages = {}  # type: Dict[str, Dict[str, Any]]
+        self.counts = {}  # type: Dict[str, int]
+        self.lock = Lock()
+        self.trace_memory = trace_memory
+        self.started_tracing = False
+        self.memory_stacks = local()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def finish(self) -> None:
+        """
+        Stop the clock, and memory tracing if this profile started it
+        """
+        if self.elapsed is None:
+            self.elapsed = perf_counter() - self.started
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def total_seconds(self) -> float:
+        """
+        Time from the start of the profile to when it finished, or until now if it hasn't
+
+        Returns:
+            float
+        """
+        return perf_counter() - self.started if self.elapsed is None else self.elapsed
+
+    def enter_memory(self) -> None:
+        """
+        Start measuring memory for a span, folding the peak so far into that of any enclosing span
+        """
+        stack = self.memory_stacks.__dict__.setdefault('stack', [])
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        if PEAK_PER_STAGE:
+            tracemalloc.reset_peak()  # type: ignore  # Only exists from Python 3.9
+        stack.append({'start': current, 'peak': current})
+
+    def exit_memory(self, stage: str) -> None:
+        """
+        Finish measuring memory for a span, and record it against its stage
+
+        Args:
+            stage: Stage name
+        """
+        stack = self.memory_stacks.stack
+        frame = stack.pop()
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(frame['peak'], peak)
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+
+        with self.lock:
+            memory = self.stages[stage]
+            if PEAK_PER_STAGE:
+                memory['peak_bytes'] = max(memory.get('peak_bytes', 0), peak)
+                memory['peak_increase_bytes'] = max(memory.get('peak_increase_bytes', 0), peak - frame['start'])
+            memory['retained_bytes'] = memory.get('retained_bytes', 0) + current - frame['start']
+
+    def add(self, stage: str, seconds: float, calls: int = 1) -> None:
+        """
+        Add time to a stage
+
+        Args:
+            stage: Stage name
+            seconds: Duration
+            calls: Number of times the stage was entered
+        """
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = {'seconds': 0.0, 'calls': 0}
+            self.stages[stage]['seconds'] += seconds
+            self.stages[stage]['calls'] += calls
+
+    def count(self, name: str, value: int) -> None:
+        """
+        Add to a row count
+
+        Args:
+            name: Name of count, eg 'checkins'
+            value: Number to add
+        """
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def as_dict(self) -> dict:
+        """
+        Summarise the profile for structured logging
+
+        Returns:
+            dict of total seconds, seconds by stage and counts
+        """
+        summary = {
+            'total_seconds': round(self.total_seconds(), 6),
+            'stages': {name: round(stage['seconds'], 6) for name, stage in self.stages.items()},
+            'counts': dict(self.counts),
+        }
+        if self.trace_memory:
+            summary['memory'] = {
+                name: {key: value for key, value in stage.items() if key.endswith('_bytes')}
+                for name, stage in self.stages.items() if 'retained_bytes' in stage
+            }
+        return summary
+
+    def report(self) -> str:
+        """
+        Format the profile as a table for humans. Stages may nest, so need not add up to the total
+
+        Returns:
+            str
+        """
+        total = self.total_seconds()
+        heading = '%-32s %10s %7s %6s' % ('stage', 'seconds', '%', 'calls')
+        if self.trace_memory:
+            heading += ' %10s %10s %10s' % ('peak MB', '+peak MB', 'kept MB')
+        lines = [heading]
+        for name, stage in self.stages.items():
+            line = '%-32s %10.4f %6.1f%% %6d' % (
+                name, stage['seconds'], 100 * stage['seconds'] / total if total else 0, stage['calls']
+            )
+            if 'peak_bytes' in stage:
+                line += ' %10.2f %10.2f' % (stage['peak_bytes'] / MEGABYTE, stage['peak_increase_bytes'] / MEGABYTE)
+            elif 'retained_bytes' in stage:
+                line += ' %10s %10s' % ('-', '-')
+            if 'retained_bytes' in stage:
+                line += ' %10.2f' % (stage['retained_bytes'] / MEGABYTE)
+            lines.append(line)
+        lines.append('%-32s %10.4f' % ('total', total))
+        for name, value in self.counts.items():
+            lines.append('%-32s %10d' % (name, value))
+        return '\n'.join(lines)
+
+
+MEGABYTE = 1024 * 1024
+
+_active = None  # type: Optional[Profile]
+
+
+class _NullSpan:
+    """
+    Reusable do-nothing context manager, returned by `span` when no profile is active
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def start_profile(trace_memory: bool = False) -> Profile:
+    """
+    Start recording spans into a new profile, replacing any already active
+
+    Args:
+        trace_memory: Also record memory allocation by each span
+
+    Returns:
+        Profile
+    """
+    global _active  # pylint: disable=W0603
+    if _active is not None:
+        _active.finish()
+    _active = Profile(trace_memory)
+    return _active
+
+
+def stop_profile() -> Optional[Profile]:
+    """
+    Stop recording spans
+
+    Returns:
+        The profile that was active, if any
+    """
+    global _active  # pylint: disable=W0603
+    profile, _active = _active, None
+    if profile is not None:
+        profile.finish()
+    return profile
+
+
+@contextmanager
+def _span(profile: Profile, stage: str) -> Iterator[None]:
+    if profile.trace_memory:
+        profile.enter_memory()
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(stage, perf_counter() - started)
+        if profile.trace_memory:
+            profile.exit_memory(stage)
+
+
+def span(stage: str):
+    """
+    Time a block of code as a stage of the active profile, eg `with span('aggregate'): ...`
+
+    Args:
+        stage: Stage name
+
+    Returns:
+        Context manager
+    """
+    profile = _active
+    return NULL_SPAN if profile is None else _span(profile, stage)
+
+
+def count(name: str, value: int) -> None:
+    """
+    Add to a row count of the active profile, if any
+
+    Args:
+        name: Name of count, eg 'checkins'
+        value: Number to add
+    """
+    profile = _active
+    if profile is not None:
+        profile.count(name, value)
+
+
+def iterate(stage: str, iterable: Iterable, count_name: str = None, weigh: Callable[[Any], int] = None) -> Iterable:
+    """
+    Time the fetching of each item from a lazy iterable as a stage, eg decoding an export as it streams in
+
+    Memory isn't traced for these stages, as fetching is interleaved with the work of the stage consuming the items.
+
+    Args:
+        stage: Stage name
+        iterable: Iterable to wrap
+        count_name: Name to count items under, if any
+        weigh: Function giving the amount each item adds to the count, eg `len` to count bytes; 1 if not set
+
+    Returns:
+        Iterable yielding the same items
+    """
+    profile = _active
+    if profile is None:
+        return iterable
+
+    def timed():
+        iterator = iter(iterable)
+        seconds = 0.0
+        items = 0
+        total = 0
+        try:
+            while True:
+                started = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += perf_counter() - started
+                items += 1
+                if weigh is not None:
+                    total += weigh(item)
+                yield item
+        finally:
+            profile.add(stage, seconds, calls=items)
+            if count_name:
+                profile.count(count_name, items if weigh is None else total)
+
+    return timed()
+
+
+def log_line(profile: Profile, **fields) -> str:
+    """
+    Format a profile as a single JSON log line, with any extra fields given
+
+    Args:
+        profile: Profile to log
+        **fields: Extra top-level fields, eg the export type
+
+    Returns:
+        str
+    """
+    entry = {'beerbot_profile': dict(fields, **profile.as_dict())}
+    return json.dumps(entry, sort_keys=True)
@@ -1,8 +1,10 @@
+import codecs
 import csv
+import json
 import re
-from typing import Optional, TextIO
+from typing import Iterable, Iterator, Optional, TextIO, Union
 
-import requests
+import timings
 
 
 try:
@@ -10,6 +12,9 @@ try:
 except ImportError:
     config = {}
 
+EXPORT_CHUNK_SIZE = 64 * 1024
+JSON_WHITESPACE = ' \t\r\n'
+
 
 def file_contents(file_path: str, verbose: bool = False) -> Optional[str]:
     """
@@ -28,20 +33,143 @@ def file_contents(file_path: str, verbose: bool = False) -> Optional[str]:
     if match:
         if verbose:
             print("Fetch from URL")
+        import requests  # Only loaded when needed, as it's slow to import
         r = requests.get(file_path)
         contents = r.content.decode('utf-8')
     else:
         if verbose:
             print("Load from file")
         with open(file_path, 'r') as f:
-            lines = f.readlines()
-            if lines:
-                contents = ''.join(lines)
+            contents = f.read()
 
     if contents and verbose:
         print(contents)
 
-    return ''.join(contents)
+    return contents
+
+
+def export_chunks(file_path: str, verbose: bool = False) -> Iterator[bytes]:
+    """
+    Read a file or URL as a series of byte chunks, without holding the whole file in memory
+
+    Args:
+        file_path: Path or URL of source file
+        verbose: Whether to display debug notes
+
+    Returns:
+        Iterator of bytes chunks
+    """
+    match = re.match('^(f|ht)tp(s?)://', file_path)
+    if match:
+        if verbose:
+            print("Stream from URL")
+        import requests  # Only loaded when needed, as it's slow to import
+        with requests.get(file_path, stream=True) as r:
+            for chunk in r.iter_content(EXPORT_CHUNK_SIZE):
+                timings.count('input bytes', len(chunk))
+                yield chunk
+    else:
+        if verbose:
+            print("Stream from file")
+        with open(file_path, 'rb') as f:
+            chunk = f.read(EXPORT_CHUNK_SIZE)
+            while chunk:
+                timings.count('input bytes', len(chunk))
+                yield chunk
+                chunk = f.read(EXPORT_CHUNK_SIZE)
+
+
+def iter_export_items(file_path: str, verbose: bool = False) -> Iterator:
+    """
+    Load checkins or list items one at a time from an Untappd JSON export file or URL
+
+    Args:
+        file_path: Path or URL of source file
+        verbose: Whether to display debug notes
+
+    Returns:
+        Iterator of decoded export items
+    """
+    return iter_json_array(export_chunks(file_path, verbose))
+
+
+def iter_json_array(chunks: Iterable[Union[str, bytes]]) -> Iterator:
+    """
+    Incrementally decode a JSON array, yielding each item as soon as it has been read
+
+    Only the item currently being decoded is buffered, so memory use does not grow with the size of the array.
+    Any iterable of text or UTF-8 byte chunks can be used as the source, eg a file, a streamed HTTP response
+    (`response.iter_content()`) or an S3 body (`body.iter_chunks()`).
+
+    Args:
+        chunks: Iterable of str or bytes chunks making up the JSON document
+
+    Returns:
+        Iterator of decoded array items
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunk_iterator = iter(chunks)
+    buffer = ''
+    position = 0
+    state = 'start'  # start -> first|item -> separator -> (item ->) end
+
+    def read_more() -> bool:
+        nonlocal buffer, position
+        chunk = next(chunk_iterator, None)
+        if chunk is None:
+            text_decoder.decode(b'', final=True)  # Raise if the source ended mid-character
+            return False
+        buffer = buffer[position:] + (text_decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+        position = 0
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position] in JSON_WHITESPACE:
+            position += 1
+
+        if position == len(buffer):
+            if read_more():
+                continue
+            break
+
+        if state == 'start':
+            if buffer[position] != '[':
+                raise Exception('Export data is not a JSON list')
+            position += 1
+            state = 'first'
+
+        elif state in ('first', 'item'):
+            if state == 'first' and buffer[position] == ']':
+                position += 1
+                state = 'end'
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if read_more():
+                    continue
+                raise
+            if end == len(buffer) and read_more():
+                continue  # A number may have been cut off at the chunk boundary, so decode it again
+            position = end
+            state = 'separator'
+            yield item
+
+        elif state == 'separator':
+            if buffer[position] == ',':
+                state = 'item'
+            elif buffer[position] == ']':
+                state = 'end'
+            else:
+                raise Exception('Unexpected "%s" between export items' % buffer[position])
+            position += 1
+
+        else:
+            raise Exception('Unexpected data after end of export')
+
+    if state != 'end':
+        raise Exception('Export data ended unexpectedly')
 
 
 def build_csv_from_list(stocklist: list, stocklist_output: TextIO):
@@ -69,100 +197,63 @@ def debug_print(message):
         print(message)
 
 
-def filter_source_data(filter_strings: list, source_data: list, verbose: bool = False):
+def parse_filter_rule(filter_string: str) -> dict:
+    """
+    Split a filter rule string such as "venue_name=The Red Lion" into its parts
+
+    Args:
+        filter_string: The rule in simple string format
+
+    Returns:
+        dict of key, comparator, value
+    """
+    parts = re.match(r'(?P<key>[a-z_]+)(?P<comparator>[=<>~?^])(?P<value>.*)', filter_string)
+
+    if parts is None:
+        raise Exception('Failed to parse rule: ' + filter_string)
+
+    return parts.groupdict()
+
+
+def filter_source_data(filter_strings: list, source_data, verbose: bool = False):
     """
     Filter source data according to a list of rules
     Args:
         filter_strings: The rules in simple string format
-        source_data: JSON source data from export
+        source_data: JSON source data from export, or a CheckinTable
         verbose: Emit debug if true
 
     Returns:
-        Filtered source data
-    """
-
-    ruleset = []
-
-    def create_test_function(key: str, comparator: str, value: str):
-
-        def test_empty(row):
-            result = row[key] is None or row[key] == ''
-            if verbose:
-                print('Check [%s] (%s) is None: %s' % (key, row[key], repr(result)))
-            return result
-
-        def test_equals(row):
-            result = row[key] is not None and row[key].lower() == value.lower()
-            if verbose:
-                print('Check [%s] (%s) = %s: %s' % (key, row[key], value, repr(result)))
-            return result
-
-        def test_greater(row):
-            result = row[key] is not None and row[key].lower() > value.lower()
-            if verbose:
-                print('Check [%s] (%s) > %s: %s' % (key, row[key], value, repr(result)))
-            return result
-
-        def test_less(row):
-            result = row[key] is not None and row[key].lower() < value.lower()
-            if verbose:
-                print('Check [%s] (%s) < %s: %s' % (key, row[key], value, repr(result)))
-            return result
-
-        def test_starts(row):
-            result = row[key] is not None and row[key].lower().find(value.lower()) == 0
-            if verbose:
-                print('Check [%s] (%s) ~ %s: %s' % (key, row[key], value, repr(result)))
-            return result
-
-        def test_not(row):
-            result = row[key] is None or row[key].lower() != value.lower()
-            if verbose:
-                print('Check [%s] (%s) ^ %s: %s' % (key, row[key], value, repr(result)))
-            return result
-
-        def test_contains(row):
-            result = value.lower() in row[key].lower() if key in row and row[key] else False
-            if verbose:
-                print('Check [%s] (%s) ^ %s: %s' % (key, row[key], value, repr(result)))
-            return result
-
-        if comparator == '=':
-            if value == '':
-                test = test_empty
-            else:
-                test = test_equals
-        elif comparator == '>':
-            test = test_greater
-        elif comparator == '<':
-            test = test_less
-        elif comparator == '~':
-            test = test_starts
-        elif comparator == '?':
-            test = test_contains
-        elif comparator == '^':
-            test = test_not
-        else:
-            raise Exception('Bad rule comparator ' + comparator)
+        Filtered source data, as a list or CheckinTable to match the source
+    """
+    # Imported here so that scripts which never filter, such as stock_check, needn't load the checkin code
+    from checkin_table import CheckinTable
+    from filter_query import compile_rules, filter_rows, filter_table
 
-        return test
+    rules = compile_rules([parse_filter_rule(filter_string) for filter_string in filter_strings], verbose)
 
-    for filter_string in filter_strings:
-        parts = re.match(r'(?P<key>[a-z_]+)(?P<comparator>[=<>~?^])(?P<value>.*)', filter_string)
+    if isinstance(source_data, CheckinTable):
+        return filter_table(rules, source_data)
 
-        if parts is None:
-            raise Exception('Failed to parse rule: ' + filter_string)
+    return filter_rows(rules, source_data)
 
-        ruleset.append({'test': create_test_function(**parts.groupdict()), 'filter': parts.groupdict()})
 
-    def input_filter(row):
-        result = True
-        for rule in ruleset:
-            if not rule['test'](row):
-                result = False
-                break
+def iter_filtered_items(filter_strings: list, source_items: Iterable[dict]) -> Iterator[dict]:
+    """
+    Filter checkins as they are read, before they are added to a CheckinTable
+
+    Each checkin's measure is read with the region left by the checkins before it, so reports must filter checkins
+    first, as a CheckinTable that is filtered afterwards keeps the measures read with the rows it dropped.
 
-        return result
+    Args:
+        filter_strings: The rules in simple string format
+        source_items: JSON source data from export, as a list or an iterator of checkins
+
+    Returns:
+        Iterator of checkins passing all rules
+    """
+    # Loaded only when filtering
+    from filter_query import compile_rules, iter_filtered_rows
 
-    source_data = [row for row in source_data if input_filter(row)]
-    return source_data
+    rules = compile_rules([parse_filter_rule(filter_string) for filter_string in filter_strings])
+    return iter_filtered_rows(rules, source_items)
@@ -0,0 +1,162 @@
+"""
+NumPy implementation of the daily and weekly checkin summaries, grouping all checkins in bulk
+
+Produces dicts identical to imbibed.build_daily_summary and imbibed.build_weekly_summary, down to int/float types
+and order of floating-point addition, so that the CSV output is the same.
+NumPy is optional: it is only needed if this path is selected.
+"""
+from datetime import date
+from typing import Any, Dict
+
+from checkin_table import ESTIMATE_FLAGS, CheckinTable
+
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore
+
+
+def column_array(column):
+    """
+    View a CheckinTable array column as a NumPy array without copying
+
+    Args:
+        column: array.array
+
+    Returns:
+        numpy.ndarray
+    """
+    return np.frombuffer(column, dtype=column.typecode) if len(column) else np.array([], dtype=column.typecode)
+
+
+def build_vectorized_summaries(table: CheckinTable, daily: dict, weekly: dict = None) -> None:
+    """
+    Gather daily data and optionally roll it up into ISO weeks, as imbibed.build_checkin_summaries does
+
+    Args:
+        table: Checkins
+        daily: dict to populate with daily data, by ISO date
+        weekly: dict to populate with weekly data
+    """
+    # pylint: disable=R0914
+    if np is None:
+        raise Exception('NumPy must be installed to build vectorized summaries')
+
+    days = column_array(table.day)
+    rating = column_array(table.rating)
+    measure = column_array(table.measure_ml)
+    abv = column_array(table.abv)
+    estimated = column_array(table.estimated)
+
+    # Group by day, keeping days in order of first appearance as the row-by-row summary would
+    unique_days, first_rows, day_index = np.unique(days, return_index=True, return_inverse=True)
+    appearance = np.argsort(first_rows, kind='stable')
+    day_count = len(unique_days)
+
+    is_rated = ~np.isnan(rating)
+    has_measure = measure != 0
+    has_alcohol = has_measure & (abv != 0)
+    alcohol_volume = np.where(has_alcohol, measure.astype(float) * abv / 100, 0.0)
+
+    # bincount adds weights in row order, so float totals match sequential addition exactly
+    drinks = np.bincount(day_index, minlength=day_count)
+    rated = np.bincount(day_index, weights=is_rated, minlength=day_count).astype(int)
+    total_score = np.bincount(day_index, weights=np.where(is_rated, rating, 0.0), minlength=day_count)
+    measured = np.bincount(day_index, weights=has_measure, minlength=day_count)
+    with_alcohol = np.bincount(day_index, weights=has_alcohol, minlength=day_count)
+    beverage_ml = np.bincount(day_index, weights=measure, minlength=day_count)
+    alcohol_ml = np.bincount(day_index, weights=alcohol_volume, minlength=day_count)
+    units = np.bincount(day_index, weights=alcohol_volume / 10, minlength=day_count)
+
+    # The day's estimate flag is that of its last checkin with any flag
+    flagged_rows = np.flatnonzero(estimated)
+    last_flagged = np.full(day_count, -1)
+    np.maximum.at(last_flagged, day_index[flagged_rows], flagged_rows)
+    day_flags = np.where(last_flagged >= 0, estimated[last_flagged], 0)
+
+    for k in appearance.tolist():
+        day_summary = {
+            'drinks': int(drinks[k]),
+            'estimated': ESTIMATE_FLAGS[day_flags[k]],
+            'rated': int(rated[k]),
+            'total_score': float(total_score[k]),
+        }  # type: Dict[str, Any]
+        if rated[k]:
+            day_summary['average'] = day_summary['total_score'] / day_summary['rated']
+        if measured[k]:
+            day_summary['beverage_ml'] = int(beverage_ml[k])
+            # Without any ABV, these totals are never added to and remain the integer 0
+            day_summary['alcohol_ml'] = float(alcohol_ml[k]) if with_alcohol[k] else 0
+            day_summary['units'] = float(units[k]) if with_alcohol[k] else 0
+        daily[date.fromordinal(int(unique_days[k])).isoformat()] = day_summary
+
+    if weekly is None:
+        return
+
+    # Weeks are summed over days in order of first appearance, as the row-by-row rollup does
+    ordered_days = unique_days[appearance]
+    mondays = ordered_days - (ordered_days - 1) % 7  # Ordinal 1 is a Monday
+    unique_mondays, week_index = np.unique(mondays, return_inverse=True)
+    week_count = len(unique_mondays)
+
+    def weekly_total(values, dtype=float):
+        return np.bincount(week_index, weights=values[appearance], minlength=week_count).astype(dtype)
+
+    week_drinks = weekly_total(drinks, int)
+    week_rated = weekly_total(rated, int)
+    week_total_score = weekly_total(total_score)
+    week_beverage_ml = weekly_total(beverage_ml, int)
+    week_alcohol_ml = weekly_total(alcohol_ml)
+    week_units = weekly_total(units)
+    week_with_alcohol = weekly_total(with_alcohol)
+    week_days = np.bincount(week_index, minlength=week_count)
+    week_flags = np.zeros(week_count, dtype=int)
+    np.maximum.at(week_flags, week_index, day_flags[appearance])
+
+    for k, monday in enumerate(unique_mondays.tolist()):
+        week_key = iso_week_key(monday)
+        weekly[week_key] = {
+            'week': week_key,
+            'commencing': date.fromordinal(monday).isoformat(),
+            'drinks': int(week_drinks[k]),
+            'units': float(week_units[k]) if week_with_alcohol[k] else 0,
+            'alcohol_ml': float(week_alcohol_ml[k]) if week_with_alcohol[k] else 0,
+            'beverage_ml': int(week_beverage_ml[k]),
+            'estimated': ESTIMATE_FLAGS[week_flags[k]],
+            'rated': int(week_rated[k]),
+            'total_score': float(week_total_score[k]),
+            'dry_days': 7 - int(week_days[k]),
+        }
+
+    # Fill in blank weeks between the first and last checkins
+    first_day = int(days[0])
+    last_day = int(days[-1])
+    for monday in range(first_day - (first_day - 1) % 7, last_day + 1, 7):
+        week_key = iso_week_key(monday)
+        if week_key not in weekly:
+            weekly[week_key] = {
+                'week': week_key,
+                'commencing': date.fromordinal(monday).isoformat(),
+                'drinks': 0,
+                'units': 0,
+                'alcohol_ml': 0,
+                'beverage_ml': 0,
+                'estimated': '',
+                'rated': 0,
+                'total_score': 0.0,
+                'dry_days': 7,
+            }
+
+
+def iso_week_key(monday_ordinal: int) -> str:
+    """
+    Format the ISO week starting on the given Monday as used for weekly keys, eg 2019-W01
+
+    Args:
+        monday_ordinal: Date ordinal of the Monday
+
+    Returns:
+        str
+    """
+    return '%d-W%02d' % date.fromordinal(monday_ordinal).isocalendar()[0:2]